@@ -0,0 +1,4 @@
+import time
+
+# when the API's modules started importing, for the startup report on /health
+IMPORT_STARTED = time.perf_counter()
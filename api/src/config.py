@@ -1,6 +1,7 @@
 import os
 import sys
-from datetime import date
+import tempfile
+from datetime import date, datetime
 from typing import Literal
 
 from dotenv import load_dotenv
@@ -11,6 +12,9 @@ from typing import Any
 
 # ---Pydantic models---
 DistType = Literal["normal", "t", "skewt", "ged"]
+EngineType = Literal["arch", "vectorized"]
+# aic/bic of the full-sample fit or oos: -2 x out-of-sample log-likelihood
+CriterionType = Literal["aic", "bic", "oos"]
 
 
 class GarchParams(BaseModel):
@@ -19,12 +23,48 @@ class GarchParams(BaseModel):
     dist: DistType
 
 
+class ModelSelection(BaseModel):
+    params: GarchParams
+    criterion: CriterionType
+    score: float
+    # candidates fitted, the rest of the grid was pruned
+    candidates: int
+    selected_at: datetime
+
+
 class PredictionResponse(BaseModel):
     symbol: str
     target_date: date
     model: str
     model_params: GarchParams
+    # volatility over the next `horizon` days, term_structure over 1..horizon
     predicted_volatility: float
+    horizon: int = 1
+    term_structure: list[float]
+    # set with auto=true
+    selection: ModelSelection | None = None
+
+
+# /predict/batch
+class BatchPredictionRequest(BaseModel):
+    symbols: list[str]
+    configs: list[GarchParams]
+    force_refit: bool = False
+    engine: EngineType = "arch"
+    horizon: int = 1
+
+
+class BatchItemResult(BaseModel):
+    symbol: str
+    model_params: GarchParams
+    target_date: date | None = None
+    predicted_volatility: float | None = None
+    term_structure: list[float] | None = None
+    error: str | None = None
+
+
+class BatchPredictionResponse(BaseModel):
+    results: list[BatchItemResult]
 
 
 # /report
@@ -38,12 +78,117 @@ class ReportResponse(BaseModel):
 DEFAULT_P = 1
 DEFAULT_Q = 1
 DEFAULT_DIST = "skewt"
+DEFAULT_ENGINE: EngineType = "arch"
+DEFAULT_CRITERION: CriterionType = "bic"
 
 
 # ENV VARIABLES
 load_dotenv()
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 DB_URL = os.getenv("DB_URL")
+# connection pool per API worker and engine (sync for the writer and the
+# scripts, request for request threads, async for /report), timeouts and the
+# retry deadline in seconds
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_STATEMENT_TIMEOUT = float(os.getenv("DB_STATEMENT_TIMEOUT", "10"))
+DB_RETRY_DEADLINE = float(os.getenv("DB_RETRY_DEADLINE", "30"))
+# DB calls on request threads (stored predictions, fitted parameters and
+# model selections) use their own pool with DB_REQUEST_TIMEOUT as pool and
+# statement timeout and are skipped for DB_BREAKER_COOLDOWN seconds after a
+# failure, requests refit instead of waiting on a slow DB
+DB_REQUEST_TIMEOUT = float(os.getenv("DB_REQUEST_TIMEOUT", "2"))
+DB_BREAKER_COOLDOWN = float(os.getenv("DB_BREAKER_COOLDOWN", "30"))
+FIT_WORKERS = int(os.getenv("FIT_WORKERS") or os.cpu_count() or 1)
+# fits waiting for a free worker before requests are rejected with 503
+FIT_QUEUE_DEPTH = int(os.getenv("FIT_QUEUE_DEPTH") or 2 * FIT_WORKERS)
+FIT_RETRY_AFTER = int(os.getenv("FIT_RETRY_AFTER", "5"))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))
+# max series per vectorized fit job, a batch is split over the fit workers
+VECTORIZED_CHUNK = int(os.getenv("VECTORIZED_CHUNK", "64"))
+# tickers downloaded and fitted together by /predict/stream
+STREAM_CHUNK = int(os.getenv("STREAM_CHUNK", "25"))
+
+# price history cache (seconds / MB)
+PRICE_CACHE_DIR = os.getenv(
+    "PRICE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "fvf_price_cache")
+)
+PRICE_CACHE_TTL = int(os.getenv("PRICE_CACHE_TTL", "900"))
+PRICE_CACHE_MAX_STALE = int(os.getenv("PRICE_CACHE_MAX_STALE", "259200"))
+PRICE_CACHE_MAX_MB = int(os.getenv("PRICE_CACHE_MAX_MB", "256"))
+
+# source of price histories: finfetcher (yfinance), synthetic (a seeded GARCH
+# path per ticker, no network) or recorded (<ticker>.parquet files in
+# DATA_SOURCE_DIR, e.g. a copy of PRICE_CACHE_DIR). offline sources add
+# DATA_SOURCE_LATENCY seconds per fetch to stand in for the download
+DATA_SOURCE = os.getenv("DATA_SOURCE", "finfetcher")
+DATA_SOURCE_DIR = os.getenv("DATA_SOURCE_DIR", "")
+DATA_SOURCE_LATENCY = float(os.getenv("DATA_SOURCE_LATENCY", "0"))
+
+# filter-only updates between full re-estimations: refit after this many new
+# observations (0 = always refit) or when the squared standardized residuals
+# since the last fit drift more than FILTER_DRIFT_Z standard errors from 1
+FILTER_REFIT_OBS = int(os.getenv("FILTER_REFIT_OBS", "5"))
+FILTER_DRIFT_Z = float(os.getenv("FILTER_DRIFT_Z", "3.0"))
+
+# multi-day forecasts: max horizon (business days) and simulated paths for
+# the aggregated volatility of skewt/ged, simulated in chunks of paths
+MAX_HORIZON = int(os.getenv("MAX_HORIZON", "60"))
+FORECAST_PATHS = int(os.getenv("FORECAST_PATHS", "10000"))
+FORECAST_CHUNK = int(os.getenv("FORECAST_CHUNK", "1000"))
+
+# read-through cache of stored predictions (entries / seconds)
+PRED_CACHE_SIZE = int(os.getenv("PRED_CACHE_SIZE", "4096"))
+PRED_CACHE_TTL = int(os.getenv("PRED_CACHE_TTL", "900"))
+
+# write-behind of predictions: flush every WRITE_BATCH_SIZE rows or
+# WRITE_FLUSH_INTERVAL seconds, rows not written are kept in PRED_SPILL_PATH
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "500"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "1.0"))
+WRITE_QUEUE_MAX = int(os.getenv("WRITE_QUEUE_MAX", "100000"))
+PRED_SPILL_PATH = os.getenv(
+    "PRED_SPILL_PATH", os.path.join(tempfile.gettempdir(), "fvf_pred_spill.jsonl")
+)
+
+# automatic model selection (/predict?auto=true): candidate grid as
+# "p,q,dist;p,q,dist;...", last SELECTION_HOLDOUT returns held out for the
+# oos criterion, seconds until a ticker's selection is redone. the simplest
+# candidate of every distribution is fitted first, distributions more than
+# SELECTION_PRUNE_MARGIN criterion points behind the best are not expanded
+SELECTION_GRID = [
+    GarchParams(p=int(p), q=int(q), dist=dist)  # type: ignore
+    for p, q, dist in (
+        c.split(",")
+        for c in os.getenv(
+            "SELECTION_GRID",
+            ";".join(
+                f"{p},{q},{dist}"
+                for dist in ["normal", "t", "skewt", "ged"]
+                for p in [1, 2]
+                for q in [1, 2]
+            ),
+        ).split(";")
+    )
+]
+SELECTION_HOLDOUT = int(os.getenv("SELECTION_HOLDOUT", "250"))
+SELECTION_TTL = int(os.getenv("SELECTION_TTL", "604800"))
+SELECTION_PRUNE_MARGIN = float(os.getenv("SELECTION_PRUNE_MARGIN", "10"))
+SELECTION_CACHE_SIZE = int(os.getenv("SELECTION_CACHE_SIZE", "1024"))
+# seconds a search waits for each free fit slot, then the request is
+# rejected with 503 like any other fit
+SELECTION_QUEUE_TIMEOUT = float(os.getenv("SELECTION_QUEUE_TIMEOUT", "10"))
+
+# seconds between checks of the report data version, /report is rendered
+# once per version and served from memory (or 304) until it changes
+REPORT_VERSION_TTL = int(os.getenv("REPORT_VERSION_TTL", "30"))
+
+# warmup at startup (WARMUP=0 disables it): every fit worker fits a small
+# synthetic series per distribution before taking requests, in the
+# background, /health answers while it runs
+WARMUP = os.getenv("WARMUP", "1") == "1"
+WARMUP_OBS = int(os.getenv("WARMUP_OBS", "500"))
 
 
 # LOGGING
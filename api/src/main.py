@@ -1,26 +1,95 @@
+import time
+from datetime import date
+
 from pandas.errors import EmptyDataError
 import uvicorn
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
-from finfetcher import DataFetcher
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 from loguru import logger
-from numpy import log as nplog
 
 from src.config import (
+    DEFAULT_CRITERION,
     DEFAULT_DIST,
+    DEFAULT_ENGINE,
     DEFAULT_P,
     DEFAULT_Q,
+    FIT_RETRY_AFTER,
+    BatchPredictionRequest,
+    BatchPredictionResponse,
+    CriterionType,
     DistType,
+    EngineType,
     GarchParams,
+    ModelSelection,
     PredictionResponse,
     ReportResponse,
     setup_logging,
 )
-from src.services.database import create_preds_table, get_error_data, store_preds
-from src.services.garch_model import get_garch_pred
-from src.services.report import get_metrics_data
+from src.services.database import (
+    dispose_engines,
+    get_pool_stats,
+    get_report_metrics,
+    migrate_schema,
+)
+from src.services.executor import (
+    FitQueueFull,
+    get_fit_executor_stats,
+    shutdown_fit_executor,
+)
+from src.services.forecast import get_term_structure
+from src.services.metrics import (
+    DB_ERRORS,
+    REQUEST_SECONDS,
+    render_metrics,
+    stage_timer,
+)
+from src.services.model_selection import (
+    get_cached_selection,
+    get_selection_stats,
+    select_model,
+)
+from src.services.prediction import (
+    check_history,
+    check_horizon,
+    fit_model,
+    get_fit_flight_stats,
+    get_log_returns,
+    get_pred_cache_stats,
+    get_stored_pred,
+    run_batch,
+    save_fit_params,
+    store_term_structures,
+    stream_batch,
+)
+from src.services.price_cache import get_cache_stats, get_cached_target_date
+from src.services.report import (
+    etag_matches,
+    get_cached_report,
+    get_data_version,
+    get_etag,
+    get_metrics_data,
+    get_report_cache_stats,
+    render_report,
+)
+from src.services.warmup import (
+    get_startup_stats,
+    record_imported,
+    record_request,
+    start_warmup,
+)
+from src.services.writer import (
+    get_pred_writer,
+    get_pred_writer_stats,
+    shutdown_pred_writer,
+)
 
 setup_logging()
+record_imported()
 
 api = FastAPI(title="Financial Volatility Forecaster")
 
@@ -29,9 +98,58 @@ api = FastAPI(title="Financial Volatility Forecaster")
 @api.on_event("startup")
 def startup_db():
     try:
-        create_preds_table()
+        migrate_schema()
     except Exception:
-        logger.exception("DB error while creating table 'garch_preds'")
+        logger.exception("DB error while migrating the database schema")
+
+    # replays predictions spilled by a previous run
+    get_pred_writer()
+
+
+@api.on_event("startup")
+def startup_warmup():
+    # runs in the background, /health answers while the fit workers warm up
+    start_warmup()
+
+
+@api.on_event("shutdown")
+def shutdown_pool():
+    shutdown_fit_executor()
+    # queued predictions are flushed (or spilled) before the DB engines close
+    shutdown_pred_writer()
+
+
+@api.on_event("shutdown")
+async def shutdown_db():
+    await dispose_engines()
+
+
+@api.middleware("http")
+async def observe_request(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # the route template, not the raw path: one series per endpoint
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    elapsed = time.perf_counter() - start
+    REQUEST_SECONDS.observe(
+        elapsed,
+        method=request.method,
+        path=path,
+        status=str(response.status_code),
+    )
+    record_request(path, elapsed)
+    return response
+
+
+@api.exception_handler(FitQueueFull)
+def fit_queue_full_handler(request: Request, exc: FitQueueFull):
+    logger.warning(f"Rejected {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(FIT_RETRY_AFTER)},
+    )
 
 
 @api.get("/")
@@ -41,87 +159,203 @@ def read_root():
 
 @api.get("/predict/{symbol}", response_model=PredictionResponse)
 def predict(
-    symbol: str, p: int = DEFAULT_P, q: int = DEFAULT_Q, dist: DistType = DEFAULT_DIST
+    symbol: str,
+    p: int = DEFAULT_P,
+    q: int = DEFAULT_Q,
+    dist: DistType = DEFAULT_DIST,
+    force_refit: bool = False,
+    engine: EngineType = DEFAULT_ENGINE,
+    horizon: int = 1,
+    auto: bool = False,
+    criterion: CriterionType = DEFAULT_CRITERION,
 ):
+    check_horizon(horizon)
     garch_params = GarchParams(p=p, q=q, dist=dist)
-    n_params = garch_params.p + garch_params.q + 2
-    model = None
+    model = "garch"
+    symbol = symbol.upper()
 
-    fetcher = DataFetcher(symbol)
+    # auto: p, q and dist of the ticker's selected model, searched again after
+    # SELECTION_TTL or with force_refit
+    selection = None
+    if auto and not force_refit:
+        selection = get_cached_selection(symbol, criterion)
+        if selection is not None:
+            garch_params = selection.params
 
-    try:
-        data = fetcher.get_data()
-        target_date = fetcher.target_date
+    # read-through: a prediction for the current target date was already made
+    if not force_refit and (not auto or selection is not None):
+        target_date = get_cached_target_date(symbol)
+        if target_date is not None:
+            stored_preds = get_stored_pred(symbol, target_date, garch_params, horizon)
+            if stored_preds is not None:
+                return get_prediction_response(
+                    symbol, target_date, model, garch_params, stored_preds, selection
+                )
 
-        logger.info(
-            f"Got data from FinFetcher, rows: {data.count()}, target_date: {target_date}"
-        )
+    symbol, log_returns, target_date = get_log_returns(symbol)
 
-    except Exception as e:
-        logger.exception("Error while getting data from FinFetcher")
-        raise HTTPException(status_code=500, detail=str(e))
+    if auto and selection is None:
+        selection = select_model(symbol, log_returns, criterion)
+        if selection is None:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Model selection failed for {symbol} (check logs)",
+            )
+        garch_params = selection.params
 
-    if data is None or target_date is None:
-        raise HTTPException(
-            status_code=404, detail=f"Data for symbol '{symbol}' not found"
-        )
+    if not force_refit:
+        stored_preds = get_stored_pred(symbol, target_date, garch_params, horizon)
+        if stored_preds is not None:
+            return get_prediction_response(
+                symbol, target_date, model, garch_params, stored_preds, selection
+            )
 
-    log_returns = nplog((data["Close"] / data["Close"].shift(1)).dropna()) * 100
+    check_history(log_returns, garch_params)
 
-    if len(log_returns) < n_params * 50:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Not enough data points for GARCH({garch_params.p},{garch_params.q}) inference"
-            f"Required: {n_params * 50}, Available: {len(log_returns)}",
-        )
-
-    garch_pred = get_garch_pred(log_returns, params=garch_params)
-    model = "garch"
-    if garch_pred is None:
+    garch_fit, shared = fit_model(
+        symbol, log_returns, garch_params, target_date, engine, force_refit
+    )
+    if garch_fit is None:
         raise HTTPException(
             status_code=500,
             detail=f"GARCH model failed to converge for {symbol} (check logs)",
         )
+    term_structure = get_term_structure(garch_fit, garch_params, horizon)
 
-    try:
-        store_preds(
-            ticker=symbol, pred=garch_pred, target_date=target_date, params=garch_params
+    # a coalesced request got the leader's fit, which the leader stores
+    if not shared:
+        store_term_structures([(symbol, term_structure, target_date, garch_params)])
+        save_fit_params(
+            [(symbol, garch_params, garch_fit, log_returns.index[-1], target_date)]
         )
-    except Exception:
-        logger.exception(f"DB error while storing {symbol} predictions")
 
+    return get_prediction_response(
+        symbol, target_date, model, garch_params, term_structure, selection
+    )
+
+
+def get_prediction_response(
+    symbol: str,
+    target_date: date,
+    model: str,
+    params: GarchParams,
+    term_structure: list[float],
+    selection: ModelSelection | None = None,
+) -> dict:
     return {
-        "symbol": fetcher.symbol,
+        "symbol": symbol,
         "target_date": target_date,
         "model": model,
-        "model_params": garch_params,
-        "predicted_volatility": garch_pred,
+        "model_params": params,
+        "predicted_volatility": term_structure[-1],
+        "horizon": len(term_structure),
+        "term_structure": term_structure,
+        "selection": selection,
     }
 
 
+@api.post("/predict/batch", response_model=BatchPredictionResponse)
+def predict_batch(request: BatchPredictionRequest):
+    if not request.symbols or not request.configs:
+        raise HTTPException(
+            status_code=422, detail="At least one symbol and one config is required"
+        )
+    check_horizon(request.horizon)
+
+    results = run_batch(
+        request.symbols,
+        request.configs,
+        request.force_refit,
+        request.engine,
+        request.horizon,
+    )
+    failed = sum(r.error is not None for r in results)
+    logger.info(f"Batch finished: {len(results) - failed} ok, {failed} failed")
+
+    return {"results": results}
+
+
+@api.post("/predict/stream")
+async def predict_stream(
+    request: BatchPredictionRequest, accept: str | None = Header(default=None)
+):
+    # /predict/batch streamed as NDJSON (or server-sent events with
+    # Accept: text/event-stream), one result per line as its fit finishes.
+    # a client disconnecting stops the remaining fits
+    if not request.symbols or not request.configs:
+        raise HTTPException(
+            status_code=422, detail="At least one symbol and one config is required"
+        )
+    check_horizon(request.horizon)
+    sse = accept is not None and "text/event-stream" in accept
+
+    async def body():
+        n, failed = 0, 0
+        async for item in stream_batch(
+            request.symbols,
+            request.configs,
+            request.force_refit,
+            request.engine,
+            request.horizon,
+        ):
+            n += 1
+            failed += item.error is not None
+            data = item.model_dump_json()
+            yield f"event: result\ndata: {data}\n\n" if sse else data + "\n"
+
+        logger.info(f"Batch stream finished: {n - failed} ok, {failed} failed")
+        if sse:
+            yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
 @api.get("/report", response_model=ReportResponse)
-def get_report_data():
+async def get_report_data(if_none_match: str | None = Header(default=None)):
+    # the report only changes with new evaluations: rendered once per data
+    # version, unchanged reports are answered with 304 via the ETag. async,
+    # waiting for a slow DB does not hold a thread of the /predict pool
+    version = await get_data_version()
+    headers = {}
+    if version is not None:
+        headers = {"ETag": get_etag(version), "Cache-Control": "no-cache"}
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+        body = get_cached_report(version)
+        if body is not None:
+            return Response(body, media_type="application/json", headers=headers)
+
     try:
-        error_data = get_error_data()
+        with stage_timer("report_query"):
+            metrics_date, metrics_ticker = await get_report_metrics()
     except EmptyDataError:
         raise HTTPException(
             status_code=501, detail="Retrieved error data is None or empty"
         )
     except Exception:
+        DB_ERRORS.inc(operation="get_report_metrics")
         raise HTTPException(status_code=501, detail="Connection to DB failed")
 
-    error_data["error_rel"] = error_data["error_rel"] * 100
-
     try:
-        metrics_df_date, metrics_df_ticker, worst_df_tickers = get_metrics_data(
-            error_data
-        )
+        with stage_timer("report_render"):
+            metrics_df_date, metrics_df_ticker, worst_df_tickers = get_metrics_data(
+                metrics_date, metrics_ticker
+            )
 
-        return {
-            "metrics_date": metrics_df_date.to_dict(orient="records"),
-            "metrics_ticker": metrics_df_ticker.to_dict(orient="records"),
-            "worst_tickers": worst_df_tickers.to_dict(orient="records"),
-        }
+            body = render_report(
+                version,
+                {
+                    "metrics_date": metrics_df_date.to_dict(orient="records"),
+                    "metrics_ticker": metrics_df_ticker.to_dict(orient="records"),
+                    "worst_tickers": worst_df_tickers.to_dict(orient="records"),
+                },
+            )
+        return Response(body, media_type="application/json", headers=headers)
 
     except Exception as e:
         logger.exception(f"Critical error while processing report data: {e}")
@@ -130,7 +364,32 @@ def get_report_data():
 
 @api.get("/health", status_code=200)
 def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "price_cache": get_cache_stats(),
+        "pred_cache": get_pred_cache_stats(),
+        "report_cache": get_report_cache_stats(),
+        "db_pool": get_pool_stats(),
+        "pred_writer": get_pred_writer_stats(),
+        "fit_coalescing": get_fit_flight_stats(),
+        "fit_executor": get_fit_executor_stats(),
+        "model_selection": get_selection_stats(),
+        "startup": get_startup_stats(),
+    }
+
+
+@api.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus text format, per API worker process
+    body = render_metrics(
+        {
+            "price": get_cache_stats(),
+            "pred": get_pred_cache_stats(),
+            "report": get_report_cache_stats(),
+            "model_selection": get_selection_stats(),
+        }
+    )
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
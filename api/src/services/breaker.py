@@ -0,0 +1,50 @@
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+
+# after a failure calls are skipped for `cooldown` seconds, then one call
+# probes whether the dependency is back, the others are skipped until it ends
+class CircuitBreaker:
+    def __init__(self, cooldown: float) -> None:
+        self.cooldown = cooldown
+        self.trips = 0
+        self.skipped = 0
+        self._open_until: float | None = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._open_until is None:
+                return True
+
+            now = time.monotonic()
+            if now < self._open_until:
+                self.skipped += 1
+                return False
+
+            self._open_until = now + self.cooldown
+            return True
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                if self._open_until is None:
+                    self.trips += 1
+                self._open_until = time.monotonic() + self.cooldown
+            raise
+
+        with self._lock:
+            self._open_until = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open": self._open_until is not None,
+                "trips": self.trips,
+                "skipped": self.skipped,
+            }
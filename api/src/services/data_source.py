@@ -0,0 +1,124 @@
+import math
+import os
+import random
+import re
+import time
+import zlib
+from datetime import date, timedelta
+from typing import TYPE_CHECKING
+
+import pandas as pd
+from pandas.tseries.offsets import BusinessDay
+
+from src.config import DATA_SOURCE, DATA_SOURCE_DIR, DATA_SOURCE_LATENCY
+
+if TYPE_CHECKING:
+    from finfetcher import DataFetcher
+
+# stand-ins for finfetcher's DataFetcher with its interface (symbol,
+# target_date, get_data(period)), they serve histories without network so
+# the API can be load tested offline
+SYNTHETIC_START = date(2020, 1, 1)
+PERIOD_DAYS = {"d": 1, "mo": 30, "y": 365}
+
+
+class SyntheticFetcher:
+    def __init__(self, symbol: str) -> None:
+        self.symbol = symbol.upper()
+        self.target_date: date | None = None
+
+    def get_data(self, period: str = "4y", interval: str = "1d") -> pd.DataFrame:
+        time.sleep(DATA_SOURCE_LATENCY)
+
+        # the path of a ticker only depends on its symbol, a refresh on a
+        # later day extends it and the overlapping closes agree
+        end = (pd.Timestamp(date.today()) - BusinessDay(1)).date()
+        index = pd.bdate_range(SYNTHETIC_START, end)
+        data = simulate_prices(self.symbol, len(index))
+        data.index = index.date  # type: ignore
+
+        self.target_date = (end + BusinessDay(1)).date()
+        return data[data.index > end - timedelta(days=get_period_days(period))]
+
+
+class RecordedFetcher:
+    def __init__(self, symbol: str) -> None:
+        self.symbol = symbol.upper()
+        self.target_date: date | None = None
+
+    def get_data(self, period: str = "4y", interval: str = "1d") -> pd.DataFrame:
+        time.sleep(DATA_SOURCE_LATENCY)
+
+        name = re.sub(r"[^\w.-]", "_", self.symbol) + ".parquet"
+        path = os.path.join(DATA_SOURCE_DIR, name)
+        if not os.path.exists(path):
+            raise ValueError(f"No recorded history for {self.symbol} in {path}")
+
+        # a recording ends on its own last day, the period counts back from it
+        data = pd.read_parquet(path)
+        data.index = pd.to_datetime(data.index).date  # type: ignore
+        end = data.index[-1]
+        self.target_date = (pd.Timestamp(end) + BusinessDay(1)).date()
+        return data[data.index > end - timedelta(days=get_period_days(period))]
+
+
+FETCHERS = {"synthetic": SyntheticFetcher, "recorded": RecordedFetcher}
+
+if DATA_SOURCE not in ["finfetcher", *FETCHERS]:
+    raise ValueError(
+        f"Unknown DATA_SOURCE '{DATA_SOURCE}', expected finfetcher, synthetic or recorded"
+    )
+if DATA_SOURCE == "recorded" and not os.path.isdir(DATA_SOURCE_DIR):
+    raise ValueError(f"DATA_SOURCE_DIR '{DATA_SOURCE_DIR}' is not a directory")
+
+
+def get_fetcher(symbol: str) -> "DataFetcher | SyntheticFetcher | RecordedFetcher":
+    if DATA_SOURCE == "finfetcher":
+        # yfinance is imported on the first download, not at API startup
+        from finfetcher import DataFetcher
+
+        return DataFetcher(symbol)
+
+    return FETCHERS[DATA_SOURCE](symbol)
+
+
+def get_period_days(period: str) -> int:
+    # yfinance periods as calendar days, "5d", "3mo", "4y"
+    match = re.fullmatch(r"(\d+)(d|mo|y)", period)
+    if match is None:
+        raise ValueError(f"Unsupported period '{period}'")
+    return int(match.group(1)) * PERIOD_DAYS[match.group(2)]
+
+
+def simulate_prices(symbol: str, n: int) -> pd.DataFrame:
+    # daily OHLCV from a GARCH(1,1) with t innovations, parameters and path
+    # seeded by the symbol
+    rng = random.Random(zlib.crc32(symbol.encode()))
+    alpha = rng.uniform(0.03, 0.12)
+    beta = rng.uniform(0.85, 0.97 - alpha)
+    # unconditional variance of daily percent returns
+    var = rng.uniform(1, 4)
+    omega = var * (1 - alpha - beta)
+    nu = rng.uniform(4, 10)
+    scale = math.sqrt((nu - 2) / nu)
+
+    close, closes = rng.uniform(20, 500), []
+    for _ in range(n):
+        # t draw as normal / sqrt(chi2 / nu), unit variance
+        z = rng.gauss(0, 1) / math.sqrt(rng.gammavariate(nu / 2, 2) / nu) * scale
+        r = math.sqrt(var) * z
+        close *= math.exp(r / 100)
+        closes.append(close)
+        var = omega + alpha * r**2 + beta * var
+
+    spread = [abs(rng.gauss(0, 0.005)) * c for c in closes]
+    opens = [closes[0], *closes[:-1]]
+    return pd.DataFrame(
+        {
+            "Open": opens,
+            "High": [max(o, c) + s for o, c, s in zip(opens, closes, spread)],
+            "Low": [min(o, c) - s for o, c, s in zip(opens, closes, spread)],
+            "Close": closes,
+            "Volume": [float(rng.randint(100_000, 10_000_000)) for _ in closes],
+        }
+    )
@@ -1,121 +1,453 @@
-import time
+import asyncio
+import math
+from collections.abc import Awaitable, Callable
 from datetime import date, datetime, timezone
+from typing import TypeVar
 
 import pandas as pd
 from pandas.errors import EmptyDataError
 from loguru import logger
-from sqlalchemy import create_engine, text
+from sqlalchemy import Engine, create_engine, make_url, text
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import QueuePool
 
-from src.config import DB_URL, GarchParams
+from src.config import (
+    DB_BREAKER_COOLDOWN,
+    DB_CONNECT_TIMEOUT,
+    DB_MAX_OVERFLOW,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_REQUEST_TIMEOUT,
+    DB_RETRY_DEADLINE,
+    DB_STATEMENT_TIMEOUT,
+    DB_URL,
+    GarchParams,
+)
+from src.services.breaker import CircuitBreaker
+from src.services.migrations import run_migrations
+
+T = TypeVar("T")
+
+# bounded pools: a slow or unreachable DB fails requests after the pool,
+# connect and statement timeouts instead of piling up waiting threads
+POOL_ARGS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+}
+# unreachable DB, dropped connection, statement or pool timeout
+TRANSIENT_DB_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError, OSError)
+
+engine: Engine | None = None
+async_engine: AsyncEngine | None = None
+# DB calls on request threads wait at most DB_REQUEST_TIMEOUT for a
+# connection and for their statement (libpq connects in whole seconds, at
+# least 2), after a failure they are skipped for DB_BREAKER_COOLDOWN seconds
+request_engine: Engine | None = None
+request_breaker = CircuitBreaker(DB_BREAKER_COOLDOWN)
+
+
+def get_connect_args(connect_timeout: int, statement_timeout: float) -> dict:
+    return {
+        "connect_timeout": connect_timeout,
+        "options": f"-c statement_timeout={int(statement_timeout * 1000)}",
+    }
 
-engine = None
 
 if DB_URL:
     try:
-        engine = create_engine(DB_URL)
+        engine = create_engine(
+            DB_URL,
+            connect_args=get_connect_args(DB_CONNECT_TIMEOUT, DB_STATEMENT_TIMEOUT),
+            **POOL_ARGS,
+        )
+        request_engine = create_engine(
+            DB_URL,
+            connect_args=get_connect_args(
+                max(2, math.ceil(DB_REQUEST_TIMEOUT)), DB_REQUEST_TIMEOUT
+            ),
+            **POOL_ARGS | {"pool_timeout": DB_REQUEST_TIMEOUT},
+        )
     except Exception:
         logger.exception(f"Invalid DB_URL format. Length of DB_URL: {len(DB_URL)}")
         engine = None
+        request_engine = None
+
+    try:
+        # asyncpg takes sslmode as its ssl argument
+        url = make_url(DB_URL).set(drivername="postgresql+asyncpg")
+        ssl = url.query.get("sslmode")
+        async_engine = create_async_engine(
+            url.difference_update_query(["sslmode"]),
+            connect_args={
+                "timeout": DB_CONNECT_TIMEOUT,
+                "server_settings": {
+                    "statement_timeout": str(int(DB_STATEMENT_TIMEOUT * 1000))
+                },
+                **({"ssl": ssl} if ssl else {}),
+            },
+            **POOL_ARGS,
+        )
+    except Exception:
+        logger.exception("Could not create async DB engine")
+        async_engine = None
 else:
     logger.warning("DB_URL is not set. Database features will be disabled.")
 
 
-def create_preds_table() -> None:
+def migrate_schema() -> None:
     if engine is None:
-        logger.warning("Database not configured, skipping table creation.")
+        logger.warning("Database not configured, skipping schema migrations.")
         return
 
-    sql_create = text("""
-        CREATE TABLE IF NOT EXISTS garch_preds (  
-            id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
-            ticker VARCHAR(10) NOT NULL,
-            execution_time TIMESTAMP DEFAULT NOW(),
-            target_date DATE NOT NULL,
-            model_config VARCHAR(20) NOT NULL,
-            prediction DOUBLE PRECISION NOT NULL,
-            CONSTRAINT unique_pred UNIQUE (ticker, target_date, model_config)
-        );
-    """)
-    with engine.begin() as conn:
-        conn.execute(sql_create)
-        logger.info("Succesfully created table 'garch_preds' or table exists")
+    run_migrations(engine)
+
 
+def get_model_config(params: GarchParams) -> str:
+    return "_".join(str(atr) for atr in vars(params).values())
 
-def store_preds(
-    ticker: str, pred: float, target_date: date, params: GarchParams
+
+def store_preds_bulk(
+    preds: list[tuple[str, float, date, GarchParams, int]],
 ) -> None:
     if engine is None:
-        logger.info(f"Skipping DB save for {ticker} (DB not configured)")
+        logger.info(
+            f"Skipping DB save for {len(preds)} predictions (DB not configured)"
+        )
         return
 
     execution_time = datetime.now(timezone.utc)
-    pred = float(pred)
-    model_config = "_".join(str(atr) for atr in vars(params).values())
 
-    sql_insert = text("""
-        INSERT INTO garch_preds (ticker, target_date, prediction, execution_time, model_config)
-        VALUES (:ticker, :target_date, :prediction, :execution_time, :model_config)
-        ON CONFLICT (ticker, target_date, model_config) 
+    # one multi-row upsert -> one round trip and one commit for the whole batch
+    rows = {}
+    for ticker, pred, target_date, params, horizon in preds:
+        model_config = get_model_config(params)
+        rows[(ticker, target_date, model_config, horizon)] = {
+            "ticker": ticker,
+            "target_date": target_date,
+            "prediction": float(pred),
+            "execution_time": execution_time,
+            "model_config": model_config,
+            "horizon": horizon,
+        }
+
+    values, bind_params = get_values_clause(list(rows.values()))
+    sql_insert = text(f"""
+        INSERT INTO garch_preds (ticker, target_date, prediction, execution_time, model_config, horizon)
+        VALUES {values}
+        ON CONFLICT (ticker, target_date, model_config, horizon) 
         DO UPDATE SET 
             prediction = EXCLUDED.prediction,
             execution_time = EXCLUDED.execution_time;
     """)
     with engine.begin() as conn:
+        conn.execute(sql_insert, bind_params)
+
+    if len(rows) == 1:
+        ticker, target_date, _, _ = next(iter(rows))
+        logger.info(f"Stored prediction for {ticker} (Target: {target_date})")
+    else:
+        logger.info(f"Stored {len(rows)} predictions in one batch")
+
+
+def get_stored_preds(
+    keys: list[tuple[str, date, GarchParams]], horizon: int = 1
+) -> dict[tuple[str, date, str, int], float]:
+    if request_engine is None or not keys or not request_breaker.allow():
+        return {}
+
+    tickers = list({ticker for ticker, _, _ in keys})
+    target_dates = list({target_date for _, target_date, _ in keys})
+    configs = list({get_model_config(params) for _, _, params in keys})
+
+    sql_extract = text("""
+        SELECT ticker, target_date, model_config, horizon, prediction
+        FROM garch_preds
+        WHERE ticker = ANY(:tickers)
+            AND target_date = ANY(:target_dates)
+            AND model_config = ANY(:configs)
+            AND horizon <= :horizon
+    """)
+    with request_breaker.guard(), request_engine.connect() as conn:
+        rows = conn.execute(
+            sql_extract,
+            {
+                "tickers": tickers,
+                "target_dates": target_dates,
+                "configs": configs,
+                "horizon": horizon,
+            },
+        ).fetchall()
+
+    return {
+        (row.ticker, row.target_date, row.model_config, row.horizon): row.prediction
+        for row in rows
+    }
+
+
+def get_values_clause(rows: list[dict]) -> tuple[str, dict]:
+    values = []
+    bind_params = {}
+    for i, row in enumerate(rows):
+        values.append("(" + ", ".join(f":{col}_{i}" for col in row) + ")")
+        bind_params |= {f"{col}_{i}": val for col, val in row.items()}
+
+    return ", ".join(values), bind_params
+
+
+def get_fit_params(
+    keys: list[tuple[str, GarchParams]],
+) -> dict[tuple[str, str], dict]:
+    if request_engine is None or not keys or not request_breaker.allow():
+        return {}
+
+    tickers = list({ticker for ticker, _ in keys})
+    configs = list({get_model_config(params) for _, params in keys})
+
+    sql_extract = text("""
+        SELECT ticker, model_config, params, resid2, sigma2, last_obs_date,
+            n_updates, z2_sum
+        FROM garch_fit_params
+        WHERE ticker = ANY(:tickers) AND model_config = ANY(:configs)
+    """)
+    with request_breaker.guard(), request_engine.connect() as conn:
+        rows = conn.execute(
+            sql_extract, {"tickers": tickers, "configs": configs}
+        ).fetchall()
+
+    return {
+        (row.ticker, row.model_config): {
+            "params": list(row.params),
+            "resid2": row.resid2,
+            "sigma2": row.sigma2,
+            "last_obs_date": row.last_obs_date,
+            "n_updates": row.n_updates,
+            "z2_sum": row.z2_sum,
+        }
+        for row in rows
+    }
+
+
+def store_fit_params(
+    fits: list[tuple[str, GarchParams, dict, date]],
+) -> None:
+    if request_engine is None or not fits or not request_breaker.allow():
+        return
+
+    updated_at = datetime.now(timezone.utc)
+    rows = {}
+    for ticker, params, state, target_date in fits:
+        model_config = get_model_config(params)
+        rows[(ticker, model_config)] = {
+            "ticker": ticker,
+            "model_config": model_config,
+            "params": [float(x) for x in state["params"]],
+            "resid2": [float(x) for x in state["resid2"]],
+            "sigma2": [float(x) for x in state["sigma2"]],
+            "last_obs_date": state["last_obs_date"],
+            "n_updates": int(state["n_updates"]),
+            "z2_sum": float(state["z2_sum"]),
+            "target_date": target_date,
+            "updated_at": updated_at,
+        }
+
+    values, bind_params = get_values_clause(list(rows.values()))
+    sql_insert = text(f"""
+        INSERT INTO garch_fit_params (ticker, model_config, params, resid2, sigma2,
+            last_obs_date, n_updates, z2_sum, target_date, updated_at)
+        VALUES {values}
+        ON CONFLICT (ticker, model_config)
+        DO UPDATE SET
+            params = EXCLUDED.params,
+            resid2 = EXCLUDED.resid2,
+            sigma2 = EXCLUDED.sigma2,
+            last_obs_date = EXCLUDED.last_obs_date,
+            n_updates = EXCLUDED.n_updates,
+            z2_sum = EXCLUDED.z2_sum,
+            target_date = EXCLUDED.target_date,
+            updated_at = EXCLUDED.updated_at;
+    """)
+    with request_breaker.guard(), request_engine.begin() as conn:
+        conn.execute(sql_insert, bind_params)
+        logger.debug(f"Stored fitted parameters and state for {len(rows)} models")
+
+
+def get_model_selection(ticker: str, criterion: str) -> dict | None:
+    if request_engine is None or not request_breaker.allow():
+        return None
+
+    sql_extract = text("""
+        SELECT model_config, score, candidates, selected_at
+        FROM garch_model_selection
+        WHERE ticker = :ticker AND criterion = :criterion
+    """)
+    with request_breaker.guard(), request_engine.connect() as conn:
+        row = conn.execute(
+            sql_extract, {"ticker": ticker, "criterion": criterion}
+        ).fetchone()
+
+    if row is None:
+        return None
+
+    p, q, dist = row.model_config.split("_")
+    return {
+        "params": GarchParams(p=int(p), q=int(q), dist=dist),  # type: ignore
+        "criterion": criterion,
+        "score": row.score,
+        "candidates": row.candidates,
+        "selected_at": row.selected_at,
+    }
+
+
+def store_model_selection(
+    ticker: str,
+    criterion: str,
+    params: GarchParams,
+    score: float,
+    candidates: int,
+    selected_at: datetime,
+) -> None:
+    if request_engine is None or not request_breaker.allow():
+        return
+
+    sql_insert = text("""
+        INSERT INTO garch_model_selection (ticker, criterion, model_config, score,
+            candidates, selected_at)
+        VALUES (:ticker, :criterion, :model_config, :score, :candidates, :selected_at)
+        ON CONFLICT (ticker, criterion)
+        DO UPDATE SET
+            model_config = EXCLUDED.model_config,
+            score = EXCLUDED.score,
+            candidates = EXCLUDED.candidates,
+            selected_at = EXCLUDED.selected_at;
+    """)
+    with request_breaker.guard(), request_engine.begin() as conn:
         conn.execute(
             sql_insert,
             {
                 "ticker": ticker,
-                "target_date": target_date,
-                "execution_time": execution_time,
-                "model_config": model_config,
-                "prediction": pred,
+                "criterion": criterion,
+                "model_config": get_model_config(params),
+                "score": score,
+                "candidates": candidates,
+                "selected_at": selected_at,
             },
         )
-        logger.info(f"Stored prediction for {ticker} (Target: {target_date})")
 
 
-def get_error_data() -> pd.DataFrame:
-    error_df = None
+async def with_retry(fn: Callable[[], Awaitable[T]], what: str) -> T:
+    # exponential backoff until DB_RETRY_DEADLINE, awaiting frees the event
+    # loop for other requests instead of blocking a worker thread. only
+    # connection errors are retried, any other error is raised right away
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DB_RETRY_DEADLINE
+    delay = 0.5
+    attempt = 1
+    while True:
+        try:
+            return await fn()
+        except TRANSIENT_DB_ERRORS as e:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logger.error(f"Giving up on {what} after {attempt} attempts: {e}")
+                raise
+
+            logger.debug(f"Attempt {attempt} of {what} failed: {e}. Retrying...")
+            await asyncio.sleep(min(delay, remaining))
+            delay *= 2
+            attempt += 1
 
-    if engine is None:
+
+async def get_report_version() -> str:
+    # changes whenever scripts/evaluate.py adds evaluations and every day,
+    # since the report window moves with the current date
+    if async_engine is None:
         raise Exception("Could not connect to DB")
 
-    attempts = 10
-    for i in range(attempts):
-        try:
-            sql_extract = text("""
-                SELECT p.ticker, p.target_date, p.model_config, gp.error_abs, gp.error_rel, gp.error_sq, gp.error_raw
-                FROM garch_performance gp 
-                    JOIN garch_preds p
-                    ON gp.prediction_id = p.id
-                WHERE p.target_date < CURRENT_DATE
-                    AND p.target_date >= CURRENT_DATE - INTERVAL '10 days'
-            """)
-
-            with engine.begin() as conn:
-                error_df = pd.read_sql(sql_extract, conn)
-                logger.info("Got performance data for last week from DB")
-                logger.debug(f"Error DF rows: {error_df.count()}")
-
-            if error_df is not None and not error_df.empty:
-                break
-
-            logger.debug(
-                f"Attempt {i + 1}/{attempts}: Could not get data from 'garch_performance' DB. Retrying..."
-            )
-
-        except Exception as e:
-            logger.debug(
-                f"Attempt {i + 1}/{attempts}: Exception fetching data: {e}. Retrying..."
-            )
-
-        if i < attempts - 1:
-            time.sleep(5)
-
-    if error_df is None or error_df.empty:
-        logger.error(
-            "Could not get data from 'garch_performance' DB\nMax attempt reached\nReturning error page"
-        )
-        raise EmptyDataError
+    sql_version = text("""
+        SELECT CURRENT_DATE AS today, COUNT(*) AS n_rows, COALESCE(SUM(n), 0) AS n
+        FROM garch_metrics_ticker
+    """)
+    async with async_engine.connect() as conn:
+        row = (await conn.execute(sql_version)).one()
+
+    return f"{row.today}:{row.n_rows}:{row.n}"
+
+
+async def get_report_metrics() -> tuple[pd.DataFrame, pd.DataFrame]:
+    # error sums per (date, config) and per (ticker, config) of the report
+    # window. the date sums are kept up to date by scripts/evaluate.py, the
+    # ticker sums are added up from the window's evaluations (bounded by the
+    # window, read from the covering date index of garch_performance)
+    db = async_engine
+    if db is None:
+        raise Exception("Could not connect to DB")
+
+    sql_date = text("""
+        SELECT *
+        FROM garch_metrics_date
+        WHERE target_date < CURRENT_DATE
+            AND target_date >= CURRENT_DATE - INTERVAL '10 days'
+    """)
+    sql_ticker = text("""
+        SELECT p.ticker, p.model_config, p.p, p.q, p.dist, COUNT(*) AS n,
+            SUM(e.error_raw) AS sum_error_raw, SUM(e.error_abs) AS sum_error_abs,
+            SUM(e.error_rel) AS sum_error_rel, SUM(e.error_sq) AS sum_error_sq
+        FROM garch_performance e
+            JOIN garch_preds p
+            ON e.prediction_id = p.id
+            AND e.target_date = p.target_date
+        WHERE e.target_date < CURRENT_DATE
+            AND e.target_date >= CURRENT_DATE - INTERVAL '10 days'
+            -- repeated for the partition pruning of garch_preds
+            AND p.target_date < CURRENT_DATE
+            AND p.target_date >= CURRENT_DATE - INTERVAL '10 days'
+        GROUP BY p.ticker, p.model_config, p.p, p.q, p.dist
+    """)
+
+    async def fetch() -> tuple[pd.DataFrame, pd.DataFrame]:
+        async with db.connect() as conn:
+            date_df = await conn.run_sync(lambda c: pd.read_sql(sql_date, c))
+            ticker_df = await conn.run_sync(lambda c: pd.read_sql(sql_ticker, c))
+
+        return date_df, ticker_df
+
+    date_df, ticker_df = await with_retry(fetch, "loading report metrics")
+    logger.info("Got aggregated performance metrics from DB")
+    logger.debug(f"Metrics rows: {len(date_df)} by date, {len(ticker_df)} by ticker")
+
+    # freshly evaluated data may not be aggregated yet, retrying won't help
+    if date_df.empty or ticker_df.empty:
+        raise EmptyDataError("Metrics tables are empty")
+    return date_df, ticker_df
+
+
+async def dispose_engines() -> None:
+    if async_engine is not None:
+        await async_engine.dispose()
+    if engine is not None:
+        engine.dispose()
+    if request_engine is not None:
+        request_engine.dispose()
+
 
-    return error_df
+def get_pool_stats() -> dict:
+    stats: dict = {}
+    engines = (("sync", engine), ("request", request_engine), ("async", async_engine))
+    for name, eng in engines:
+        pool = None if eng is None else eng.pool
+        if isinstance(pool, QueuePool):
+            stats[name] = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                # negative while fewer than pool_size connections are open
+                "overflow": max(pool.overflow(), 0),
+            }
+    if request_engine is not None:
+        stats["request_breaker"] = request_breaker.stats()
+    return stats
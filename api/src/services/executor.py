@@ -0,0 +1,146 @@
+import multiprocessing as mp
+import os
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from loguru import logger
+
+from src.config import FIT_QUEUE_DEPTH, FIT_WORKERS, WARMUP, setup_logging
+from src.services.metrics import forward_metrics, receive_metrics
+
+
+class FitQueueFull(Exception):
+    pass
+
+
+def init_worker(metrics_queue) -> None:
+    setup_logging()
+    if WARMUP:
+        # before forwarding metrics, warmup fits are not reported
+        from src.services.warmup import warm_up_worker
+
+        warm_up_worker()
+    forward_metrics(metrics_queue)
+
+
+class FitExecutor:
+    def __init__(self, max_workers: int, queue_depth: int) -> None:
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        self.rejected = 0
+        self.completed = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        # every submitted fit holds a slot until it finishes: running + queued
+        self._slots = threading.BoundedSemaphore(max_workers + queue_depth)
+        # spawn: forking a process with uvicorn/loguru threads running can deadlock
+        ctx = mp.get_context("spawn")
+        # the workers' fit timings are collected here for /metrics
+        self._metrics_queue = ctx.Queue()
+        self._metrics_receiver = receive_metrics(self._metrics_queue)
+        self._pool = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=ctx,
+            initializer=init_worker,
+            initargs=(self._metrics_queue,),
+        )
+
+    def submit(
+        self, fn: Callable, *args, block: bool = False, timeout: float | None = None
+    ) -> Future:
+        # block waits for a free slot, at most `timeout` seconds if given
+        if not self._slots.acquire(block, timeout if block else None):
+            with self._lock:
+                self.rejected += 1
+            raise FitQueueFull(
+                f"Fit queue is full ({self.max_workers} running, "
+                f"{self.queue_depth} queued)"
+            )
+
+        with self._lock:
+            self._in_flight += 1
+
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._release(None)
+            raise
+
+        future.add_done_callback(self._release)
+        return future
+
+    def start_workers(self) -> list[Future]:
+        # the pool spawns a worker per job while none is idle, a no-op per
+        # worker starts all of them. they take no slots, requests are not
+        # rejected while the workers start and warm up
+        return [self._pool.submit(os.getpid) for _ in range(self.max_workers)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = self._in_flight
+            running = min(in_flight, self.max_workers)
+            return {
+                "workers": self.max_workers,
+                "running": running,
+                "queued": in_flight - running,
+                "queue_depth": self.queue_depth,
+                "utilization": running / self.max_workers,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._metrics_queue.put(None)
+        self._metrics_receiver.join(timeout=5)
+
+    def _release(self, future: Future | None) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            if future is not None:
+                self.completed += 1
+        self._slots.release()
+
+
+_fit_executor: FitExecutor | None = None
+_fit_executor_lock = threading.Lock()
+
+
+def get_fit_executor() -> FitExecutor:
+    global _fit_executor
+
+    with _fit_executor_lock:
+        if _fit_executor is None:
+            _fit_executor = FitExecutor(FIT_WORKERS, FIT_QUEUE_DEPTH)
+            logger.info(
+                f"Started GARCH fit pool with {FIT_WORKERS} workers, "
+                f"queue depth {FIT_QUEUE_DEPTH}"
+            )
+
+    return _fit_executor
+
+
+def get_fit_executor_stats() -> dict:
+    if _fit_executor is None:
+        return {
+            "workers": FIT_WORKERS,
+            "running": 0,
+            "queued": 0,
+            "queue_depth": FIT_QUEUE_DEPTH,
+            "utilization": 0.0,
+            "completed": 0,
+            "rejected": 0,
+        }
+
+    return _fit_executor.stats()
+
+
+def shutdown_fit_executor() -> None:
+    global _fit_executor
+
+    with _fit_executor_lock:
+        if _fit_executor is not None:
+            _fit_executor.shutdown()
+            _fit_executor = None
+            logger.info("GARCH fit pool shut down")
@@ -0,0 +1,84 @@
+import math
+
+import pandas as pd
+from loguru import logger
+
+from src.config import FILTER_DRIFT_Z, FILTER_REFIT_OBS, GarchParams
+from src.services.garch_model import GarchFit, check_sigma
+
+
+def filter_update(
+    state: dict | None, params: GarchParams, log_returns: pd.Series
+) -> GarchFit | None:
+    # rolls the stored variance recursion over the returns after the state's
+    # last observation, None when a full estimation is due instead
+    if state is None or FILTER_REFIT_OBS <= 0:
+        return None
+
+    resid2, sigma2 = state["resid2"], state["sigma2"]
+    last_obs = state["last_obs_date"]
+    if resid2 is None or sigma2 is None or last_obs is None:
+        return None
+    if len(resid2) != params.p or len(sigma2) != params.q:
+        return None
+    if last_obs not in log_returns.index:
+        logger.info(f"Filter state ends at {last_obs}, not in history, refitting")
+        return None
+
+    fit_params = state["params"]
+    mu = fit_params[0]
+    n_updates, z2_sum = state["n_updates"], state["z2_sum"]
+    resid2, sigma2 = list(resid2), list(sigma2)
+
+    for ret in log_returns[log_returns.index > last_obs]:
+        var = one_step_variance(fit_params, params, resid2, sigma2)
+        eps2 = (float(ret) - mu) ** 2
+        z2_sum += eps2 / var
+        n_updates += 1
+        resid2 = resid2[1:] + [eps2]
+        sigma2 = sigma2[1:] + [var]
+
+    if n_updates >= FILTER_REFIT_OBS:
+        logger.info(f"{n_updates} filter updates since the last fit, refitting")
+        return None
+
+    # E[z^2] = 1 under the model, its mean over n updates has sd ~ sqrt(2 / n)
+    if n_updates and abs(z2_sum / n_updates - 1) > FILTER_DRIFT_Z * math.sqrt(
+        2 / n_updates
+    ):
+        logger.info(
+            f"Standardized residuals drifted (mean z^2 {z2_sum / n_updates:.2f} "
+            f"over {n_updates} updates), refitting"
+        )
+        return None
+
+    pred = check_sigma(math.sqrt(one_step_variance(fit_params, params, resid2, sigma2)))
+    if pred is None:
+        return None
+
+    logger.info(f"GARCH prediction updated by filter: {pred:.4f} ({n_updates} updates)")
+    return GarchFit(
+        pred=pred,
+        params=list(fit_params),
+        warm_start=True,
+        resid2=resid2,
+        sigma2=sigma2,
+        n_updates=n_updates,
+        z2_sum=z2_sum,
+    )
+
+
+def one_step_variance(
+    fit_params: list[float],
+    params: GarchParams,
+    resid2: list[float],
+    sigma2: list[float],
+) -> float:
+    # state is oldest first, alpha_1 / beta_1 weight the newest values
+    alphas = fit_params[2 : 2 + params.p]
+    betas = fit_params[2 + params.p : 2 + params.p + params.q]
+    return (
+        fit_params[1]
+        + sum(a * e for a, e in zip(alphas, reversed(resid2)))
+        + sum(b * s for b, s in zip(betas, reversed(sigma2)))
+    )
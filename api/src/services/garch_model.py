@@ -1,11 +1,35 @@
+import time
+from dataclasses import dataclass, field
+
 import numpy as np
-from arch import arch_model
 from loguru import logger
 
-from src.config import GarchParams
+from src.config import CriterionType, GarchParams
+from src.services.metrics import STAGE_SECONDS, stage_timer
+
+
+@dataclass
+class GarchFit:
+    pred: float
+    params: list[float]
+    warm_start: bool
+    # filter state at the last observation (p squared residuals, q variances),
+    # oldest first, enough to roll the variance recursion forward
+    resid2: list[float] = field(default_factory=list)
+    sigma2: list[float] = field(default_factory=list)
+    # filter updates and their sum of squared standardized residuals since
+    # the last full estimation
+    n_updates: int = 0
+    z2_sum: float = 0.0
 
 
-def get_garch_pred(log_return, params: GarchParams) -> float | None:
+def get_garch_pred(
+    log_return, params: GarchParams, starting_values: list[float] | None = None
+) -> GarchFit | None:
+    # arch (and scipy.stats under it) is only needed here, in the fit workers,
+    # importing it lazily keeps it out of the API's startup
+    from arch import arch_model
+
     try:
         model = arch_model(
             log_return,
@@ -16,34 +40,148 @@ def get_garch_pred(log_return, params: GarchParams) -> float | None:
             mean="Constant",
         )
 
-        res = model.fit(disp="off", show_warning=False)
-        logger.debug(res.summary())
+        # fit timings per config and outcome: converged, non_converged,
+        # exploded, degenerate, invalid (nan/inf sigma) or error
+        config = f"{params.p}_{params.q}_{params.dist}"
 
-        if res.convergence_flag != 0:
-            logger.error(f"Optimization failed with flag: {res.convergence_flag}")
-            return None
+        # warm start from the last estimate first, cold start if that fails
+        attempts = [None] if starting_values is None else [starting_values, None]
+        for start in attempts:
+            warm_start = start is not None
+            fit_start = time.perf_counter()
+            try:
+                res = model.fit(
+                    disp="off",
+                    show_warning=False,
+                    starting_values=None if start is None else np.asarray(start),
+                )
+            except Exception as e:
+                STAGE_SECONDS.observe(
+                    time.perf_counter() - fit_start,
+                    stage="fit",
+                    config=config,
+                    outcome="error",
+                )
+                if not warm_start or not isinstance(e, ValueError):
+                    raise
+                logger.warning(f"Invalid warm start values, cold start instead: {e}")
+                continue
+            fit_seconds = time.perf_counter() - fit_start
 
-        forecast = res.forecast(horizon=1)
-        var = forecast.variance.iloc[-1]["h.1"]
-        pred = np.sqrt(var)
+            logger.debug(res.summary())
 
-        if np.isnan(pred) or np.isinf(pred):
-            logger.error(f"Error in predicted sigma: {pred}")
-            return None
+            if res.convergence_flag != 0:
+                STAGE_SECONDS.observe(
+                    fit_seconds, stage="fit", config=config, outcome="non_converged"
+                )
+                logger.error(f"Optimization failed with flag: {res.convergence_flag}")
+                if warm_start:
+                    logger.warning("Warm start did not converge, retrying cold start")
+                continue
 
-        if pred > 500.0:
-            logger.warning(
-                f"Predicted sigma value exploded (failed estimation): {pred}"
+            with stage_timer("forecast", config):
+                sigma = get_sigma_forecast(res)
+            STAGE_SECONDS.observe(
+                fit_seconds,
+                stage="fit",
+                config=config,
+                outcome=get_sigma_outcome(sigma),
             )
-            return None
 
-        if pred < 0.001:
-            logger.warning(f"Model degenerated to zero variance: {pred}")
-            return None
+            pred = check_sigma(sigma)
+            if pred is None:
+                continue
+
+            logger.info(
+                f"GARCH prediction calculated: {pred:.4f} "
+                f"({'warm' if warm_start else 'cold'} start, "
+                f"{res.optimization_result.nit} iterations)"
+            )
+            return GarchFit(
+                pred=pred,
+                params=res.params.tolist(),
+                warm_start=warm_start,
+                resid2=(np.asarray(res.resid)[-params.p :] ** 2).tolist(),
+                sigma2=(
+                    np.asarray(res.conditional_volatility)[-params.q :] ** 2
+                ).tolist(),
+            )
 
-        logger.info(f"GARCH prediction calculated: {pred:.4f}")
-        return pred
+        return None
 
     except Exception:
         logger.exception("Error during GARCH training and prediction")
         return None
+
+
+def get_garch_score(
+    log_return, params: GarchParams, criterion: CriterionType, holdout: int
+) -> float | None:
+    # model selection score, lower is better. oos: the model is fitted
+    # without the last `holdout` returns and scored by -2 x their
+    # log-likelihood under the fitted parameters, the scale of aic/bic
+    from arch import arch_model
+
+    try:
+        train = log_return[:-holdout] if criterion == "oos" else log_return
+        model_args = {"vol": "GARCH", "p": params.p, "q": params.q, "dist": params.dist}
+        with stage_timer(
+            "selection_fit", f"{params.p}_{params.q}_{params.dist}"
+        ) as labels:
+            res = arch_model(train, mean="Constant", **model_args).fit(
+                disp="off", show_warning=False
+            )
+            labels["outcome"] = (
+                "converged" if res.convergence_flag == 0 else "non_converged"
+            )
+        if res.convergence_flag != 0:
+            return None
+
+        if criterion == "aic":
+            return float(res.aic)
+        if criterion == "bic":
+            return float(res.bic)
+
+        # the variance recursion runs on through the held out returns
+        full = arch_model(log_return, mean="Constant", **model_args).fix(res.params)
+        return float(-2 * (full.loglikelihood - res.loglikelihood))
+
+    except Exception:
+        logger.exception(
+            f"Error while scoring GARCH({params.p},{params.q}) {params.dist}"
+        )
+        return None
+
+
+def get_sigma_forecast(res) -> float:
+    forecast = res.forecast(horizon=1)
+    var = forecast.variance.iloc[-1]["h.1"]
+    return float(np.sqrt(var))
+
+
+def get_sigma_outcome(pred: float) -> str:
+    if np.isnan(pred) or np.isinf(pred):
+        return "invalid"
+    if pred > 500.0:
+        return "exploded"
+    if pred < 0.001:
+        return "degenerate"
+    return "converged"
+
+
+def check_sigma(pred: float) -> float | None:
+    outcome = get_sigma_outcome(pred)
+
+    if outcome == "invalid":
+        logger.error(f"Error in predicted sigma: {pred}")
+        return None
+
+    if outcome == "exploded":
+        logger.warning(f"Predicted sigma value exploded (failed estimation): {pred}")
+        return None
+
+    if outcome == "degenerate":
+        logger.warning(f"Model degenerated to zero variance: {pred}")
+        return None
+
+    return pred
@@ -0,0 +1,741 @@
+import itertools
+import time
+from typing import cast
+
+import numpy as np
+from loguru import logger
+from scipy.special import expit, gammaln, logit
+
+from src.config import GarchParams
+from src.services.garch_model import GarchFit, check_sigma
+from src.services.metrics import STAGE_SECONDS
+
+# same parameter bounds and starting values as arch's distributions
+DIST_BOUNDS = {
+    "normal": [],
+    "t": [(2.05, 500.0)],
+    "skewt": [(2.05, 300.0), (-1.0, 1.0)],
+    "ged": [(1.01, 500.0)],
+}
+DIST_START = {"normal": [], "t": [8.0], "skewt": [8.0, 0.0], "ged": [1.5]}
+# arch's starting value grid: alpha x persistence
+START_ALPHAS = [0.01, 0.05, 0.1, 0.2]
+START_PERSISTENCE = [0.5, 0.7, 0.9, 0.98]
+
+MAX_ITER = 500
+FTOL = 1e-9
+FD_STEP = 1e-6
+# GARCH(p, 1) recursions are solved in closed form per block, the block length is
+# bounded by how fast beta^-t grows (precision of the cumulative sums)
+FILTER_GROWTH = 1e6
+MIN_FILTER_BLOCK = 16
+MAX_PERSISTENCE = 1.0 - 1e-10
+BOUND_EPS = 1e-4
+
+
+def get_garch_pred_vectorized(
+    log_return, params: GarchParams, starting_values: list[float] | None = None
+) -> GarchFit | None:
+    return fit_garch_batch([log_return], params, [starting_values])[0]
+
+
+def fit_garch_batch(
+    log_returns: list,
+    params: GarchParams,
+    starting_values: list[list[float] | None] | None = None,
+) -> list[GarchFit | None]:
+    start = time.perf_counter()
+    try:
+        fits: list[GarchFit | None] = _fit_garch_batch(
+            log_returns, params, starting_values
+        )
+    except Exception:
+        logger.exception("Error during vectorized GARCH training and prediction")
+        fits = [None] * len(log_returns)
+
+    # one observation per batch: all, some or none of its series converged
+    n_fitted = sum(fit is not None for fit in fits)
+    STAGE_SECONDS.observe(
+        time.perf_counter() - start,
+        stage="fit_vectorized",
+        config=f"{params.p}_{params.q}_{params.dist}",
+        outcome=(
+            "converged"
+            if n_fitted == len(fits)
+            else "partial"
+            if n_fitted
+            else "non_converged"
+        ),
+    )
+    return fits
+
+
+def _fit_garch_batch(
+    log_returns: list,
+    params: GarchParams,
+    starting_values: list[list[float] | None] | None,
+) -> list[GarchFit | None]:
+    model = _BatchGarch(log_returns, params)
+    starts = starting_values or [None] * model.n_series
+
+    # warm start from the last estimate, cold (multi) start for the rest
+    warm = np.array([sv is not None for sv in starts])
+    z_warm = np.empty((model.n_series, model.n_params))
+    for i, sv in enumerate(starts):
+        if sv is None:
+            continue
+        try:
+            z_warm[i] = model.to_unconstrained(np.asarray(sv, dtype=float))[0]
+        except ValueError as e:
+            logger.warning(f"Invalid warm start values, cold start instead: {e}")
+            warm[i] = False
+
+    everything = np.arange(model.n_series)
+    z, converged, n_iter = _fit_rows(model, z_warm, warm, everything)
+
+    retry = warm & ~converged
+    if retry.any():
+        logger.warning(f"{retry.sum()} warm starts did not converge, retrying cold")
+        z_cold, converged_cold, _ = _fit_rows(
+            model, z_warm, np.zeros_like(warm), np.flatnonzero(retry)
+        )
+        z[retry] = z_cold[retry]
+        converged[retry] = converged_cold[retry]
+        warm[retry] = False
+
+    theta = model.to_constrained(z)
+    resid2, sigma2 = model.last_state(theta)
+    sigma = np.sqrt(model.forecast(theta, resid2, sigma2))
+
+    results: list[GarchFit | None] = []
+    for i in range(model.n_series):
+        if not converged[i]:
+            logger.error(f"Vectorized optimization failed to converge for series {i}")
+            results.append(None)
+            continue
+
+        pred = check_sigma(float(sigma[i]))
+        if pred is None:
+            results.append(None)
+            continue
+
+        results.append(
+            GarchFit(
+                pred=pred,
+                params=theta[i].tolist(),
+                warm_start=bool(warm[i]),
+                resid2=resid2[i].tolist(),
+                sigma2=sigma2[i].tolist(),
+            )
+        )
+
+    logger.info(
+        f"Vectorized GARCH({params.p},{params.q}) {params.dist}: "
+        f"{converged.sum()}/{model.n_series} series converged "
+        f"({warm.sum()} warm starts, {n_iter} iterations)"
+    )
+    return results
+
+
+def _fit_rows(
+    model: "_BatchGarch", z_warm: np.ndarray, warm: np.ndarray, series: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, int]:
+    # one optimization row per warm series, one per cold start for the others,
+    # all rows run in the same lockstep passes and the best row wins
+    z_cold, cold_cols = model.cold_start(series[~warm[series]])
+    warm_cols = series[warm[series]]
+    z0 = np.concatenate([z_warm[warm_cols], z_cold])
+    cols = np.concatenate([warm_cols, cold_cols])
+
+    z_rows, f_rows, conv_rows, n_iter = _minimize(model, z0, cols)
+
+    z = np.zeros((model.n_series, model.n_params))
+    converged = np.zeros(model.n_series, dtype=bool)
+    for row in np.argsort(np.where(conv_rows, f_rows, np.inf))[::-1]:
+        i = cols[row]
+        z[i], converged[i] = z_rows[row], conv_rows[row]
+
+    return z, converged, n_iter
+
+
+class _BatchGarch:
+    # constant mean GARCH(p, q) for N series at once, parameters in arch's order:
+    # mu, omega, alpha[1..p], beta[1..q], distribution parameters
+
+    def __init__(self, log_returns: list, params: GarchParams) -> None:
+        series = [np.asarray(r, dtype=float) for r in log_returns]
+        series = [r[np.isfinite(r)] for r in series]
+        if any(len(r) == 0 for r in series):
+            raise ValueError("Empty return series")
+
+        self.p, self.q, self.dist = params.p, params.q, params.dist
+        self.n_dist = len(DIST_BOUNDS[self.dist])
+        self.n_params = 2 + self.p + self.q + self.n_dist
+        self.n_series = len(series)
+        self.n_obs = np.array([len(r) for r in series])
+
+        # series are left aligned and the ragged tails masked out, so every series
+        # starts its recursion at row 0 and histories may differ in length
+        n_max = int(self.n_obs.max())
+        self.y = np.zeros((n_max, self.n_series))
+        self.mask = np.zeros((n_max, self.n_series))
+        for i, r in enumerate(series):
+            self.y[: len(r), i] = r
+            self.mask[: len(r), i] = 1.0
+
+        # like arch: backcast is fixed from the residuals around the sample mean
+        self.y_mean = np.array([r.mean() for r in series])
+        self.resid_var = np.array([r.var() for r in series])
+        self.backcast = np.empty(self.n_series)
+        for i, r in enumerate(series):
+            tau = min(75, len(r))
+            w = 0.94 ** np.arange(tau)
+            self.backcast[i] = (w / w.sum()) @ (r[:tau] - r.mean()) ** 2
+
+    def cold_start(self, series: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if len(series) == 0:
+            return np.empty((0, self.n_params)), series
+
+        # best point of arch's grid per series by Gaussian likelihood
+        grid = [
+            (alpha, persistence)
+            for alpha, persistence in itertools.product(START_ALPHAS, START_PERSISTENCE)
+            if alpha < persistence
+        ]
+        n = len(series)
+        theta = np.empty((len(grid), n, self.n_params))
+        theta[:, :, 0] = self.y_mean[series]
+        for g, (alpha, persistence) in enumerate(grid):
+            theta[g, :, 1] = (1 - persistence) * self.resid_var[series]
+            theta[g, :, 2 : 2 + self.p] = alpha / self.p
+            theta[g, :, 2 + self.p : 2 + self.p + self.q] = (
+                persistence - alpha
+            ) / self.q
+        theta[:, :, 2 + self.p + self.q :] = DIST_START[self.dist]
+
+        flat = theta.reshape(-1, self.n_params)
+        cols = np.tile(series, len(grid))
+        sigma2 = self.variance(flat, cols)
+        resid = self.y[:, cols] - flat[:, 0]
+        lls = -0.5 * (np.log(sigma2) + resid**2 / sigma2)
+        llf = (lls * self.mask[:, cols]).sum(axis=0).reshape(len(grid), n)
+        best = theta[np.argmax(llf, axis=0), np.arange(n)]
+
+        # with more than one lag the likelihood is multimodal in how alpha and
+        # beta are split across lags, extra starts put them on the first lags
+        # and on the last beta lag
+        starts = [best]
+        k = 2 + self.p + self.q
+        if self.p + self.q > 2:
+            alpha = best[:, 2 : 2 + self.p].sum(axis=1)
+            beta = best[:, 2 + self.p : k].sum(axis=1)
+            for beta_lag in {0, self.q - 1}:
+                start = best.copy()
+                start[:, 2:k] = 0.0
+                start[:, 2] = alpha
+                start[:, 2 + self.p + beta_lag] = beta
+                starts.append(start)
+
+        z = self.to_unconstrained(np.concatenate(starts))
+        return z, np.tile(series, len(starts))
+
+    def to_unconstrained(self, theta: np.ndarray) -> np.ndarray:
+        theta = np.atleast_2d(theta)
+        if theta.shape[-1] != self.n_params:
+            raise ValueError(
+                f"Expected {self.n_params} parameters, got {theta.shape[-1]}"
+            )
+        if not np.isfinite(theta).all():
+            raise ValueError("Starting values are not finite")
+
+        k = 2 + self.p + self.q
+        z = np.empty_like(theta)
+        z[:, 0] = theta[:, 0]
+        z[:, 1] = np.log(np.maximum(theta[:, 1], 1e-12))
+
+        # alphas and betas stay as they are, the optimizer keeps them feasible
+        ab = theta[:, 2:k]
+        if (ab < -1e-8).any() or (ab.sum(axis=1) > 1 + 1e-6).any():
+            raise ValueError("Starting values are not in the stationary region")
+        z[:, 2:k] = ab
+
+        for j, (low, high) in enumerate(DIST_BOUNDS[self.dist]):
+            u = (theta[:, k + j] - low) / (high - low)
+            z[:, k + j] = logit(np.clip(u, 1e-9, 1 - 1e-9))
+
+        return z
+
+    def to_constrained(self, z: np.ndarray) -> np.ndarray:
+        k = 2 + self.p + self.q
+        theta = np.empty_like(z)
+        theta[:, 0] = z[:, 0]
+        theta[:, 1] = np.exp(np.minimum(z[:, 1], 700.0))
+
+        theta[:, 2:k] = z[:, 2:k]
+
+        for j, (low, high) in enumerate(DIST_BOUNDS[self.dist]):
+            theta[:, k + j] = low + (high - low) * expit(z[:, k + j])
+
+        return theta
+
+    def project(self, z: np.ndarray) -> np.ndarray:
+        # Euclidean projection onto alphas, betas >= 0 and alpha + beta <= 1,
+        # arch's SLSQP bounds and stationarity constraint
+        k = 2 + self.p + self.q
+        z = z.copy()
+        ab = np.maximum(z[:, 2:k], 0.0)
+        over = ab.sum(axis=1) > MAX_PERSISTENCE
+        if over.any():
+            # projection onto the simplex sum = MAX_PERSISTENCE (sort based)
+            v = z[over, 2:k]
+            u = -np.sort(-v, axis=1)
+            css = np.cumsum(u, axis=1) - MAX_PERSISTENCE
+            ranks = np.arange(1, v.shape[1] + 1)
+            rho = (u - css / ranks > 0).sum(axis=1)
+            tau = css[np.arange(len(v)), rho - 1] / rho
+            ab[over] = np.maximum(v - tau[:, None], 0.0)
+        z[:, 2:k] = ab
+        return z
+
+    def binding(self, z: np.ndarray, g: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # alphas/betas at (or within BOUND_EPS of) zero that the gradient pushes
+        # further down are fixed, alpha + beta = 1 binds when steepest descent
+        # would raise the sum
+        k = 2 + self.p + self.q
+        ab, g_ab = z[:, 2:k], g[:, 2:k]
+        at_zero = ab <= BOUND_EPS
+        at_cap = ab.sum(axis=1) >= MAX_PERSISTENCE - 1e-9
+
+        fixed_ab = at_zero & (g_ab > 0)
+        capped = np.zeros(len(z), dtype=bool)
+        for _ in range(self.p + self.q):
+            free = ~fixed_ab
+            capped = at_cap & ((-g_ab * free).sum(axis=1) > 0)
+            # on the cap the gradient counts relative to the constraint multiplier
+            multiplier = (g_ab * free).sum(axis=1) / np.maximum(free.sum(axis=1), 1)
+            shifted = g_ab - np.where(capped, multiplier, 0.0)[:, None]
+            new_fixed = at_zero & (shifted > 0)
+            if (new_fixed == fixed_ab).all():
+                break
+            fixed_ab = new_fixed
+
+        fixed = np.zeros_like(z, dtype=bool)
+        fixed[:, 2:k] = fixed_ab
+        return fixed, capped
+
+    def tangent_space(self, fixed: np.ndarray, capped: np.ndarray) -> np.ndarray:
+        # projection onto the directions allowed by the binding constraints
+        n, k = fixed.shape
+        proj = np.eye(k) * ~fixed[:, :, None]
+
+        # at alpha + beta = 1 the free alphas/betas may only move along the cap
+        normal = np.zeros((n, k))
+        normal[:, 2 : 2 + self.p + self.q] = 1.0
+        normal *= ~fixed
+        normal /= np.sqrt(np.maximum((normal**2).sum(axis=1, keepdims=True), 1.0))
+        proj -= capped[:, None, None] * np.einsum("ni,nj->nij", normal, normal)
+        return proj
+
+    def variance(self, theta: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        # theta: (M, K) parameter sets for the series in cols (M,) -> sigma2 (T, M)
+        resid2 = (self.y[:, cols] - theta[:, 0]) ** 2
+        alphas = theta[:, 2 : 2 + self.p]
+        betas = theta[:, 2 + self.p : 2 + self.p + self.q]
+        backcast = self.backcast[cols]
+
+        # the ARCH part does not depend on sigma2, computed for all t at once
+        arch_part = _lag_sum(resid2, alphas, backcast) + theta[:, 1]
+        init = np.broadcast_to(backcast, (self.q, len(cols)))
+        return _filter(arch_part, betas, init)
+
+    def loglikelihood(
+        self, theta: np.ndarray, resid: np.ndarray, sigma2: np.ndarray
+    ) -> np.ndarray:
+        return self.density(theta, resid, sigma2)[0]
+
+    def density(
+        self,
+        theta: np.ndarray,
+        resid: np.ndarray,
+        sigma2: np.ndarray,
+        partials: bool = False,
+    ) -> tuple[np.ndarray, np.ndarray | None, np.ndarray | None]:
+        # per observation log-likelihood (T, M), same densities as arch, and
+        # optionally its partial derivatives w.r.t. sigma2 and resid
+        dist_params = theta[:, 2 + self.p + self.q :]
+        dll_ds = dll_de = None
+
+        if self.dist == "normal":
+            lls = -0.5 * (np.log(2 * np.pi) + np.log(sigma2) + resid**2 / sigma2)
+            if partials:
+                dll_ds = 0.5 * (resid**2 / sigma2 - 1) / sigma2
+                dll_de = -resid / sigma2
+
+        elif self.dist == "t":
+            nu = dist_params[:, 0]
+            const = (
+                gammaln((nu + 1) / 2) - gammaln(nu / 2) - np.log(np.pi * (nu - 2)) / 2
+            )
+            u = resid**2 / (sigma2 * (nu - 2))
+            lls = const - 0.5 * np.log(sigma2) - (nu + 1) / 2 * np.log1p(u)
+            if partials:
+                dll_ds = (0.5 * (nu + 1) * u / (1 + u) - 0.5) / sigma2
+                dll_de = -(nu + 1) * resid / (sigma2 * (nu - 2) * (1 + u))
+
+        elif self.dist == "skewt":
+            eta, lam = dist_params[:, 0], dist_params[:, 1]
+            const = (
+                gammaln((eta + 1) / 2)
+                - gammaln(eta / 2)
+                - np.log(np.pi * (eta - 2)) / 2
+            )
+            a = 4 * lam * np.exp(const) * (eta - 2) / (eta - 1)
+            b = np.sqrt(1 + 3 * lam**2 - a**2)
+            sigma = np.sqrt(sigma2)
+            std_resid = resid / sigma
+            side = 1 + np.where(std_resid < -a / b, -lam, lam)
+            w = (b * std_resid + a) / side
+            lls = (
+                np.log(b)
+                + const
+                - np.log(sigma2) / 2
+                - (eta + 1) / 2 * np.log1p(w**2 / (eta - 2))
+            )
+            if partials:
+                dll_dz = -(eta + 1) * w / (eta - 2 + w**2) * b / side
+                dll_ds = -0.5 / sigma2 - 0.5 * dll_dz * std_resid / sigma2
+                dll_de = dll_dz / sigma
+
+        else:
+            nu = dist_params[:, 0]
+            log_c = 0.5 * (-2 / nu * np.log(2) + gammaln(1 / nu) - gammaln(3 / nu))
+            const = np.log(nu) - log_c - gammaln(1 / nu) - (1 + 1 / nu) * np.log(2)
+            scale = np.sqrt(sigma2) * np.exp(log_c)
+            x = np.abs(resid) / scale
+            x_nu = x**nu
+            lls = const - 0.5 * np.log(sigma2) - 0.5 * x_nu
+            if partials:
+                dll_ds = (0.25 * nu * x_nu - 0.5) / sigma2
+                dll_de = -0.5 * nu * x ** (nu - 1) * np.sign(resid) / scale
+
+        return lls, dll_ds, dll_de
+
+    def objective(self, z: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        # mean negative log-likelihood per observation, one value per row of z
+        theta = self.to_constrained(z)
+        sigma2 = self.variance(theta, cols)
+        resid = self.y[:, cols] - theta[:, 0]
+        with np.errstate(all="ignore"):
+            lls = self.loglikelihood(theta, resid, sigma2)
+            nllf = -(lls * self.mask[:, cols]).sum(axis=0) / self.n_obs[cols]
+        return np.where(np.isfinite(nllf), nllf, np.inf)
+
+    def gradient(
+        self, z: np.ndarray, cols: np.ndarray, bhhh: bool = False
+    ) -> tuple[np.ndarray, np.ndarray | None]:
+        # gradient of the objective w.r.t. z, optionally with the outer product
+        # of scores (BHHH) approximation of its Hessian
+        p, q, m = self.p, self.q, len(cols)
+        theta = self.to_constrained(z)
+        resid = self.y[:, cols] - theta[:, 0]
+        resid2 = resid**2
+        alphas = theta[:, 2 : 2 + p]
+        betas = theta[:, 2 + p : 2 + p + q]
+        backcast = self.backcast[cols]
+        sigma2 = self.variance(theta, cols)
+        mask = self.mask[:, cols]
+        n_obs = self.n_obs[cols]
+
+        # d sigma2 / d (mu, omega, alphas, betas) follows the same recursion as
+        # sigma2 itself, all channels are filtered together in one pass
+        n_t = resid.shape[0]
+        drive = np.empty((n_t, 2 + p + q, m))
+        drive[:, 0] = _lag_sum(-2 * resid, alphas, 0.0)
+        drive[:, 1] = 1.0
+        for j in range(1, p + 1):
+            drive[:, 1 + j] = _shift(resid2, j, backcast)
+        for j in range(1, q + 1):
+            drive[:, 1 + p + j] = _shift(sigma2, j, backcast)
+
+        channels = drive.shape[1]
+        d_sigma2 = _filter(
+            drive.reshape(n_t, channels * m),
+            np.tile(betas, (channels, 1)),
+            np.zeros((q, channels * m)),
+        ).reshape(n_t, channels, m)
+
+        k = 2 + p + q
+        scores = np.empty((n_t, m, self.n_params)) if bhhh else None
+        grad = np.empty((m, self.n_params))
+        with np.errstate(all="ignore"):
+            _, dll_ds, dll_de = self.density(theta, resid, sigma2, partials=True)
+            dll_ds = cast(np.ndarray, dll_ds) * mask
+            dll_de = cast(np.ndarray, dll_de) * mask
+            if scores is None:
+                grad[:, :channels] = np.einsum("tm,tcm->mc", dll_ds, d_sigma2)
+                grad[:, 0] -= dll_de.sum(axis=0)
+            else:
+                scores[:, :, :channels] = (dll_ds[:, None] * d_sigma2).transpose(
+                    0, 2, 1
+                )
+                scores[:, :, 0] -= dll_de
+
+            # shape parameters do not enter sigma2 -> elementwise differences
+            for j in range(self.n_dist):
+                step = FD_STEP * np.maximum(np.abs(theta[:, k + j]), 1.0)
+                up, down = theta.copy(), theta.copy()
+                up[:, k + j] += step
+                down[:, k + j] -= step
+                diff = self.loglikelihood(up, resid, sigma2) - self.loglikelihood(
+                    down, resid, sigma2
+                )
+                diff = diff * mask / (2 * step)
+                if scores is None:
+                    grad[:, k + j] = diff.sum(axis=0)
+                else:
+                    scores[:, :, k + j] = diff
+
+        outer = None
+        if scores is not None:
+            scores = np.where(np.isfinite(scores), scores, 0.0)
+            grad = scores.sum(axis=0)
+            # BHHH in theta, mapped to z with the Jacobian of the transform
+            jac = self.chain_rule(
+                z,
+                theta,
+                np.broadcast_to(
+                    np.eye(k + self.n_dist)[:, None], (self.n_params, m, self.n_params)
+                ),
+            )
+            outer = np.einsum("tmi,tmj->mij", scores, scores) / n_obs[:, None, None]
+            outer = np.einsum("imk,mij,jml->mkl", jac, outer, jac)
+
+        grad = -self.chain_rule(z, theta, grad) / n_obs[:, None]
+        return np.where(np.isfinite(grad), grad, 0.0), outer
+
+    def chain_rule(
+        self, z: np.ndarray, theta: np.ndarray, grad: np.ndarray
+    ) -> np.ndarray:
+        # derivatives w.r.t. theta -> w.r.t. the unconstrained z, grad (..., M, K)
+        k = 2 + self.p + self.q
+        out = np.array(grad, dtype=float)
+        out[..., 1] *= theta[:, 1]
+
+        for j, (low, high) in enumerate(DIST_BOUNDS[self.dist]):
+            s = expit(z[:, k + j])
+            out[..., k + j] *= (high - low) * s * (1 - s)
+
+        return out
+
+    def last_state(self, theta: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # squared residuals (N, p) and variances (N, q) at each series' own
+        # last observations, oldest first
+        sigma2 = self.variance(theta, np.arange(self.n_series))
+        resid2 = (self.y - theta[:, 0]) ** 2
+        return self._tail(resid2, self.p), self._tail(sigma2, self.q)
+
+    def forecast(
+        self, theta: np.ndarray, resid2: np.ndarray, sigma2: np.ndarray
+    ) -> np.ndarray:
+        alphas = theta[:, 2 : 2 + self.p]
+        betas = theta[:, 2 + self.p : 2 + self.p + self.q]
+        arch_part = (alphas[:, ::-1] * resid2).sum(axis=1)
+        return theta[:, 1] + arch_part + (betas[:, ::-1] * sigma2).sum(axis=1)
+
+    def _tail(self, x: np.ndarray, lags: int) -> np.ndarray:
+        idx = self.n_obs[:, None] - np.arange(lags, 0, -1)
+        tail = x[np.maximum(idx, 0), np.arange(self.n_series)[:, None]]
+        return np.where(idx >= 0, tail, self.backcast[:, None])
+
+
+def _shift(x: np.ndarray, lag: int, fill) -> np.ndarray:
+    out = np.empty_like(x)
+    out[lag:] = x[:-lag]
+    out[:lag] = fill
+    return out
+
+
+def _lag_sum(x: np.ndarray, coefs: np.ndarray, fill) -> np.ndarray:
+    # sum_j coefs[:, j] * x[t - 1 - j], pre-sample values replaced by fill
+    out = np.zeros_like(x)
+    for j in range(1, coefs.shape[1] + 1):
+        out[j:] += coefs[:, j - 1] * x[:-j]
+        out[:j] += coefs[:, j - 1] * fill
+    return out
+
+
+def _filter(drive: np.ndarray, betas: np.ndarray, init: np.ndarray) -> np.ndarray:
+    # out[t] = drive[t] + sum_k betas[:, k] * out[t - 1 - k], the only sequential
+    # part of the likelihood, computed for all columns at once
+    q = betas.shape[1]
+    n_t, m = drive.shape
+
+    if q == 1:
+        beta = betas[:, 0]
+        # block length so that beta^-block stays below FILTER_GROWTH
+        block = int(np.log(FILTER_GROWTH) / -np.log(max(beta.min(), 1e-300)))
+        if block >= MIN_FILTER_BLOCK:
+            return _filter_blocked(drive, beta, init[0], min(block, n_t))
+
+    out = np.empty((n_t + q, m))
+    out[:q] = init
+    step = np.empty(m)
+
+    if q == 1:
+        beta = betas[:, 0]
+        for t in range(n_t):
+            np.multiply(beta, out[t], out=step)
+            np.add(drive[t], step, out=out[t + 1])
+    else:
+        betas_rev = np.ascontiguousarray(betas[:, ::-1].T)
+        for t in range(n_t):
+            np.einsum("lm,lm->m", betas_rev, out[t : t + q], out=step)
+            np.add(drive[t], step, out=out[t + q])
+
+    return out[q:]
+
+
+def _filter_blocked(
+    drive: np.ndarray, beta: np.ndarray, init: np.ndarray, block: int
+) -> np.ndarray:
+    # within a block out[s + j] = beta^j * (beta * out[s - 1] + cumsum(drive * beta^-j)),
+    # replaces the per step python loop with one cumsum per block
+    n_t, m = drive.shape
+    lags = np.arange(block)[:, None]
+    powers = beta**lags
+    inv_powers = 1.0 / powers
+
+    out = np.empty((n_t, m))
+    prev = init
+    for start in range(0, n_t, block):
+        end = min(start + block, n_t)
+        n = end - start
+        acc = np.cumsum(drive[start:end] * inv_powers[:n], axis=0)
+        out[start:end] = powers[:n] * (acc + beta * prev)
+        prev = out[end - 1]
+
+    return out
+
+
+def _minimize(
+    model: _BatchGarch, z0: np.ndarray, cols: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    # projected BFGS for all rows in lockstep (row i fits series cols[i]), every
+    # likelihood or gradient evaluation is one vectorized pass over the rows
+    # still being optimized
+    n, k = z0.shape
+    z = model.project(z0)
+    f = model.objective(z, cols)
+    g, _ = model.gradient(z, cols)
+    h_inv = np.empty((n, k, k))
+    proj = np.empty((n, k, k))
+    fixed = np.zeros((n, k), dtype=bool)
+    capped = np.zeros(n, dtype=bool)
+    # no inverse Hessian yet -> every row starts from BHHH below
+    stale = np.ones(n, dtype=bool)
+    active = np.isfinite(f)
+    converged = np.zeros(n, dtype=bool)
+
+    n_iter = 0
+    while active.any() and n_iter < MAX_ITER:
+        n_iter += 1
+        idx = np.flatnonzero(active)
+
+        # binding bounds restrict the search to a subspace, the quasi-Newton
+        # matrix restarts from the outer product of scores whenever it changes
+        new_fixed, new_capped = model.binding(z[idx], g[idx])
+        restart = stale[idx] | (new_fixed != fixed[idx]).any(axis=1)
+        restart |= new_capped != capped[idx]
+        fixed[idx], capped[idx] = new_fixed, new_capped
+        if restart.any():
+            rows = idx[restart]
+            proj[rows] = model.tangent_space(fixed[rows], capped[rows])
+            _, bhhh = model.gradient(z[rows], cols[rows], bhhh=True)
+            h_inv[rows] = _inverse(cast(np.ndarray, bhhh), proj[rows])
+            stale[rows] = False
+
+        g_proj = np.einsum("nij,nj->ni", proj[idx], g[idx])
+        direction = -np.einsum("nij,nj->ni", h_inv[idx], g_proj)
+        slope = np.einsum("ni,ni->n", direction, g_proj)
+
+        # not a descent direction: projected steepest descent, fresh start next time
+        uphill = slope >= 0
+        if uphill.any():
+            direction[uphill] = -g_proj[uphill]
+            slope[uphill] = -np.einsum("ni,ni->n", g_proj[uphill], g_proj[uphill])
+            stale[idx[uphill]] = True
+
+        # fixed parameters close to their bound step onto it
+        to_bound = np.where(fixed[idx], -z[idx], 0.0)
+        direction += to_bound
+        slope += np.einsum("ni,ni->n", to_bound, g[idx])
+
+        # predicted decrease (Newton decrement) below tolerance: converged
+        done = -slope < 2 * FTOL
+        converged[idx[done]] = True
+        active[idx[done]] = False
+        idx, direction = idx[~done], direction[~done]
+        if len(idx) == 0:
+            break
+
+        # backtracking (Armijo) line search along the projected path, only
+        # unfinished rows are re-evaluated
+        step = np.ones(len(idx))
+        z_new = z[idx].copy()
+        f_new = np.full(len(idx), np.inf)
+        pending = np.ones(len(idx), dtype=bool)
+        for _ in range(40):
+            sub = np.flatnonzero(pending)
+            trial = model.project(z[idx[sub]] + step[sub, None] * direction[sub])
+            f_trial = model.objective(trial, cols[idx[sub]])
+            decrease = np.einsum("ni,ni->n", g[idx[sub]], trial - z[idx[sub]])
+            ok = f_trial <= f[idx[sub]] + 1e-4 * np.minimum(decrease, 0.0)
+            z_new[sub[ok]] = trial[ok]
+            f_new[sub[ok]] = f_trial[ok]
+            pending[sub[ok]] = False
+            if not pending.any():
+                break
+            step[sub[~ok]] *= 0.5
+
+        # no decrease possible: optimum up to numerical precision if the
+        # projected gradient is small, otherwise the optimization failed
+        stalled = idx[pending]
+        g_stalled = np.einsum("nij,nj->ni", proj[stalled], g[stalled])
+        converged[stalled] = np.abs(g_stalled).max(axis=1) < 1e-3
+        active[stalled] = False
+
+        moved = ~pending
+        idx = idx[moved]
+        if len(idx) == 0:
+            continue
+
+        s = z_new[moved] - z[idx]
+        g_old = g[idx]
+        z[idx] = z_new[moved]
+        f[idx] = f_new[moved]
+        g[idx], _ = model.gradient(z[idx], cols[idx])
+
+        # BFGS update within the subspace, skipped where the curvature
+        # condition does not hold
+        s = np.einsum("nij,nj->ni", proj[idx], s)
+        y = np.einsum("nij,nj->ni", proj[idx], g[idx] - g_old)
+        sy = np.einsum("ni,ni->n", s, y)
+        upd = sy > 1e-14
+        if upd.any():
+            rho = (1.0 / sy[upd])[:, None, None]
+            su, yu = s[upd], y[upd]
+            left = np.eye(k) - rho * np.einsum("ni,nj->nij", su, yu)
+            h_upd = np.einsum("nij,njk,nlk->nil", left, h_inv[idx[upd]], left)
+            h_inv[idx[upd]] = h_upd + rho * np.einsum("ni,nj->nij", su, su)
+
+    return z, f, converged, n_iter
+
+
+def _inverse(hess: np.ndarray, proj: np.ndarray) -> np.ndarray:
+    # inverse of the Hessian restricted to the subspace proj, a small ridge
+    # keeps flat directions (unidentified lags) invertible
+    k = hess.shape[-1]
+    reduced = np.einsum("nij,njk,nlk->nil", proj, hess, proj)
+    scale = 1 + np.trace(reduced, axis1=1, axis2=2)
+    reduced += 1e-8 * scale[:, None, None] * np.eye(k)
+    return np.einsum("nij,njk,nlk->nil", proj, np.linalg.inv(reduced), proj)
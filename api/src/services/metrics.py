@@ -0,0 +1,174 @@
+import bisect
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+# per-process metrics rendered in the Prometheus text format on /metrics.
+# fit workers serve no /metrics, they forward their observations over a queue
+# to the API process (forward_metrics in the worker, receive_metrics here)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry: dict[str, "Histogram | Counter"] = {}
+_forward: Any = None
+
+
+class Histogram:
+    def __init__(
+        self, name: str, help: str, labelnames: list[str], buckets=BUCKETS
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> counts per bucket (not cumulative), sum, count
+        self._series: dict[tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def observe(self, value: float, **labels: str) -> None:
+        if _forward is not None:
+            _forward.put((self.name, value, labels))
+            return
+        self.record(value, labels)
+
+    def record(self, value: float, labels: dict[str, str]) -> None:
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(
+                key, [[0] * (len(self.buckets) + 1), 0.0, 0]
+            )
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(k, list(c), s, n) for k, (c, s, n) in self._series.items()]
+
+        for key, counts, total, count in sorted(series):
+            labels = _labels(self.labelnames, key)
+            cumulative = 0
+            for bound, n in zip([*self.buckets, "+Inf"], counts):
+                cumulative += n
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: list[str]) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if _forward is not None:
+            _forward.put((self.name, amount, labels))
+            return
+        self.record(amount, labels)
+
+    def record(self, amount: float, labels: dict[str, str]) -> None:
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{{{_labels(self.labelnames, key)}}} {value}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "fvf_stage_seconds",
+    "Duration of prediction and report pipeline stages",
+    ["stage", "config", "outcome"],
+)
+REQUEST_SECONDS = Histogram(
+    "fvf_request_seconds", "HTTP request latency", ["method", "path", "status"]
+)
+DB_ERRORS = Counter("fvf_db_errors_total", "Failed database operations", ["operation"])
+
+
+@contextmanager
+def stage_timer(stage: str, config: str = "") -> Iterator[dict[str, str]]:
+    # the block may set the outcome label, an exception sets it to error
+    labels = {"outcome": "ok"}
+    start = time.perf_counter()
+    try:
+        yield labels
+    except BaseException:
+        labels["outcome"] = "error"
+        raise
+    finally:
+        STAGE_SECONDS.observe(
+            time.perf_counter() - start,
+            stage=stage,
+            config=config,
+            outcome=labels["outcome"],
+        )
+
+
+def forward_metrics(metrics_queue) -> None:
+    global _forward
+    _forward = metrics_queue
+
+
+def receive_metrics(metrics_queue) -> threading.Thread:
+    # stops at a None sentinel
+    def run() -> None:
+        while True:
+            try:
+                item = metrics_queue.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+
+            name, value, labels = item
+            metric = _registry.get(name)
+            if metric is not None:
+                metric.record(value, labels)
+
+    thread = threading.Thread(target=run, name="metrics-receiver", daemon=True)
+    thread.start()
+    return thread
+
+
+def render_metrics(caches: dict[str, dict]) -> str:
+    # cache counters come from the caches' own stats
+    lines = [
+        "# HELP fvf_cache_lookups_total Cache lookups by result",
+        "# TYPE fvf_cache_lookups_total counter",
+    ]
+    for cache, stats in caches.items():
+        for result in ["hits", "incremental", "stale", "misses"]:
+            if result in stats:
+                lines.append(
+                    f'fvf_cache_lookups_total{{cache="{cache}",result="{result}"}} '
+                    f"{stats[result]}"
+                )
+
+    for metric in _registry.values():
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
+
+
+def _labels(names: list[str], values: tuple[str, ...]) -> str:
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,291 @@
+from loguru import logger
+from sqlalchemy import Engine, text
+
+# versioned schema of all tables, shared by the API and scripts/evaluate.py,
+# so only sqlalchemy and loguru imports here. applied versions are recorded
+# in schema_migrations, a new migration is appended with the next version
+PARTITION_MONTHS_AHEAD = 2
+# serializes migrations of concurrently starting API workers and scripts
+MIGRATION_LOCK_ID = 7_301_2026
+
+# the tables as created before versioned migrations, a no-op on databases
+# created by earlier versions
+BASELINE = """
+    CREATE TABLE IF NOT EXISTS garch_preds (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        ticker VARCHAR(10) NOT NULL,
+        execution_time TIMESTAMP DEFAULT NOW(),
+        target_date DATE NOT NULL,
+        model_config VARCHAR(20) NOT NULL,
+        horizon INTEGER NOT NULL DEFAULT 1,
+        prediction DOUBLE PRECISION NOT NULL,
+        CONSTRAINT unique_pred_horizon
+            UNIQUE (ticker, target_date, model_config, horizon)
+    );
+    ALTER TABLE garch_preds
+        ADD COLUMN IF NOT EXISTS horizon INTEGER NOT NULL DEFAULT 1;
+    ALTER TABLE garch_preds DROP CONSTRAINT IF EXISTS unique_pred;
+    CREATE UNIQUE INDEX IF NOT EXISTS unique_pred_horizon
+        ON garch_preds (ticker, target_date, model_config, horizon);
+
+    CREATE TABLE IF NOT EXISTS garch_fit_params (
+        ticker VARCHAR(10) NOT NULL,
+        model_config VARCHAR(20) NOT NULL,
+        params DOUBLE PRECISION[] NOT NULL,
+        target_date DATE NOT NULL,
+        updated_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (ticker, model_config)
+    );
+    ALTER TABLE garch_fit_params
+        ADD COLUMN IF NOT EXISTS resid2 DOUBLE PRECISION[],
+        ADD COLUMN IF NOT EXISTS sigma2 DOUBLE PRECISION[],
+        ADD COLUMN IF NOT EXISTS last_obs_date DATE,
+        ADD COLUMN IF NOT EXISTS n_updates INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS z2_sum DOUBLE PRECISION NOT NULL DEFAULT 0;
+
+    CREATE TABLE IF NOT EXISTS garch_performance (
+        prediction_id INTEGER PRIMARY KEY,
+        evaluation_date DATE NOT NULL,
+        realized_vol DOUBLE PRECISION,
+        error_raw DOUBLE PRECISION,
+        error_abs DOUBLE PRECISION,
+        error_rel DOUBLE PRECISION,
+        error_sq DOUBLE PRECISION,
+        CONSTRAINT fk_garch_performance_prediction
+            FOREIGN KEY (prediction_id)
+            REFERENCES garch_preds (id)
+            ON DELETE CASCADE
+    );
+    ALTER TABLE garch_performance
+        ADD COLUMN IF NOT EXISTS realized_bv DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS realized_pk DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS realized_gk DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS realized_rv_sub DOUBLE PRECISION;
+
+    CREATE TABLE IF NOT EXISTS garch_metrics_date (
+        target_date DATE NOT NULL,
+        model_config VARCHAR(20) NOT NULL,
+        n INTEGER NOT NULL,
+        sum_error_raw DOUBLE PRECISION NOT NULL,
+        sum_error_abs DOUBLE PRECISION NOT NULL,
+        sum_error_rel DOUBLE PRECISION NOT NULL,
+        sum_error_sq DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (target_date, model_config)
+    );
+    CREATE TABLE IF NOT EXISTS garch_metrics_ticker (
+        ticker VARCHAR(10) NOT NULL,
+        model_config VARCHAR(20) NOT NULL,
+        n INTEGER NOT NULL,
+        sum_error_raw DOUBLE PRECISION NOT NULL,
+        sum_error_abs DOUBLE PRECISION NOT NULL,
+        sum_error_rel DOUBLE PRECISION NOT NULL,
+        sum_error_sq DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (ticker, model_config)
+    );
+
+    -- metrics of evaluations made before the metrics tables existed
+    INSERT INTO garch_metrics_date
+    SELECT p.target_date, p.model_config, COUNT(*), SUM(gp.error_raw),
+        SUM(gp.error_abs), SUM(gp.error_rel), SUM(gp.error_sq)
+    FROM garch_performance gp
+        JOIN garch_preds p
+        ON gp.prediction_id = p.id
+    WHERE NOT EXISTS (SELECT 1 FROM garch_metrics_date)
+    GROUP BY p.target_date, p.model_config;
+    INSERT INTO garch_metrics_ticker
+    SELECT p.ticker, p.model_config, COUNT(*), SUM(gp.error_raw),
+        SUM(gp.error_abs), SUM(gp.error_rel), SUM(gp.error_sq)
+    FROM garch_performance gp
+        JOIN garch_preds p
+        ON gp.prediction_id = p.id
+    WHERE NOT EXISTS (SELECT 1 FROM garch_metrics_ticker)
+    GROUP BY p.ticker, p.model_config;
+"""
+
+# garch_preds and garch_performance range partitioned by target_date month,
+# typed p/q/dist columns next to model_config and covering indexes for the
+# evaluation and lookup queries. a partitioned table needs the partition key
+# in every unique key, so garch_performance carries the target_date of its
+# prediction and both keys include it
+PARTITIONED = """
+    CREATE OR REPLACE FUNCTION garch_ensure_partitions(first_day date, last_day date)
+    RETURNS void AS $$
+    DECLARE
+        start_day date := date_trunc('month', first_day);
+        parent text;
+        part_name text;
+        has_rows boolean;
+    BEGIN
+        WHILE start_day <= last_day LOOP
+            FOREACH parent IN ARRAY ARRAY['garch_preds', 'garch_performance'] LOOP
+                part_name := parent || '_' || to_char(start_day, 'YYYYMM');
+                CONTINUE WHEN to_regclass(part_name) IS NOT NULL;
+
+                -- rows of the month already in the default partition would
+                -- violate the new partition, they stay where they are
+                EXECUTE format(
+                    'SELECT EXISTS (SELECT 1 FROM %I WHERE target_date >= %L AND target_date < %L)',
+                    parent || '_default', start_day, start_day + interval '1 month'
+                ) INTO has_rows;
+                IF has_rows THEN
+                    RAISE WARNING 'Rows of % in %_default, partition not created', start_day, parent;
+                    CONTINUE;
+                END IF;
+
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                    part_name, parent, start_day, (start_day + interval '1 month')::date
+                );
+            END LOOP;
+            start_day := (start_day + interval '1 month')::date;
+        END LOOP;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    ALTER TABLE garch_performance RENAME TO garch_performance_old;
+    ALTER TABLE garch_performance_old
+        DROP CONSTRAINT fk_garch_performance_prediction;
+    ALTER INDEX garch_performance_pkey RENAME TO garch_performance_old_pkey;
+    ALTER TABLE garch_preds RENAME TO garch_preds_old;
+    ALTER TABLE garch_preds_old ALTER COLUMN id DROP IDENTITY IF EXISTS;
+    ALTER INDEX garch_preds_pkey RENAME TO garch_preds_old_pkey;
+    ALTER INDEX unique_pred_horizon RENAME TO unique_pred_horizon_old;
+
+    CREATE SEQUENCE garch_preds_id_seq AS INTEGER;
+    CREATE TABLE garch_preds (
+        id INTEGER NOT NULL DEFAULT nextval('garch_preds_id_seq'),
+        ticker VARCHAR(10) NOT NULL,
+        execution_time TIMESTAMP DEFAULT NOW(),
+        target_date DATE NOT NULL,
+        model_config VARCHAR(20) NOT NULL,
+        horizon INTEGER NOT NULL DEFAULT 1,
+        prediction DOUBLE PRECISION NOT NULL,
+        p SMALLINT GENERATED ALWAYS AS (split_part(model_config, '_', 1)::smallint) STORED,
+        q SMALLINT GENERATED ALWAYS AS (split_part(model_config, '_', 2)::smallint) STORED,
+        dist VARCHAR(10) GENERATED ALWAYS AS (split_part(model_config, '_', 3)) STORED,
+        PRIMARY KEY (id, target_date),
+        -- stored prediction lookups are answered from the index alone
+        CONSTRAINT unique_pred_horizon
+            UNIQUE (ticker, target_date, model_config, horizon) INCLUDE (prediction)
+    ) PARTITION BY RANGE (target_date);
+    ALTER SEQUENCE garch_preds_id_seq OWNED BY garch_preds.id;
+    CREATE TABLE garch_preds_default PARTITION OF garch_preds DEFAULT;
+    -- predictions pending evaluation (scripts/evaluate.py)
+    CREATE INDEX garch_preds_eval_idx
+        ON garch_preds (target_date, ticker, model_config)
+        INCLUDE (id, prediction)
+        WHERE horizon = 1;
+
+    CREATE TABLE garch_performance (
+        prediction_id INTEGER NOT NULL,
+        target_date DATE NOT NULL,
+        evaluation_date DATE NOT NULL,
+        realized_vol DOUBLE PRECISION,
+        realized_bv DOUBLE PRECISION,
+        realized_pk DOUBLE PRECISION,
+        realized_gk DOUBLE PRECISION,
+        realized_rv_sub DOUBLE PRECISION,
+        error_raw DOUBLE PRECISION,
+        error_abs DOUBLE PRECISION,
+        error_rel DOUBLE PRECISION,
+        error_sq DOUBLE PRECISION,
+        PRIMARY KEY (prediction_id, target_date),
+        CONSTRAINT fk_garch_performance_prediction
+            FOREIGN KEY (prediction_id, target_date)
+            REFERENCES garch_preds (id, target_date)
+            ON DELETE CASCADE
+    ) PARTITION BY RANGE (target_date);
+    CREATE TABLE garch_performance_default PARTITION OF garch_performance DEFAULT;
+    CREATE INDEX garch_performance_date_idx
+        ON garch_performance (target_date, prediction_id)
+        INCLUDE (error_raw, error_abs, error_rel, error_sq);
+
+    SELECT garch_ensure_partitions(
+        COALESCE((SELECT MIN(target_date) FROM garch_preds_old), CURRENT_DATE),
+        CURRENT_DATE
+    );
+    INSERT INTO garch_preds
+        (id, ticker, execution_time, target_date, model_config, horizon, prediction)
+    SELECT id, ticker, execution_time, target_date, model_config, horizon, prediction
+    FROM garch_preds_old;
+    SELECT setval(
+        'garch_preds_id_seq', COALESCE((SELECT MAX(id) FROM garch_preds), 0) + 1, false
+    );
+    INSERT INTO garch_performance
+    SELECT gp.prediction_id, p.target_date, gp.evaluation_date, gp.realized_vol,
+        gp.realized_bv, gp.realized_pk, gp.realized_gk, gp.realized_rv_sub,
+        gp.error_raw, gp.error_abs, gp.error_rel, gp.error_sq
+    FROM garch_performance_old gp
+        JOIN garch_preds_old p
+        ON gp.prediction_id = p.id;
+    DROP TABLE garch_performance_old;
+    DROP TABLE garch_preds_old;
+
+    ALTER TABLE garch_metrics_date
+        ADD COLUMN p SMALLINT GENERATED ALWAYS AS (split_part(model_config, '_', 1)::smallint) STORED,
+        ADD COLUMN q SMALLINT GENERATED ALWAYS AS (split_part(model_config, '_', 2)::smallint) STORED,
+        ADD COLUMN dist VARCHAR(10) GENERATED ALWAYS AS (split_part(model_config, '_', 3)) STORED;
+    ALTER TABLE garch_metrics_ticker
+        ADD COLUMN p SMALLINT GENERATED ALWAYS AS (split_part(model_config, '_', 1)::smallint) STORED,
+        ADD COLUMN q SMALLINT GENERATED ALWAYS AS (split_part(model_config, '_', 2)::smallint) STORED,
+        ADD COLUMN dist VARCHAR(10) GENERATED ALWAYS AS (split_part(model_config, '_', 3)) STORED;
+"""
+
+# config chosen by automatic model selection per ticker and criterion
+MODEL_SELECTION = """
+    CREATE TABLE garch_model_selection (
+        ticker VARCHAR(10) NOT NULL,
+        criterion VARCHAR(10) NOT NULL,
+        model_config VARCHAR(20) NOT NULL,
+        score DOUBLE PRECISION NOT NULL,
+        candidates INTEGER NOT NULL,
+        selected_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (ticker, criterion)
+    );
+"""
+
+MIGRATIONS = [
+    (1, "baseline schema", BASELINE),
+    (2, "partitioned, typed and indexed predictions and performance", PARTITIONED),
+    (3, "automatic model selection", MODEL_SELECTION),
+]
+
+
+def run_migrations(engine: Engine) -> None:
+    sql_create = text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    """)
+    sql_record = text("""
+        INSERT INTO schema_migrations (version, description)
+        VALUES (:version, :description)
+    """)
+    # monthly partitions ahead of the dates that will be written
+    sql_partitions = text(f"""
+        SELECT garch_ensure_partitions(
+            CURRENT_DATE,
+            (CURRENT_DATE + INTERVAL '{PARTITION_MONTHS_AHEAD} months')::date
+        )
+    """)
+
+    with engine.begin() as conn:
+        conn.execute(text(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_ID})"))
+        conn.execute(sql_create)
+        applied = set(
+            conn.execute(text("SELECT version FROM schema_migrations")).scalars()
+        )
+
+        for version, description, sql in MIGRATIONS:
+            if version in applied:
+                continue
+
+            conn.execute(text(sql))
+            conn.execute(sql_record, {"version": version, "description": description})
+            logger.info(f"Applied schema migration {version}: {description}")
+
+        conn.execute(sql_partitions)
+
+    logger.info(f"Database schema at version {MIGRATIONS[-1][0]}")
@@ -0,0 +1,191 @@
+import math
+import threading
+from datetime import datetime, timezone
+
+import pandas as pd
+from loguru import logger
+
+from src.config import (
+    SELECTION_CACHE_SIZE,
+    SELECTION_GRID,
+    SELECTION_HOLDOUT,
+    SELECTION_PRUNE_MARGIN,
+    SELECTION_QUEUE_TIMEOUT,
+    SELECTION_TTL,
+    CriterionType,
+    GarchParams,
+    ModelSelection,
+)
+from src.services.cache import TTLCache
+from src.services.database import (
+    get_model_config,
+    get_model_selection,
+    store_model_selection,
+)
+from src.services.executor import FitQueueFull, get_fit_executor
+from src.services.garch_model import get_garch_score
+from src.services.metrics import DB_ERRORS
+from src.services.singleflight import SingleFlight
+
+# (ticker, criterion) -> selected model, backed by garch_model_selection
+_selection_cache = TTLCache(maxsize=SELECTION_CACHE_SIZE, ttl=SELECTION_TTL)
+# (ticker, criterion) -> in-flight search
+_selection_flight = SingleFlight()
+_counts = {"searches": 0, "fitted": 0, "pruned": 0}
+_counts_lock = threading.Lock()
+
+
+def get_cached_selection(
+    symbol: str, criterion: CriterionType
+) -> ModelSelection | None:
+    # the ticker's selection unless it is older than SELECTION_TTL
+    key = (symbol, criterion)
+    selection = _selection_cache.get(key)
+    if selection is None:
+        try:
+            stored = get_model_selection(symbol, criterion)
+        except Exception:
+            logger.exception("DB error while loading the model selection")
+            DB_ERRORS.inc(operation="get_model_selection")
+            stored = None
+
+        if stored is not None:
+            selection = ModelSelection(**stored)
+            _selection_cache.set(key, selection)
+
+    if selection is None or is_stale(selection):
+        return None
+
+    return selection
+
+
+def is_stale(selection: ModelSelection) -> bool:
+    age = datetime.now(timezone.utc) - selection.selected_at
+    return age.total_seconds() > SELECTION_TTL
+
+
+def select_model(
+    symbol: str, log_returns: pd.Series, criterion: CriterionType
+) -> ModelSelection | None:
+    # concurrent auto requests for a ticker share one search
+    selection, _ = _selection_flight.do(
+        (symbol, criterion), search_model, symbol, log_returns, criterion
+    )
+    return selection
+
+
+def search_model(
+    symbol: str, log_returns: pd.Series, criterion: CriterionType
+) -> ModelSelection | None:
+    holdout = SELECTION_HOLDOUT if criterion == "oos" else 0
+    candidates = [
+        c for c in SELECTION_GRID if len(log_returns) - holdout >= (c.p + c.q + 2) * 50
+    ]
+    if not candidates:
+        logger.warning(f"Not enough data for any model selection candidate of {symbol}")
+        return None
+
+    # the simplest candidate of every distribution first
+    first: dict[str, GarchParams] = {}
+    for c in sorted(candidates, key=lambda c: (c.p + c.q, c.p)):
+        first.setdefault(c.dist, c)
+    scores = score_candidates(log_returns, list(first.values()), criterion, holdout)
+
+    # a distribution far behind the best is dominated, its larger orders would
+    # have to gain more than the margin in likelihood to catch up
+    best = min((score for _, score in scores.values()), default=math.inf)
+    dominated = {
+        params.dist
+        for params, score in scores.values()
+        if score > best + SELECTION_PRUNE_MARGIN
+    }
+    first_configs = {get_model_config(c) for c in first.values()}
+    rest = [
+        c
+        for c in candidates
+        if get_model_config(c) not in first_configs and c.dist not in dominated
+    ]
+    scores |= score_candidates(log_returns, rest, criterion, holdout)
+
+    fitted = len(first) + len(rest)
+    with _counts_lock:
+        _counts["searches"] += 1
+        _counts["fitted"] += fitted
+        _counts["pruned"] += len(candidates) - fitted
+
+    if not scores:
+        logger.error(f"No model selection candidate converged for {symbol}")
+        return None
+
+    params, score = min(scores.values(), key=lambda item: item[1])
+    selection = ModelSelection(
+        params=params,
+        criterion=criterion,
+        score=score,
+        candidates=fitted,
+        selected_at=datetime.now(timezone.utc),
+    )
+    logger.info(
+        f"Selected GARCH({params.p},{params.q}) {params.dist} for {symbol} by "
+        f"{criterion} ({fitted} fitted, {len(candidates) - fitted} pruned)"
+    )
+
+    _selection_cache.set((symbol, criterion), selection)
+    try:
+        store_model_selection(
+            symbol, criterion, params, score, fitted, selection.selected_at
+        )
+    except Exception:
+        logger.exception(f"DB error while storing the model selection of {symbol}")
+        DB_ERRORS.inc(operation="store_model_selection")
+
+    return selection
+
+
+def score_candidates(
+    log_returns: pd.Series,
+    candidates: list[GarchParams],
+    criterion: CriterionType,
+    holdout: int,
+) -> dict[str, tuple[GarchParams, float]]:
+    # all candidates in parallel on the fit pool, waiting for free slots. a
+    # slot not free within SELECTION_QUEUE_TIMEOUT rejects the request with
+    # FitQueueFull and cancels the candidates not started yet
+    executor = get_fit_executor()
+    futures = []
+    try:
+        for params in candidates:
+            future = executor.submit(
+                get_garch_score,
+                log_returns,
+                params,
+                criterion,
+                holdout,
+                block=True,
+                timeout=SELECTION_QUEUE_TIMEOUT,
+            )
+            futures.append((params, future))
+    except FitQueueFull:
+        for _, future in futures:
+            future.cancel()
+        raise
+
+    scores = {}
+    for params, future in futures:
+        try:
+            score = future.result()
+        except Exception:
+            logger.exception(
+                f"Fit worker failed for candidate {get_model_config(params)}"
+            )
+            continue
+
+        if score is not None and math.isfinite(score):
+            scores[get_model_config(params)] = (params, score)
+
+    return scores
+
+
+def get_selection_stats() -> dict:
+    with _counts_lock:
+        return _selection_cache.stats() | _counts
@@ -0,0 +1,650 @@
+import asyncio
+import math
+import queue
+import threading
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date
+from functools import partial
+from typing import cast
+
+import pandas as pd
+from fastapi import HTTPException
+from loguru import logger
+from numpy import log as nplog
+
+from src.config import (
+    FETCH_WORKERS,
+    FIT_WORKERS,
+    MAX_HORIZON,
+    PRED_CACHE_SIZE,
+    PRED_CACHE_TTL,
+    STREAM_CHUNK,
+    VECTORIZED_CHUNK,
+    BatchItemResult,
+    EngineType,
+    GarchParams,
+)
+from src.services.cache import TTLCache
+from src.services.database import (
+    get_fit_params,
+    get_model_config,
+    get_stored_preds,
+    store_fit_params,
+)
+from src.services.executor import get_fit_executor
+from src.services.forecast import get_term_structure
+from src.services.garch_filter import filter_update
+from src.services.garch_model import GarchFit, get_garch_pred
+from src.services.garch_vectorized import fit_garch_batch, get_garch_pred_vectorized
+from src.services.metrics import DB_ERRORS, stage_timer
+from src.services.price_cache import get_price_history
+from src.services.singleflight import SingleFlight
+from src.services.writer import get_pred_writer
+
+# (ticker, target_date, model_config, horizon) -> stored prediction
+_pred_cache = TTLCache(maxsize=PRED_CACHE_SIZE, ttl=PRED_CACHE_TTL)
+# (ticker, p, q, dist, target_date, engine, force_refit) -> in-flight GARCH fit
+_fit_flight = SingleFlight()
+
+FIT_ENGINES = {"arch": get_garch_pred, "vectorized": get_garch_pred_vectorized}
+
+
+def get_log_returns(symbol: str) -> tuple[str, pd.Series, date]:
+    try:
+        with stage_timer("download"):
+            symbol, data, target_date = get_price_history(symbol)
+
+        logger.info(
+            f"Got data from FinFetcher, rows: {data.count()}, target_date: {target_date}"
+        )
+
+    except Exception as e:
+        logger.exception("Error while getting data from FinFetcher")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if data is None or target_date is None:
+        raise HTTPException(
+            status_code=404, detail=f"Data for symbol '{symbol}' not found"
+        )
+
+    with stage_timer("log_returns"):
+        log_returns = nplog((data["Close"] / data["Close"].shift(1)).dropna()) * 100
+
+    return symbol, cast(pd.Series, log_returns), target_date
+
+
+def check_history(log_returns: pd.Series, params: GarchParams) -> None:
+    n_params = params.p + params.q + 2
+
+    if len(log_returns) < n_params * 50:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Not enough data points for GARCH({params.p},{params.q}) inference"
+            f"Required: {n_params * 50}, Available: {len(log_returns)}",
+        )
+
+
+def check_horizon(horizon: int) -> None:
+    if not 1 <= horizon <= MAX_HORIZON:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Horizon must be between 1 and {MAX_HORIZON}, got {horizon}",
+        )
+
+
+def get_stored_preds_cached(
+    keys: list[tuple[str, date, GarchParams]], horizon: int = 1
+) -> dict[tuple[str, date, str], list[float]]:
+    # stored term structures, only complete ones (every horizon up to horizon)
+    found = {}
+    missing = []
+    for ticker, target_date, params in keys:
+        key = (ticker, target_date, get_model_config(params))
+        preds = [_pred_cache.get((*key, h)) for h in range(1, horizon + 1)]
+        if None in preds:
+            missing.append((ticker, target_date, params))
+        else:
+            found[key] = preds
+
+    if missing:
+        try:
+            with stage_timer("db_lookup"):
+                stored = get_stored_preds(missing, horizon)
+        except Exception:
+            logger.exception("DB error while looking up stored predictions")
+            DB_ERRORS.inc(operation="get_stored_preds")
+            stored = {}
+
+        for key, pred in stored.items():
+            _pred_cache.set(key, pred)
+
+        for ticker, target_date, params in missing:
+            key = (ticker, target_date, get_model_config(params))
+            preds = [stored.get((*key, h)) for h in range(1, horizon + 1)]
+            if None not in preds:
+                found[key] = preds
+
+    return found
+
+
+def get_stored_pred(
+    symbol: str, target_date: date, params: GarchParams, horizon: int = 1
+) -> list[float] | None:
+    stored = get_stored_preds_cached([(symbol, target_date, params)], horizon)
+    return stored.get((symbol, target_date, get_model_config(params)))
+
+
+def store_term_structures(
+    preds: list[tuple[str, list[float], date, GarchParams]],
+) -> None:
+    rows = [
+        (ticker, pred, target_date, params, h)
+        for ticker, term_structure, target_date, params in preds
+        for h, pred in enumerate(term_structure, start=1)
+    ]
+    if not rows:
+        return
+
+    # written in the background, the cache serves them until then
+    get_pred_writer().put(rows)
+
+    for ticker, pred, target_date, params, h in rows:
+        _pred_cache.set((ticker, target_date, get_model_config(params), h), pred)
+
+
+def get_pred_cache_stats() -> dict:
+    return _pred_cache.stats()
+
+
+def get_flight_key(
+    symbol: str,
+    params: GarchParams,
+    target_date: date,
+    engine: EngineType,
+    force_refit: bool,
+) -> tuple:
+    # the engines' estimates differ slightly, a request gets its engine's fit.
+    # a forced refit never joins a fit that may end as a filter update
+    return (symbol, params.p, params.q, params.dist, target_date, engine, force_refit)
+
+
+def fit_model(
+    symbol: str,
+    log_returns: pd.Series,
+    params: GarchParams,
+    target_date: date,
+    engine: EngineType = "arch",
+    force_refit: bool = False,
+) -> tuple[GarchFit | None, bool]:
+    def fit() -> GarchFit | None:
+        states = get_fit_states([(symbol, params)])
+        state = states.get((symbol, get_model_config(params)))
+        if not force_refit:
+            garch_fit = filter_update(state, params, log_returns)
+            if garch_fit is not None:
+                return garch_fit
+
+        start = None if state is None else state["params"]
+        # raises FitQueueFull instead of queueing without limit
+        future = get_fit_executor().submit(
+            FIT_ENGINES[engine], log_returns, params, start
+        )
+        return future.result()
+
+    # identical concurrent requests wait for the leader's fit instead of refitting
+    key = get_flight_key(symbol, params, target_date, engine, force_refit)
+    return _fit_flight.do(key, fit)
+
+
+def get_fit_flight_stats() -> dict:
+    return _fit_flight.stats()
+
+
+def run_batch(
+    symbols: list[str],
+    configs: list[GarchParams],
+    force_refit: bool = False,
+    engine: EngineType = "arch",
+    horizon: int = 1,
+) -> list[BatchItemResult]:
+    symbols = list(dict.fromkeys(s.upper() for s in symbols))
+    configs = list({(c.p, c.q, c.dist): c for c in configs}.values())
+
+    # fetching is network bound -> threads, fitting is CPU bound -> processes
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as fetch_pool:
+        fetched = dict(zip(symbols, fetch_pool.map(_fetch_safe, symbols)))
+
+    results, fitted, to_fit, last_obs_dates = prepare_batch(
+        symbols, fetched, configs, force_refit, horizon
+    )
+
+    if engine == "vectorized":
+        pending = submit_vectorized(to_fit, force_refit)
+    else:
+        pending = submit_arch(to_fit, force_refit)
+
+    for item, future, shared in pending:
+        garch_fit = get_fit_result(item, future, shared, horizon)
+        if garch_fit is not None:
+            fitted.append((item, garch_fit))
+
+    store_fits(fitted, last_obs_dates)
+    return results
+
+
+def iter_batch(
+    symbols: list[str],
+    configs: list[GarchParams],
+    force_refit: bool = False,
+    engine: EngineType = "arch",
+    horizon: int = 1,
+    cancelled: threading.Event | None = None,
+) -> Iterator[BatchItemResult]:
+    # run_batch in completion order, STREAM_CHUNK tickers at a time: the next
+    # chunk downloads while the current one fits, only one chunk of histories
+    # is held. a set `cancelled` stops submitting fits and starting chunks,
+    # fits already running finish and are stored
+    symbols = list(dict.fromkeys(s.upper() for s in symbols))
+    configs = list({(c.p, c.q, c.dist): c for c in configs}.values())
+    chunks = [
+        symbols[i : i + STREAM_CHUNK] for i in range(0, len(symbols), STREAM_CHUNK)
+    ]
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as fetch_pool:
+        fetches: list[Future] = []
+        if chunks:
+            fetches = [fetch_pool.submit(_fetch_safe, s) for s in chunks[0]]
+        try:
+            for k, chunk in enumerate(chunks):
+                fetched = {s: f.result() for s, f in zip(chunk, fetches)}
+                fetches = []
+                if k + 1 < len(chunks) and not is_set(cancelled):
+                    fetches = [fetch_pool.submit(_fetch_safe, s) for s in chunks[k + 1]]
+
+                results, fitted, to_fit, last_obs_dates = prepare_batch(
+                    chunk, fetched, configs, force_refit, horizon
+                )
+                fetched.clear()
+
+                # errors, stored predictions and filter updates are done already
+                fitting = {id(item) for item, _, _ in to_fit}
+                try:
+                    for item in results:
+                        if id(item) not in fitting:
+                            yield item
+                    for item, garch_fit in iter_fits(
+                        to_fit, engine, horizon, force_refit, cancelled
+                    ):
+                        if garch_fit is not None:
+                            fitted.append((item, garch_fit))
+                        yield item
+                finally:
+                    store_fits(fitted, last_obs_dates)
+
+                if is_set(cancelled):
+                    logger.info(
+                        f"Batch stream cancelled after {k + 1}/{len(chunks)} chunks"
+                    )
+                    return
+        finally:
+            for f in fetches:
+                f.cancel()
+
+
+def iter_fits(
+    to_fit: list[tuple[BatchItemResult, pd.Series, list[float] | None]],
+    engine: EngineType,
+    horizon: int,
+    force_refit: bool,
+    cancelled: threading.Event | None,
+) -> Iterator[tuple[BatchItemResult, GarchFit | None]]:
+    # submitting waits for free fit slots, so it runs in the background and
+    # finished fits are handed over as they complete. yields each item with
+    # the fit it has to store (None if failed or stored by another request)
+    done: queue.Queue = queue.Queue()
+    submitted = [0]
+
+    if engine == "vectorized":
+        groups: dict[str, list] = {}
+        for entry in to_fit:
+            groups.setdefault(get_model_config(entry[0].model_params), []).append(entry)
+        submit_fn, batches = submit_vectorized, list(groups.values())
+    else:
+        submit_fn, batches = submit_arch, [[entry] for entry in to_fit]
+
+    def submit() -> None:
+        try:
+            for batch in batches:
+                if is_set(cancelled):
+                    break
+                try:
+                    pending = submit_fn(batch, force_refit)
+                except Exception as e:
+                    logger.exception("Could not submit batch fits")
+                    pending = []
+                    for item, _, _ in batch:
+                        failed: Future = Future()
+                        failed.set_exception(e)
+                        pending.append((item, failed, False))
+
+                for entry in pending:
+                    submitted[0] += 1
+                    entry[1].add_done_callback(lambda _, entry=entry: done.put(entry))
+        finally:
+            done.put(None)
+
+    threading.Thread(target=submit, name="batch-submit", daemon=True).start()
+
+    received, finished = 0, False
+    while not finished or received < submitted[0]:
+        entry = done.get()
+        if entry is None:
+            finished = True
+            continue
+
+        received += 1
+        item, future, shared = entry
+        yield item, get_fit_result(item, future, shared, horizon)
+
+
+async def stream_batch(
+    symbols: list[str],
+    configs: list[GarchParams],
+    force_refit: bool = False,
+    engine: EngineType = "arch",
+    horizon: int = 1,
+) -> AsyncIterator[BatchItemResult]:
+    # iter_batch runs in its own thread and hands results to the event loop,
+    # leaving the loop early (the client went away) cancels the batch
+    loop = asyncio.get_running_loop()
+    results: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def run() -> None:
+        items = iter_batch(symbols, configs, force_refit, engine, horizon, cancelled)
+        try:
+            for item in items:
+                if not cancelled.is_set():
+                    loop.call_soon_threadsafe(results.put_nowait, item)
+        except Exception as e:
+            logger.exception("Batch stream failed")
+            loop.call_soon_threadsafe(results.put_nowait, e)
+        finally:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(results.put_nowait, None)
+
+    threading.Thread(target=run, name="batch-stream", daemon=True).start()
+    try:
+        while (item := await results.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+
+
+def prepare_batch(
+    symbols: list[str],
+    fetched: dict[str, tuple[str, pd.Series, date] | str],
+    configs: list[GarchParams],
+    force_refit: bool,
+    horizon: int,
+) -> tuple[
+    list[BatchItemResult],
+    list[tuple[BatchItemResult, GarchFit]],
+    list[tuple[BatchItemResult, pd.Series, list[float] | None]],
+    dict[str, date],
+]:
+    # one result per (symbol, config) in input order. stored predictions and
+    # filter updates are set here, the rest is returned to be fitted
+    stored = {}
+    if not force_refit:
+        stored = get_stored_preds_cached(
+            [
+                (data[0], data[2], params)
+                for data in fetched.values()
+                if not isinstance(data, str)
+                for params in configs
+            ],
+            horizon,
+        )
+
+    states = get_fit_states(
+        [
+            (data[0], params)
+            for data in fetched.values()
+            if not isinstance(data, str)
+            for params in configs
+        ]
+    )
+
+    last_obs_dates = {
+        data[0]: data[1].index[-1]
+        for data in fetched.values()
+        if not isinstance(data, str)
+    }
+
+    results: list[BatchItemResult] = []
+    fitted: list[tuple[BatchItemResult, GarchFit]] = []
+    to_fit: list[tuple[BatchItemResult, pd.Series, list[float] | None]] = []
+
+    for symbol in symbols:
+        data = fetched[symbol]
+        for params in configs:
+            item = BatchItemResult(symbol=symbol, model_params=params)
+            results.append(item)
+
+            if isinstance(data, str):
+                item.error = data
+                continue
+
+            fetched_symbol, log_returns, target_date = data
+            item.symbol = fetched_symbol
+            item.target_date = target_date
+
+            stored_preds = stored.get(
+                (fetched_symbol, target_date, get_model_config(params))
+            )
+            if stored_preds is not None:
+                set_term_structure(item, stored_preds)
+                continue
+
+            try:
+                check_history(log_returns, params)
+            except HTTPException as e:
+                item.error = e.detail
+                continue
+
+            state = states.get((fetched_symbol, get_model_config(params)))
+            if not force_refit:
+                garch_fit = filter_update(state, params, log_returns)
+                if garch_fit is not None:
+                    set_term_structure(
+                        item, get_term_structure(garch_fit, params, horizon)
+                    )
+                    fitted.append((item, garch_fit))
+                    continue
+
+            start = None if state is None else state["params"]
+            to_fit.append((item, log_returns, start))
+
+    return results, fitted, to_fit, last_obs_dates
+
+
+def get_fit_result(
+    item: BatchItemResult, future: Future, shared: bool, horizon: int
+) -> GarchFit | None:
+    # sets the item's term structure or error, returns the fit if this
+    # request has to store it
+    try:
+        garch_fit = future.result()
+    except Exception as e:
+        logger.exception(f"Fit worker failed for {item.symbol}")
+        item.error = str(e)
+        return None
+
+    if garch_fit is None:
+        item.error = f"GARCH model failed to converge for {item.symbol} (check logs)"
+        return None
+
+    set_term_structure(item, get_term_structure(garch_fit, item.model_params, horizon))
+
+    # the request that started a shared fit stores it
+    return None if shared else garch_fit
+
+
+def store_fits(
+    fitted: list[tuple[BatchItemResult, GarchFit]], last_obs_dates: dict[str, date]
+) -> None:
+    store_term_structures(
+        [
+            (item.symbol, item.term_structure, item.target_date, item.model_params)
+            for item, _ in fitted
+            if item.target_date is not None and item.term_structure is not None
+        ]
+    )
+
+    save_fit_params(
+        [
+            (
+                item.symbol,
+                item.model_params,
+                garch_fit,
+                last_obs_dates[item.symbol],
+                item.target_date,
+            )
+            for item, garch_fit in fitted
+            if item.target_date is not None
+        ]
+    )
+
+
+def is_set(event: threading.Event | None) -> bool:
+    return event is not None and event.is_set()
+
+
+def set_term_structure(item: BatchItemResult, term_structure: list[float]) -> None:
+    item.term_structure = term_structure
+    item.predicted_volatility = term_structure[-1]
+
+
+def submit_arch(
+    to_fit: list[tuple[BatchItemResult, pd.Series, list[float] | None]],
+    force_refit: bool,
+) -> list[tuple[BatchItemResult, Future, bool]]:
+    executor = get_fit_executor()
+    pending = []
+    for item, log_returns, start in to_fit:
+        # a batch waits for free slots instead of being rejected
+        future, shared = _fit_flight.submit(
+            get_batch_flight_key(item, "arch", force_refit),
+            partial(executor.submit, block=True),
+            get_garch_pred,
+            log_returns,
+            item.model_params,
+            start,
+        )
+        pending.append((item, future, shared))
+
+    return pending
+
+
+def submit_vectorized(
+    to_fit: list[tuple[BatchItemResult, pd.Series, list[float] | None]],
+    force_refit: bool,
+) -> list[tuple[BatchItemResult, Future, bool]]:
+    executor = get_fit_executor()
+    by_config: dict[str, list] = {}
+    for entry in to_fit:
+        by_config.setdefault(get_model_config(entry[0].model_params), []).append(entry)
+
+    pending = []
+    for entries in by_config.values():
+        # one fit job per chunk of series, chunks spread over all fit workers
+        size = min(VECTORIZED_CHUNK, math.ceil(len(entries) / FIT_WORKERS))
+        for i in range(0, len(entries), size):
+            chunk = entries[i : i + size]
+            params = chunk[0][0].model_params
+
+            def submit(leaders: list[int], chunk=chunk, params=params) -> Future:
+                return executor.submit(
+                    fit_garch_batch,
+                    [chunk[j][1] for j in leaders],
+                    params,
+                    [chunk[j][2] for j in leaders],
+                    block=True,
+                )
+
+            calls = _fit_flight.submit_many(
+                [
+                    get_batch_flight_key(item, "vectorized", force_refit)
+                    for item, _, _ in chunk
+                ],
+                submit,
+            )
+            pending.extend(
+                (item, future, shared)
+                for (item, _, _), (future, shared) in zip(chunk, calls)
+            )
+
+    return pending
+
+
+def get_batch_flight_key(
+    item: BatchItemResult, engine: EngineType, force_refit: bool
+) -> tuple:
+    return get_flight_key(
+        item.symbol,
+        item.model_params,
+        cast(date, item.target_date),
+        engine,
+        force_refit,
+    )
+
+
+def get_fit_states(
+    keys: list[tuple[str, GarchParams]],
+) -> dict[tuple[str, str], dict]:
+    try:
+        return get_fit_params(keys)
+    except Exception:
+        logger.exception("DB error while loading fitted parameters and state")
+        DB_ERRORS.inc(operation="get_fit_params")
+        return {}
+
+
+def save_fit_params(fits: list[tuple[str, GarchParams, GarchFit, date, date]]) -> None:
+    # (ticker, config, fit, date of the last return in the fit, target date)
+    states = [
+        (
+            ticker,
+            params,
+            {
+                "params": garch_fit.params,
+                "resid2": garch_fit.resid2,
+                "sigma2": garch_fit.sigma2,
+                "last_obs_date": last_obs_date,
+                "n_updates": garch_fit.n_updates,
+                "z2_sum": garch_fit.z2_sum,
+            },
+            target_date,
+        )
+        for ticker, params, garch_fit, last_obs_date, target_date in fits
+    ]
+    try:
+        store_fit_params(states)
+    except Exception:
+        logger.exception(f"DB error while storing parameters of {len(fits)} fits")
+        DB_ERRORS.inc(operation="store_fit_params")
+
+
+def _fetch_safe(symbol: str) -> tuple[str, pd.Series, date] | str:
+    try:
+        return get_log_returns(symbol)
+    except HTTPException as e:
+        return e.detail
+    except Exception as e:
+        # an unexpected failure fails this ticker, not the whole batch
+        logger.exception(f"Could not fetch price history for {symbol}")
+        return str(e)
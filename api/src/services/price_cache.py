@@ -0,0 +1,211 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import pandas as pd
+from loguru import logger
+
+from src.config import (
+    PRICE_CACHE_DIR,
+    PRICE_CACHE_MAX_MB,
+    PRICE_CACHE_MAX_STALE,
+    PRICE_CACHE_TTL,
+)
+from src.services.data_source import get_fetcher
+
+HISTORY_PERIOD = "4y"
+# smallest yfinance period that still covers a gap of N calendar days
+INCREMENTAL_PERIODS = [(5, "5d"), (28, "1mo"), (90, "3mo"), (180, "6mo"), (365, "1y")]
+
+_stats = {"hits": 0, "incremental": 0, "misses": 0, "stale": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+_symbol_locks: defaultdict[str, threading.Lock] = defaultdict(threading.Lock)
+
+
+def get_price_history(symbol: str) -> tuple[str, pd.DataFrame, date]:
+    symbol = symbol.upper()
+
+    # one download per symbol at a time, concurrent callers wait and hit the cache
+    with _symbol_locks[symbol]:
+        cached = _read(symbol)
+
+        if cached is not None:
+            data, meta = cached
+            age = time.time() - meta["fetched_at"]
+            target_date = date.fromisoformat(meta["target_date"])
+
+            if age < PRICE_CACHE_TTL:
+                _count("hits")
+                _touch(symbol)
+                return meta["symbol"], data, target_date
+
+            try:
+                return _refresh(symbol, data)
+            except Exception:
+                if age > PRICE_CACHE_MAX_STALE:
+                    raise
+                logger.warning(
+                    f"Refresh of {symbol} failed, serving cached history "
+                    f"({age / 3600:.1f}h old)"
+                )
+                _count("stale")
+                return meta["symbol"], data, target_date
+
+        return _download(symbol)
+
+
+def get_cached_target_date(symbol: str) -> date | None:
+    meta = _read_meta(symbol.upper())
+    if meta is None or time.time() - meta["fetched_at"] >= PRICE_CACHE_TTL:
+        return None
+
+    return date.fromisoformat(meta["target_date"])
+
+
+def get_cache_stats() -> dict:
+    with _stats_lock:
+        stats: dict[str, float] = dict(_stats)
+
+    lookups = stats["hits"] + stats["incremental"] + stats["misses"] + stats["stale"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+
+def _refresh(symbol: str, cached: pd.DataFrame) -> tuple[str, pd.DataFrame, date]:
+    gap = (date.today() - cached.index[-1]).days
+    period = next((p for days, p in INCREMENTAL_PERIODS if gap + 3 <= days), None)
+    if period is None:
+        return _download(symbol)
+
+    fetcher = get_fetcher(symbol)
+    new_data = fetcher.get_data(period=period)
+    target_date = fetcher.target_date
+    if new_data is None or target_date is None:
+        raise ValueError(f"Incremental fetch for {symbol} returned no data")
+
+    overlap = cached.index.intersection(new_data.index)
+    if len(overlap) == 0:
+        return _download(symbol)
+
+    # adjusted closes of the whole history change after dividends and splits
+    old_close = cached.loc[overlap, "Close"]
+    new_close = new_data.loc[overlap, "Close"]
+    if ((old_close - new_close).abs() > 1e-6 * new_close.abs()).any():
+        logger.info(f"Adjusted prices of {symbol} changed, reloading full history")
+        return _download(symbol)
+
+    data = pd.concat([cached[~cached.index.isin(new_data.index)], new_data])
+    start = date.today() - timedelta(days=4 * 365)
+    data = data[data.index >= start]
+
+    _count("incremental")
+    logger.debug(f"Appended {len(new_data) - len(overlap)} new rows for {symbol}")
+    _write(symbol, fetcher.symbol, data, target_date)
+    return fetcher.symbol, data, target_date
+
+
+def _download(symbol: str) -> tuple[str, pd.DataFrame, date]:
+    fetcher = get_fetcher(symbol)
+    data = fetcher.get_data(period=HISTORY_PERIOD)
+    target_date = fetcher.target_date
+    if data is None or target_date is None:
+        raise ValueError(f"Data for symbol '{symbol}' not found")
+
+    _count("misses")
+    _write(symbol, fetcher.symbol, data, target_date)
+    return fetcher.symbol, data, target_date
+
+
+def _path(symbol: str, ext: str) -> str:
+    return os.path.join(PRICE_CACHE_DIR, re.sub(r"[^\w.-]", "_", symbol) + ext)
+
+
+def _read_meta(symbol: str) -> dict | None:
+    try:
+        with open(_path(symbol, ".json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _read(symbol: str) -> tuple[pd.DataFrame, dict] | None:
+    meta = _read_meta(symbol)
+    if meta is None:
+        return None
+
+    try:
+        data = pd.read_parquet(_path(symbol, ".parquet"))
+    except Exception:
+        logger.warning(f"Unreadable cache file for {symbol}, dropping it")
+        _remove(symbol)
+        return None
+
+    if data.empty:
+        return None
+
+    return data, meta
+
+
+def _write(symbol: str, fetched_symbol: str, data: pd.DataFrame, target: date) -> None:
+    try:
+        os.makedirs(PRICE_CACHE_DIR, exist_ok=True)
+        meta = {
+            "symbol": fetched_symbol,
+            "fetched_at": time.time(),
+            "target_date": target.isoformat(),
+        }
+
+        # write to temp files + rename, other workers never see partial files
+        path, meta_path = _path(symbol, ".parquet"), _path(symbol, ".json")
+        data.to_parquet(path + ".tmp")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+        os.replace(meta_path + ".tmp", meta_path)
+
+        _evict()
+    except Exception:
+        logger.exception(f"Could not write price cache for {symbol}")
+
+
+def _touch(symbol: str) -> None:
+    try:
+        os.utime(_path(symbol, ".parquet"))
+    except OSError:
+        pass
+
+
+def _remove(symbol: str) -> None:
+    for ext in (".parquet", ".json"):
+        try:
+            os.remove(_path(symbol, ext))
+        except OSError:
+            pass
+
+
+def _evict() -> None:
+    files = []
+    for entry in os.scandir(PRICE_CACHE_DIR):
+        if entry.name.endswith(".parquet"):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.name))
+
+    total = sum(size for _, size, _ in files)
+    max_bytes = PRICE_CACHE_MAX_MB * 1024 * 1024
+
+    # least recently used first
+    for _, size, name in sorted(files):
+        if total <= max_bytes:
+            break
+        _remove(name.removesuffix(".parquet"))
+        total -= size
+        _count("evictions")
+
+
+def _count(key: str) -> None:
+    with _stats_lock:
+        _stats[key] += 1
@@ -1,6 +1,29 @@
+import hashlib
+
 import pandas as pd
+from loguru import logger
 from numpy import sqrt as npsq
 
+from src.config import REPORT_VERSION_TTL, ReportResponse
+from src.services.cache import TTLCache
+from src.services.database import get_report_version
+from src.services.metrics import DB_ERRORS, stage_timer
+
+# data version -> rendered /report body, the version itself is looked up at
+# most every REPORT_VERSION_TTL seconds
+_report_cache = TTLCache(maxsize=2, ttl=24 * 3600)
+_version_cache = TTLCache(maxsize=1, ttl=REPORT_VERSION_TTL)
+
+ERRORS = ["error_abs", "error_rel", "error_sq", "error_raw"]
+
+
+def get_means(df_sums: pd.DataFrame, keys: list[str]) -> pd.DataFrame:
+    # mean errors from the aggregated sums and counts
+    means = pd.DataFrame({e: df_sums[f"sum_{e}"] / df_sums["n"] for e in ERRORS})
+    means["error_rel"] = means["error_rel"] * 100
+    means.index = pd.MultiIndex.from_frame(df_sums[keys])
+    return means
+
 
 def get_metrics(df_grouped: pd.DataFrame) -> pd.DataFrame:
     mape = df_grouped["error_rel"]
@@ -19,16 +42,15 @@ def get_metrics(df_grouped: pd.DataFrame) -> pd.DataFrame:
 
 
 def get_metrics_data(
-    df: pd.DataFrame,
+    df_date: pd.DataFrame, df_ticker: pd.DataFrame
 ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    df["model_config"] = [
-        f"p:{p} q:{q} dist:{d}" for p, q, d in df["model_config"].str.split("_")
-    ]
+    for df in (df_date, df_ticker):
+        df["model_config"] = [
+            f"p:{p} q:{q} dist:{d}" for p, q, d in zip(df["p"], df["q"], df["dist"])
+        ]
 
-    df_grouped_date = df.groupby(["target_date", "model_config"]).mean(
-        numeric_only=True
-    )
-    df_grouped_ticker = df.groupby(["ticker", "model_config"]).mean(numeric_only=True)
+    df_grouped_date = get_means(df_date, ["target_date", "model_config"])
+    df_grouped_ticker = get_means(df_ticker, ["ticker", "model_config"])
 
     worst_tickers = (
         df_grouped_ticker.sort_values("error_abs", ascending=False)
@@ -76,3 +98,44 @@ def get_metrics_data(
     )
 
     return metrics_df_date, metrics_df_ticker, worst_tickers
+
+
+async def get_data_version() -> str | None:
+    version = _version_cache.get("version")
+    if version is None:
+        try:
+            with stage_timer("report_version"):
+                version = await get_report_version()
+        except Exception:
+            logger.exception("DB error while looking up the report data version")
+            DB_ERRORS.inc(operation="get_report_version")
+            return None
+        _version_cache.set("version", version)
+
+    return version
+
+
+def get_etag(version: str) -> str:
+    return '"' + hashlib.sha1(version.encode()).hexdigest()[:16] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def get_cached_report(version: str) -> bytes | None:
+    return _report_cache.get(version)
+
+
+def render_report(version: str | None, report: dict) -> bytes:
+    body = ReportResponse(**report).model_dump_json().encode()
+    if version is not None:
+        _report_cache.set(version, body)
+    return body
+
+
+def get_report_cache_stats() -> dict:
+    return _report_cache.stats()
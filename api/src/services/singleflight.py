@@ -0,0 +1,139 @@
+import threading
+from collections.abc import Callable, Hashable
+from concurrent.futures import Future
+from typing import Any
+
+
+# concurrent calls with the same key share the result of the first one (leader)
+class SingleFlight:
+    def __init__(self) -> None:
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable, *args) -> tuple[Any, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            shared = False
+            if future is not None:
+                shared = True
+                self.coalesced += 1
+            else:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+
+        if shared:
+            return future.result(), True
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._forget(key, future)
+
+    def submit(
+        self, key: Hashable, submit_fn: Callable[..., Future], *args
+    ) -> tuple[Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, True
+
+            # placeholder, submit_fn may block and must not run under the lock
+            future = Future()
+            self._calls[key] = future
+            self.leaders += 1
+
+        try:
+            inner = submit_fn(*args)
+        except BaseException as e:
+            self._forget(key, future)
+            future.set_exception(e)
+            raise
+
+        inner.add_done_callback(lambda f: self._resolve(key, future, f))
+        return future, False
+
+    def submit_many(
+        self, keys: list[Hashable], submit_fn: Callable[[list[int]], Future]
+    ) -> list[tuple[Future, bool]]:
+        # one job for all keys not in flight yet, submit_fn gets their indexes
+        # and returns a future of a list of results in the same order
+        calls: list[tuple[Future, bool]] = []
+        leaders = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                future = self._calls.get(key)
+                if future is not None:
+                    self.coalesced += 1
+                    calls.append((future, True))
+                    continue
+
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+                calls.append((future, False))
+                leaders.append(i)
+
+        if not leaders:
+            return calls
+
+        try:
+            inner = submit_fn(leaders)
+        except BaseException as e:
+            for i in leaders:
+                self._forget(keys[i], calls[i][0])
+                calls[i][0].set_exception(e)
+            raise
+
+        inner.add_done_callback(
+            lambda f: self._resolve_many(
+                [keys[i] for i in leaders], [calls[i][0] for i in leaders], f
+            )
+        )
+        return calls
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+    def _resolve(self, key: Hashable, future: Future, inner: Future) -> None:
+        self._forget(key, future)
+        if inner.cancelled():
+            future.cancel()
+        elif inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
+
+    def _resolve_many(
+        self, keys: list[Hashable], futures: list[Future], inner: Future
+    ) -> None:
+        for key, future in zip(keys, futures):
+            self._forget(key, future)
+
+        if inner.cancelled():
+            for future in futures:
+                future.cancel()
+        elif inner.exception() is not None:
+            for future in futures:
+                future.set_exception(inner.exception())
+        else:
+            for future, result in zip(futures, inner.result()):
+                future.set_result(result)
+
+    def _forget(self, key: Hashable, future: Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+
+from src import IMPORT_STARTED
+from src.config import DATA_SOURCE, WARMUP, WARMUP_OBS, GarchParams
+from src.services.executor import get_fit_executor
+from src.services.forecast import get_term_structure
+from src.services.garch_model import get_garch_pred
+from src.services.garch_vectorized import fit_garch_batch
+
+# cold start: arch, scipy.stats and finfetcher are imported lazily, the
+# warmup imports them and runs every distribution's first fit in the fit
+# workers (in their initializer) and here, with the first forecasts
+WARMUP_SEED = 0
+WARMUP_HORIZON = 5
+WARMUP_CONFIGS = [
+    GarchParams(p=1, q=1, dist=dist)  # type: ignore
+    for dist in ["normal", "t", "skewt", "ged"]
+]
+
+_report: dict = {
+    "import_seconds": None,
+    "startup_seconds": None,
+    "warmup": "enabled" if WARMUP else "disabled",
+    "warmup_seconds": None,
+    "first_request_seconds": {},
+}
+_lock = threading.Lock()
+
+
+def get_warmup_returns() -> np.ndarray:
+    # GARCH(1,1) returns with t(6) shocks, every distribution converges on them
+    rng = np.random.default_rng(WARMUP_SEED)
+    z = rng.standard_t(6, WARMUP_OBS) / np.sqrt(1.5)
+    returns = np.empty(WARMUP_OBS)
+    var = 1.0
+    for t in range(WARMUP_OBS):
+        returns[t] = np.sqrt(var) * z[t]
+        var = 0.05 + 0.1 * returns[t] ** 2 + 0.85 * var
+    return returns
+
+
+def warm_up_worker() -> None:
+    start = time.perf_counter()
+    returns = get_warmup_returns()
+    for params in WARMUP_CONFIGS:
+        get_garch_pred(returns, params)
+        fit_garch_batch([returns, returns], params)
+    logger.info(f"Fit worker warmed up in {time.perf_counter() - start:.2f}s")
+
+
+def record_imported() -> None:
+    with _lock:
+        _report["import_seconds"] = time.perf_counter() - IMPORT_STARTED
+
+
+def start_warmup() -> None:
+    elapsed = time.perf_counter() - IMPORT_STARTED
+    with _lock:
+        _report["startup_seconds"] = elapsed
+    logger.info(
+        f"API started in {elapsed:.2f}s (imports {_report['import_seconds']:.2f}s)"
+    )
+
+    if WARMUP:
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+
+
+def warm_up() -> None:
+    with _lock:
+        _report["warmup"] = "running"
+    start = time.perf_counter()
+    try:
+        # the workers warm up in their initializer, this only starts them
+        futures = get_fit_executor().start_workers()
+
+        # the forecasts of this process run on local fits
+        returns = get_warmup_returns()
+        for params in WARMUP_CONFIGS:
+            garch_fit = get_garch_pred(returns, params)
+            if garch_fit is not None:
+                get_term_structure(garch_fit, params, WARMUP_HORIZON)
+
+        if DATA_SOURCE == "finfetcher":
+            import finfetcher  # noqa: F401
+
+        for future in futures:
+            future.result()
+        state = "done"
+    except Exception:
+        logger.exception("Warmup failed, first requests pay the cold start")
+        state = "failed"
+
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _report["warmup"] = state
+        _report["warmup_seconds"] = elapsed
+    logger.info(f"Warmup {state} in {elapsed:.2f}s")
+
+
+def record_request(path: str, seconds: float) -> None:
+    # the first request of every endpoint, what the warmup did not cover
+    first = _report["first_request_seconds"]
+    if path in first:
+        return
+    with _lock:
+        if path in first:
+            return
+        first[path] = seconds
+    logger.info(f"First request to {path} took {seconds:.3f}s")
+
+
+def get_startup_stats() -> dict:
+    with _lock:
+        return _report | {
+            "first_request_seconds": dict(_report["first_request_seconds"])
+        }
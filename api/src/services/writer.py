@@ -0,0 +1,187 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import date
+
+from loguru import logger
+
+from src.config import (
+    PRED_SPILL_PATH,
+    WRITE_BATCH_SIZE,
+    WRITE_FLUSH_INTERVAL,
+    WRITE_QUEUE_MAX,
+    GarchParams,
+)
+from src.services.database import store_preds_bulk
+from src.services.metrics import DB_ERRORS, stage_timer
+
+PredRow = tuple[str, float, date, GarchParams, int]
+
+
+# write-behind for garch_preds: requests enqueue their rows, a background
+# thread flushes them as multi-row upserts when WRITE_BATCH_SIZE rows are
+# queued or WRITE_FLUSH_INTERVAL seconds passed. rows that can not be written
+# (DB unreachable, queue full) are spilled to a local file and replayed after
+# the next successful flush
+class PredWriter:
+    def __init__(
+        self, batch_size: int, flush_interval: float, max_queued: int, spill_path: str
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.written = 0
+        self.flushes = 0
+        self.spilled = 0
+        self.replayed = 0
+        self._queue: queue.Queue[PredRow | None] = queue.Queue(maxsize=max_queued)
+        self._spill_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="pred-writer", daemon=True
+        )
+        self._thread.start()
+
+    def put(self, rows: list[PredRow]) -> None:
+        overflow = []
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                overflow.append(row)
+
+        if overflow:
+            logger.warning(f"Write queue full, spilling {len(overflow)} predictions")
+            self._spill(overflow)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "flushes": self.flushes,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+        }
+
+    def shutdown(self, timeout: float) -> None:
+        # the sentinel is queued behind all pending rows, they are flushed first
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("Prediction writer did not drain before shutdown")
+
+    def _run(self) -> None:
+        self._replay()
+        stopping = False
+        while not stopping:
+            batch: list[PredRow] = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    row = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+
+            if batch and self._flush(batch):
+                self._replay()
+
+    def _flush(self, batch: list[PredRow]) -> bool:
+        try:
+            with stage_timer("store"):
+                store_preds_bulk(batch)
+        except Exception:
+            logger.exception(f"DB error while storing {len(batch)} predictions")
+            DB_ERRORS.inc(operation="store_preds")
+            self._spill(batch)
+            return False
+
+        self.written += len(batch)
+        self.flushes += 1
+        return True
+
+    def _spill(self, rows: list[PredRow]) -> None:
+        try:
+            with self._spill_lock, open(self.spill_path, "a") as f:
+                for ticker, pred, target_date, params, horizon in rows:
+                    row = [ticker, pred, target_date.isoformat(), params.model_dump()]
+                    f.write(json.dumps([*row, horizon]) + "\n")
+            self.spilled += len(rows)
+        except OSError:
+            logger.exception(f"Could not spill {len(rows)} predictions, dropping them")
+
+    def _replay(self) -> None:
+        # the file is moved aside first (per process, API workers share the
+        # spill file), rows failing again are spilled anew
+        replay_path = f"{self.spill_path}.{os.getpid()}.replay"
+        try:
+            with self._spill_lock:
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+
+            rows = []
+            with open(replay_path) as f:
+                for line in f:
+                    try:
+                        ticker, pred, target_date, params, horizon = json.loads(line)
+                        target_date = date.fromisoformat(target_date)
+                        params = GarchParams(**params)
+                    except Exception:
+                        # torn last line of a crashed process
+                        logger.warning(f"Skipping malformed spilled row: {line!r}")
+                        continue
+                    rows.append((ticker, pred, target_date, params, horizon))
+            os.remove(replay_path)
+        except OSError:
+            logger.exception("Could not read spilled predictions")
+            return
+
+        for i in range(0, len(rows), self.batch_size):
+            if not self._flush(rows[i : i + self.batch_size]):
+                self._spill(rows[i + self.batch_size :])
+                return
+            self.replayed += len(rows[i : i + self.batch_size])
+
+        logger.info(f"Replayed {len(rows)} spilled predictions")
+
+
+_pred_writer: PredWriter | None = None
+_pred_writer_lock = threading.Lock()
+
+
+def get_pred_writer() -> PredWriter:
+    global _pred_writer
+
+    with _pred_writer_lock:
+        if _pred_writer is None:
+            _pred_writer = PredWriter(
+                WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL, WRITE_QUEUE_MAX, PRED_SPILL_PATH
+            )
+            logger.info(
+                f"Started prediction writer, batches of {WRITE_BATCH_SIZE} rows "
+                f"or every {WRITE_FLUSH_INTERVAL}s"
+            )
+
+    return _pred_writer
+
+
+def get_pred_writer_stats() -> dict:
+    if _pred_writer is None:
+        return {"queued": 0, "written": 0, "flushes": 0, "spilled": 0, "replayed": 0}
+
+    return _pred_writer.stats()
+
+
+def shutdown_pred_writer(timeout: float = 30) -> None:
+    global _pred_writer
+
+    with _pred_writer_lock:
+        if _pred_writer is not None:
+            _pred_writer.shutdown(timeout)
+            _pred_writer = None
+            logger.info("Prediction writer drained and shut down")
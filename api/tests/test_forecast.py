@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from src.config import GarchParams
+from src.services.forecast import SIMULATED_DISTS, get_term_structure
+from src.services.garch_model import get_garch_pred
+
+
+@pytest.mark.parametrize("dist", SIMULATED_DISTS)
+def test_simulated_term_structure_shares_prefix(dist: str) -> None:
+    # a shorter horizon reads the same simulated days as a longer one
+    returns = np.random.default_rng(3).standard_t(5, 1500)
+    params = GarchParams(p=1, q=1, dist=dist)  # type: ignore
+    garch_fit = get_garch_pred(returns, params)
+    assert garch_fit is not None
+
+    longest = get_term_structure(garch_fit, params, 30)
+    for horizon in [2, 5, 10]:
+        assert get_term_structure(garch_fit, params, horizon) == longest[:horizon]
+    assert np.all(np.diff(longest) > 0)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from arch import arch_model
+
+from src.config import GarchParams
+from src.services.garch_model import get_garch_pred
+from src.services.garch_vectorized import fit_garch_batch, get_garch_pred_vectorized
+
+DISTS = ["normal", "t", "skewt", "ged"]
+SEEDS = [1, 2]
+# GARCH(1,1): relative difference of the 1-step sigma forecast and of the
+# parameters (relative to max(|arch|, 0.01), mu and skew can be near 0)
+SIGMA_RTOL = 1e-4
+PARAMS_RTOL = 1e-2
+PARAMS_FLOOR = 1e-2
+# higher orders: log-likelihood at least arch's, up to optimizer tolerance
+LOGLIK_EPS = 1e-5
+
+
+def simulate(seed: int, n: int = 1500) -> np.ndarray:
+    # daily percent returns of a GARCH(1,1) with t(6) shocks
+    rng = np.random.default_rng(seed)
+    z = rng.standard_t(6, n + 500) / np.sqrt(1.5)
+    returns = np.empty(n + 500)
+    var = 1.0
+    for t in range(n + 500):
+        returns[t] = np.sqrt(var) * z[t]
+        var = 0.05 + 0.08 * returns[t] ** 2 + 0.9 * var
+    return returns[500:]
+
+
+def get_loglik(returns: np.ndarray, params: GarchParams, theta: list[float]) -> float:
+    model = arch_model(
+        returns, mean="Constant", p=params.p, q=params.q, dist=params.dist
+    )
+    return float(model.fix(theta).loglikelihood)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("dist", DISTS)
+def test_garch_11_matches_arch(dist: str, seed: int) -> None:
+    returns = simulate(seed)
+    params = GarchParams(p=1, q=1, dist=dist)  # type: ignore
+
+    expected = get_garch_pred(returns, params)
+    fit = get_garch_pred_vectorized(returns, params)
+    assert expected is not None and fit is not None
+
+    assert fit.pred == pytest.approx(expected.pred, rel=SIGMA_RTOL)
+    theta, arch_theta = np.array(fit.params), np.array(expected.params)
+    scale = np.maximum(np.abs(arch_theta), PARAMS_FLOOR)
+    assert np.all(np.abs(theta - arch_theta) / scale < PARAMS_RTOL)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("dist", DISTS)
+@pytest.mark.parametrize("p,q", [(2, 1), (1, 2), (2, 2)])
+def test_higher_orders_reach_arch_loglik(p: int, q: int, dist: str, seed: int) -> None:
+    returns = simulate(seed)
+    params = GarchParams(p=p, q=q, dist=dist)  # type: ignore
+
+    expected = get_garch_pred(returns, params)
+    fit = get_garch_pred_vectorized(returns, params)
+    assert expected is not None and fit is not None
+
+    loglik = get_loglik(returns, params, fit.params)
+    assert loglik >= get_loglik(returns, params, expected.params) - LOGLIK_EPS
+
+
+@pytest.mark.parametrize("dist", DISTS)
+def test_batch_matches_single_fits(dist: str) -> None:
+    # series optimized in lockstep end where they end alone
+    series = [simulate(seed) for seed in SEEDS]
+    params = GarchParams(p=1, q=1, dist=dist)  # type: ignore
+
+    batch = fit_garch_batch(series, params)
+    for returns, fit in zip(series, batch):
+        single = get_garch_pred_vectorized(returns, params)
+        assert fit is not None and single is not None
+        assert fit.pred == pytest.approx(single.pred, rel=SIGMA_RTOL)
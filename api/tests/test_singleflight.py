@@ -0,0 +1,139 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from src.services.singleflight import SingleFlight
+
+FOLLOWERS = 3
+
+
+def wait_for_followers(flight: SingleFlight, n: int) -> None:
+    deadline = time.monotonic() + 5
+    while flight.coalesced < n:
+        assert time.monotonic() < deadline, "followers did not join the call"
+        time.sleep(0.001)
+
+
+def must_not_submit() -> Future:
+    raise AssertionError("a follower submitted its own call")
+
+
+def run_concurrently(flight: SingleFlight, fn) -> list:
+    # the leader blocks in fn until every follower waits for its call
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def leader_fn():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return fn()
+
+    def call():
+        try:
+            return flight.do("key", leader_fn)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(FOLLOWERS + 1) as pool:
+        leader = pool.submit(call)
+        started.wait()
+        followers = [pool.submit(call) for _ in range(FOLLOWERS)]
+        wait_for_followers(flight, FOLLOWERS)
+        release.set()
+        outcomes = [leader.result()] + [f.result() for f in followers]
+
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": FOLLOWERS}
+    return outcomes
+
+
+def test_do_followers_get_leader_result() -> None:
+    outcomes = run_concurrently(SingleFlight(), lambda: object())
+
+    result = outcomes[0][0]
+    assert outcomes == [(result, False)] + [(result, True)] * FOLLOWERS
+
+
+def test_do_followers_get_leader_exception() -> None:
+    error = ValueError("fit failed")
+
+    def fail():
+        raise error
+
+    assert run_concurrently(SingleFlight(), fail) == [error] * (FOLLOWERS + 1)
+
+
+@pytest.mark.parametrize("fails", [False, True])
+def test_submit_followers_share_leader_future(fails: bool) -> None:
+    flight = SingleFlight()
+    inner: Future = Future()
+
+    future, shared = flight.submit("key", lambda: inner)
+    followers = [flight.submit("key", must_not_submit) for _ in range(FOLLOWERS)]
+    assert not shared
+    assert followers == [(future, True)] * FOLLOWERS
+
+    if fails:
+        inner.set_exception(ValueError("fit failed"))
+        with pytest.raises(ValueError, match="fit failed"):
+            future.result()
+    else:
+        inner.set_result(1.5)
+        assert future.result() == 1.5
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_failing_submit_fn_clears_key() -> None:
+    flight = SingleFlight()
+
+    def submit_fn():
+        raise RuntimeError("queue full")
+
+    with pytest.raises(RuntimeError, match="queue full"):
+        flight.submit("key", submit_fn)
+    assert flight.stats()["in_flight"] == 0
+
+    # the next call leads a new one instead of joining the failed call
+    inner: Future = Future()
+    future, shared = flight.submit("key", lambda: inner)
+    assert not shared
+    inner.set_result(2.0)
+    assert future.result() == 2.0
+
+
+def test_submit_many_shares_only_keys_in_flight() -> None:
+    flight = SingleFlight()
+    pending: Future = Future()
+    flight.submit("a", lambda: pending)
+
+    inner: Future = Future()
+    submitted = []
+
+    def submit_fn(leaders: list[int]) -> Future:
+        submitted.append(leaders)
+        return inner
+
+    # "a" is in flight already, the second "b" joins the first one
+    calls = flight.submit_many(["a", "b", "c", "b"], submit_fn)
+    assert submitted == [[1, 2]]
+    assert [shared for _, shared in calls] == [True, False, False, True]
+    assert calls[3][0] is calls[1][0]
+
+    inner.set_result(["B", "C"])
+    pending.set_result("A")
+    assert [future.result() for future, _ in calls] == ["A", "B", "C", "B"]
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_submit_many_failing_submit_fn_clears_keys() -> None:
+    flight = SingleFlight()
+
+    def submit_fn(leaders: list[int]) -> Future:
+        raise RuntimeError("queue full")
+
+    with pytest.raises(RuntimeError, match="queue full"):
+        flight.submit_many(["a", "b"], submit_fn)
+    assert flight.stats()["in_flight"] == 0
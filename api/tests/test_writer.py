@@ -0,0 +1,89 @@
+import time
+from datetime import date
+
+import pytest
+
+from src.config import GarchParams
+from src.services import writer
+from src.services.writer import PredRow, PredWriter
+
+ROWS: list[PredRow] = [
+    (ticker, 1.0 + i / 7, date(2026, 1, 5), GarchParams(p=1, q=1, dist=dist), 1)  # type: ignore
+    for i, (ticker, dist) in enumerate(
+        [("AAPL", "normal"), ("MSFT", "t"), ("NVDA", "skewt"), ("AMZN", "ged")]
+    )
+]
+
+
+class FakeStore:
+    # store_preds_bulk that fails while `fail` is set
+    def __init__(self, fail: bool) -> None:
+        self.fail = fail
+        self.rows: list[PredRow] = []
+
+    def __call__(self, rows: list[PredRow]) -> None:
+        if self.fail:
+            raise ConnectionError("DB unreachable")
+        self.rows.extend(rows)
+
+
+@pytest.fixture
+def store(monkeypatch: pytest.MonkeyPatch) -> FakeStore:
+    fake = FakeStore(fail=True)
+    monkeypatch.setattr(writer, "store_preds_bulk", fake)
+    return fake
+
+
+def get_writer(spill_path) -> PredWriter:
+    return PredWriter(
+        batch_size=2, flush_interval=0.01, max_queued=100, spill_path=str(spill_path)
+    )
+
+
+def wait_for(pred_writer: PredWriter, stat: str, n: int) -> None:
+    deadline = time.monotonic() + 5
+    while pred_writer.stats()[stat] < n:
+        assert time.monotonic() < deadline, f"{stat} did not reach {n}"
+        time.sleep(0.005)
+
+
+def test_failed_flush_spills_and_replays_in_order(store: FakeStore, tmp_path) -> None:
+    spill_path = tmp_path / "spill.jsonl"
+    pred_writer = get_writer(spill_path)
+    try:
+        pred_writer.put(ROWS[:3])
+        wait_for(pred_writer, "spilled", 3)
+        assert len(spill_path.read_text().splitlines()) == 3
+        assert store.rows == []
+
+        # the next successful flush replays the spilled rows once, in order
+        store.fail = False
+        pred_writer.put(ROWS[3:])
+        wait_for(pred_writer, "replayed", 3)
+    finally:
+        pred_writer.shutdown(5)
+
+    assert store.rows == ROWS[3:] + ROWS[:3]
+    assert pred_writer.stats()["written"] == 4
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_replay_skips_torn_last_line(store: FakeStore, tmp_path) -> None:
+    spill_path = tmp_path / "spill.jsonl"
+    pred_writer = get_writer(spill_path)
+    pred_writer.put(ROWS[:2])
+    wait_for(pred_writer, "spilled", 2)
+    pred_writer.shutdown(5)
+
+    # a process crashed while spilling, the restarted writer replays the rest
+    with open(spill_path, "a") as f:
+        f.write('["NVDA", 1.3, "2026-01-')
+    store.fail = False
+    pred_writer = get_writer(spill_path)
+    try:
+        wait_for(pred_writer, "replayed", 2)
+    finally:
+        pred_writer.shutdown(5)
+
+    assert store.rows == ROWS[:2]
+    assert list(tmp_path.iterdir()) == []
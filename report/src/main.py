@@ -21,13 +21,27 @@ load_dotenv()
 API_URL = os.getenv("API_URL")
 
 
+@st.cache_resource
+def get_report_cache() -> dict:
+    # last report and its ETag, shared by all sessions
+    return {}
+
+
 def main():
+    cache = get_report_cache()
     try:
         with st.spinner("Fetching data from Financial Volatility Forecaster API..."):
-            response = requests.get(f"{API_URL}/report", timeout=10)
+            headers = {"If-None-Match": cache["etag"]} if "etag" in cache else {}
+            response = requests.get(f"{API_URL}/report", headers=headers, timeout=10)
+
+        if response.status_code == 304:
+            render_dashboard(cache["data"])
 
-        if response.status_code == 200:
-            render_dashboard(response.json())
+        elif response.status_code == 200:
+            data = response.json()
+            if "ETag" in response.headers:
+                cache.update(etag=response.headers["ETag"], data=data)
+            render_dashboard(data)
 
         elif response.status_code == 501:
             render_db_error()
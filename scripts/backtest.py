@@ -0,0 +1,231 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import cast
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+# reuse the API's price cache, GARCH fit and variance recursion. its imports
+# have to follow the path setup (noqa: E402)
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+)
+
+from src.config import GarchParams  # noqa: E402
+from src.services.database import get_model_config  # noqa: E402
+from src.services.garch_filter import one_step_variance  # noqa: E402
+from src.services.garch_model import GarchFit, get_garch_pred  # noqa: E402
+from src.services.price_cache import get_price_history  # noqa: E402
+
+
+def parse_config(value: str) -> GarchParams:
+    p, q, dist = value.split(",")
+    return GarchParams(p=int(p), q=int(q), dist=dist)  # type: ignore
+
+
+def setup_worker_logging() -> None:
+    # every fit logs at INFO, keep workers to warnings
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+
+def get_log_returns(symbol: str) -> pd.Series:
+    _, data, _ = get_price_history(symbol)
+    log_returns = np.log((data["Close"] / data["Close"].shift(1)).dropna()) * 100
+    return cast(pd.Series, log_returns)
+
+
+def roll_forward(garch_fit: GarchFit, params: GarchParams, ret: float) -> GarchFit:
+    # next day's forecast with unchanged parameters, the realized return
+    # enters the variance recursion
+    var = garch_fit.pred**2
+    resid2 = garch_fit.resid2[1:] + [(ret - garch_fit.params[0]) ** 2]
+    sigma2 = garch_fit.sigma2[1:] + [var]
+    pred = float(np.sqrt(one_step_variance(garch_fit.params, params, resid2, sigma2)))
+    return GarchFit(
+        pred=pred,
+        params=garch_fit.params,
+        warm_start=True,
+        resid2=resid2,
+        sigma2=sigma2,
+    )
+
+
+def walk_forward(
+    symbol: str,
+    log_returns: pd.Series,
+    params: GarchParams,
+    window: int,
+    expanding: bool,
+    refit_every: int,
+) -> pd.DataFrame:
+    # one-day-ahead forecast for every day after the first window, refit on
+    # the trailing (rolling) or all past (expanding) returns, warm started
+    # from the previous window's estimate
+    rows = []
+    garch_fit: GarchFit | None = None
+    last_refit = -refit_every
+    values = log_returns.to_numpy()
+
+    for t in range(window, len(values)):
+        if garch_fit is not None and t - last_refit < refit_every:
+            garch_fit = roll_forward(garch_fit, params, float(values[t - 1]))
+            refit = False
+        else:
+            train = (
+                log_returns.iloc[:t] if expanding else log_returns.iloc[t - window : t]
+            )
+            start = None if garch_fit is None else garch_fit.params
+            garch_fit = get_garch_pred(train, params, start)
+            last_refit = t
+            refit = True
+
+        rows.append(
+            {
+                "date": log_returns.index[t],
+                "prediction": np.nan if garch_fit is None else garch_fit.pred,
+                "ret": values[t],
+                "refit": refit,
+            }
+        )
+
+    result = pd.DataFrame(rows)
+    result.insert(0, "model_config", get_model_config(params))
+    result.insert(0, "ticker", symbol)
+    return result
+
+
+def run_task(
+    symbol: str,
+    params: GarchParams,
+    window: int,
+    expanding: bool,
+    refit_every: int,
+    part_path: str,
+) -> int:
+    log_returns = get_log_returns(symbol)
+    result = walk_forward(symbol, log_returns, params, window, expanding, refit_every)
+
+    # finished tasks are checkpoints, an interrupted run resumes from them
+    result.to_parquet(part_path + ".tmp")
+    os.replace(part_path + ".tmp", part_path)
+    return len(result)
+
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    # daily proxies: |r| for the volatility, QLIKE on r^2 for the variance
+    df = results.dropna(subset=["prediction"])
+    var = df["prediction"] ** 2
+    df = df.assign(
+        error_abs=(df["ret"].abs() - df["prediction"]).abs(),
+        error_sq=(df["ret"].abs() - df["prediction"]) ** 2,
+        qlike=np.log(var) + df["ret"] ** 2 / var,
+    )
+    grouped = df.groupby("model_config")
+    return pd.DataFrame(
+        {
+            "days": grouped.size(),
+            "tickers": grouped["ticker"].nunique(),
+            "failed": results.groupby("model_config")["prediction"].apply(
+                lambda s: s.isna().sum()
+            ),
+            "MAE": grouped["error_abs"].mean(),
+            "RMSE": np.sqrt(grouped["error_sq"].mean()),
+            "QLIKE": grouped["qlike"].mean(),
+        }
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Walk-forward backtest of GARCH configs over the full history"
+    )
+    parser.add_argument("--tickers", nargs="+", required=True)
+    parser.add_argument(
+        "--configs",
+        nargs="+",
+        type=parse_config,
+        default=[parse_config("1,1,skewt"), parse_config("4,4,skewt")],
+        help="p,q,dist per config (default: 1,1,skewt 4,4,skewt)",
+    )
+    parser.add_argument("--window", type=int, default=500)
+    parser.add_argument("--expanding", action="store_true")
+    parser.add_argument(
+        "--refit-every",
+        type=int,
+        default=5,
+        help="days between re-estimations, filter updates in between",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default="backtest.parquet")
+    args = parser.parse_args()
+
+    parts_dir = args.output + ".parts"
+    os.makedirs(parts_dir, exist_ok=True)
+
+    part_paths = {}
+    for symbol in dict.fromkeys(t.upper() for t in args.tickers):
+        for params in args.configs:
+            part_paths[(symbol, get_model_config(params))] = (
+                params,
+                os.path.join(parts_dir, f"{symbol}_{get_model_config(params)}.parquet"),
+            )
+
+    tasks = [
+        (symbol, params, part_path)
+        for (symbol, _), (params, part_path) in part_paths.items()
+        if not os.path.exists(part_path)
+    ]
+    logger.info(
+        f"{len(tasks)} walk-forward tasks to run "
+        f"({len(part_paths) - len(tasks)} already checkpointed)"
+    )
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=setup_worker_logging
+    ) as pool:
+        futures = {
+            pool.submit(
+                run_task,
+                symbol,
+                params,
+                args.window,
+                args.expanding,
+                args.refit_every,
+                part_path,
+            ): (symbol, params)
+            for symbol, params, part_path in tasks
+        }
+        for future in as_completed(futures):
+            symbol, params = futures[future]
+            try:
+                days = future.result()
+                logger.info(f"{symbol} {get_model_config(params)}: {days} days")
+            except Exception:
+                logger.exception(f"Backtest failed for {symbol}")
+
+    parts = [
+        pd.read_parquet(part_path)
+        for _, part_path in part_paths.values()
+        if os.path.exists(part_path)
+    ]
+    if not parts:
+        logger.error("No backtest results")
+        sys.exit(1)
+
+    results = pd.concat(parts, ignore_index=True)
+    results.to_parquet(args.output)
+    logger.info(
+        f"Wrote {len(results)} forecasts to {args.output} "
+        f"in {time.perf_counter() - start:.0f}s"
+    )
+    print(summarize(results).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import json
+import os
+import re
+import tempfile
+from datetime import date
+
+import pandas as pd
+import pyarrow.parquet as pq
+from loguru import logger
+
+# intraday bars partitioned by trading date and ticker:
+#   <BAR_STORE_DIR>/<YYYY-MM-DD>/<TICKER>.parquet   one ticker, one day
+#   <BAR_STORE_DIR>/<YYYY-MM-DD>/_compacted.parquet all tickers of a day
+#   <BAR_STORE_DIR>/<YYYY-MM-DD>/_compacted.json    bar count per ticker
+# a ticker without bars on a day is stored as an empty partition, so it is
+# not downloaded again
+BAR_STORE_DIR = os.getenv(
+    "BAR_STORE_DIR", os.path.join(tempfile.gettempdir(), "fvf_bar_store")
+)
+BAR_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+COMPACTED = "_compacted"
+
+
+def get_bars(day: date, tickers: list[str]) -> dict[str, pd.DataFrame]:
+    # stored bars of the tickers, tickers missing in the store are left out
+    wanted = set(tickers)
+    stored = {t: bars for t, bars in _read_compacted(day).items() if t in wanted}
+
+    for ticker in wanted - stored.keys():
+        path = _path(day, ticker)
+        if not os.path.exists(path):
+            continue
+
+        try:
+            bars = pd.read_parquet(path)
+        except Exception:
+            logger.warning(f"Unreadable bar partition {path}, dropping it")
+            _remove(path)
+            continue
+
+        if not _is_valid(bars, day):
+            logger.warning(f"Invalid bar partition {path}, dropping it")
+            _remove(path)
+            continue
+
+        stored[ticker] = bars
+
+    return stored
+
+
+def get_missing(day: date, tickers: list[str]) -> list[str]:
+    stored = get_bars(day, tickers)
+    return [t for t in tickers if t not in stored]
+
+
+def has_bars(day: date) -> bool:
+    # any ticker with bars on the day, i.e. the day was a trading day
+    day_dir = _day_dir(day)
+    if not os.path.isdir(day_dir):
+        return False
+
+    for name in os.listdir(day_dir):
+        path = os.path.join(day_dir, name)
+        try:
+            if name == COMPACTED + ".json":
+                with open(path) as f:
+                    if any(json.load(f).values()):
+                        return True
+            elif name.endswith(".parquet") and not name.startswith(COMPACTED):
+                if pq.read_metadata(path).num_rows:
+                    return True
+        except Exception:
+            continue
+
+    return False
+
+
+def put_bars(day: date, ticker: str, bars: pd.DataFrame) -> None:
+    bars = bars.reindex(columns=BAR_COLUMNS).dropna(subset=["Close"])
+    bars = bars[~bars.index.duplicated(keep="last")].sort_index()
+    if not _is_valid(bars, day):
+        raise ValueError(f"Bars of {ticker} do not belong to {day}")
+
+    os.makedirs(_day_dir(day), exist_ok=True)
+    _write_parquet(_path(day, ticker), bars)
+
+
+def compact(day: date) -> None:
+    # merge the per-ticker partitions of a day into one file, fewer and
+    # larger files read much faster than hundreds of small ones
+    day_dir = _day_dir(day)
+    names = [
+        n
+        for n in os.listdir(day_dir)
+        if n.endswith(".parquet") and not n.startswith(COMPACTED)
+    ]
+    if not names:
+        return
+
+    tickers = [n.removesuffix(".parquet") for n in names]
+    bars = _read_compacted(day) | get_bars(day, tickers)
+    counts = {ticker: len(b) for ticker, b in bars.items()}
+
+    frames = [b.assign(ticker=ticker) for ticker, b in bars.items() if len(b)]
+    merged = (
+        pd.concat(frames)
+        if frames
+        else pd.DataFrame(columns=[*BAR_COLUMNS, "ticker"], dtype=float)
+    )
+    _write_parquet(os.path.join(day_dir, COMPACTED + ".parquet"), merged)
+    _write_json(os.path.join(day_dir, COMPACTED + ".json"), counts)
+
+    for name in names:
+        _remove(os.path.join(day_dir, name))
+
+    logger.debug(f"Compacted {len(names)} bar partitions of {day}")
+
+
+def _read_compacted(day: date) -> dict[str, pd.DataFrame]:
+    path = os.path.join(_day_dir(day), COMPACTED + ".parquet")
+    meta_path = os.path.join(_day_dir(day), COMPACTED + ".json")
+    if not os.path.exists(meta_path):
+        return {}
+
+    try:
+        with open(meta_path) as f:
+            counts = json.load(f)
+        merged = pd.read_parquet(path)
+    except Exception:
+        logger.warning(f"Unreadable compacted bars of {day}, dropping them")
+        _remove(path)
+        _remove(meta_path)
+        return {}
+
+    stored = {}
+    groups = dict(tuple(merged.groupby("ticker"))) if len(merged) else {}
+    for ticker, count in counts.items():
+        bars = groups.get(ticker)
+        bars = (
+            bars.drop(columns="ticker")
+            if bars is not None
+            else pd.DataFrame(columns=BAR_COLUMNS, dtype=float)
+        )
+        # a partial write or a foreign file shows up as a count mismatch
+        if len(bars) != count or (count and not _is_valid(bars, day)):
+            logger.warning(f"Compacted bars of {day} failed integrity check")
+            _remove(path)
+            _remove(meta_path)
+            return {}
+        stored[ticker] = bars
+
+    return stored
+
+
+def _is_valid(bars: pd.DataFrame, day: date) -> bool:
+    if "Close" not in bars.columns:
+        return False
+    if bars.empty:
+        return True
+    if not isinstance(bars.index, pd.DatetimeIndex):
+        return False
+    if not bars.index.is_monotonic_increasing or not bars.index.is_unique:
+        return False
+    if (bars["Close"] <= 0).any():
+        return False
+    return bool((bars.index.date == day).all())
+
+
+def _day_dir(day: date) -> str:
+    return os.path.join(BAR_STORE_DIR, day.isoformat())
+
+
+def _path(day: date, ticker: str) -> str:
+    return os.path.join(_day_dir(day), re.sub(r"[^\w.-]", "_", ticker) + ".parquet")
+
+
+def _write_parquet(path: str, df: pd.DataFrame) -> None:
+    # temp file + rename, readers never see partial files
+    df.to_parquet(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def _write_json(path: str, data: dict) -> None:
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,333 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import date, datetime, timedelta, timezone
+from importlib.metadata import version
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+# benchmarks the API's fit and report code and evaluate.py's realized step.
+# its imports have to follow the path setup (noqa: E402)
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+)
+
+from src.config import GarchParams  # noqa: E402
+from src.services.database import get_model_config  # noqa: E402
+from src.services.garch_model import get_garch_pred  # noqa: E402
+from src.services.report import get_metrics_data  # noqa: E402
+
+# evaluate.py needs a DB_URL at import, its engine never connects here
+os.environ.setdefault("DB_URL", "postgresql://benchmark@localhost/offline")
+
+from scripts import bar_store  # noqa: E402
+from scripts.evaluate import get_errors, get_window, get_window_bars  # noqa: E402
+from scripts.realized import get_realized_measures  # noqa: E402
+
+SEED = 0
+# GARCH(1,1) with t(6) innovations, daily percent returns
+OMEGA, ALPHA, BETA, NU = 0.05, 0.08, 0.9, 6.0
+FIT_CONFIGS = [
+    (p, q, d)
+    for p, q in [(1, 1), (2, 1), (2, 2)]
+    for d in ["normal", "t", "skewt", "ged"]
+]
+FIT_LENGTHS = [500, 1000, 2500]
+METRICS_ROWS = [1_000, 10_000, 100_000, 1_000_000]
+REALIZED_TICKERS = [100, 500]
+BARS_PER_DAY = 78
+CONFIGS_PER_TICKER = 2
+PACKAGES = ["numpy", "pandas", "scipy", "arch", "pyarrow"]
+
+
+def simulate_garch(n: int, seed: int = SEED) -> pd.Series:
+    # returns from a fixed process and seed, independent of arch's simulator
+    rng = np.random.default_rng(seed)
+    z = rng.standard_t(NU, n + 500) / np.sqrt(NU / (NU - 2))
+    returns = np.empty(n + 500)
+    var = OMEGA / (1 - ALPHA - BETA)
+    for t in range(n + 500):
+        returns[t] = np.sqrt(var) * z[t]
+        var = OMEGA + ALPHA * returns[t] ** 2 + BETA * var
+    index = pd.bdate_range(end="2026-01-02", periods=n)
+    return pd.Series(returns[500:], index=index)
+
+
+def simulate_bars(day: date, n_bars: int, rng: np.random.Generator) -> pd.DataFrame:
+    # 5m OHLC bars of one ticker and day from a random walk with a random level
+    start = pd.Timestamp(day) + pd.Timedelta(hours=14, minutes=30)
+    index = pd.date_range(start, periods=n_bars, freq="5min")
+    close = rng.uniform(20, 500) * np.exp(np.cumsum(rng.normal(0, 0.001, n_bars)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.0007, n_bars)) * close
+    return pd.DataFrame(
+        {
+            "Open": open_,
+            "High": np.maximum(open_, close) + spread,
+            "Low": np.minimum(open_, close) - spread,
+            "Close": close,
+            "Volume": rng.integers(1_000, 100_000, n_bars).astype(float),
+        },
+        index=index,
+    )
+
+
+def simulate_error_sums(
+    n_rows: int, seed: int = SEED
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # n_rows evaluations of 100 tickers x 2 configs, aggregated the way the
+    # garch_metrics_date / garch_metrics_ticker tables hold them
+    rng = np.random.default_rng(seed)
+    tickers = np.array([f"T{i:03d}" for i in range(100)])
+    configs = [(1, 1, "skewt"), (4, 4, "skewt")]
+    n_dates = max(n_rows // (len(tickers) * len(configs)), 1)
+    dates = pd.bdate_range(end="2026-01-02", periods=n_dates).date
+
+    config_idx = rng.integers(0, len(configs), n_rows)
+    prediction = rng.uniform(0.5, 3.0, n_rows)
+    realized = prediction * rng.lognormal(0, 0.3, n_rows)
+    error_raw = realized - prediction
+    rows = pd.DataFrame(
+        {
+            "target_date": dates[rng.integers(0, n_dates, n_rows)],
+            "ticker": tickers[rng.integers(0, len(tickers), n_rows)],
+            "p": [configs[i][0] for i in config_idx],
+            "q": [configs[i][1] for i in config_idx],
+            "dist": [configs[i][2] for i in config_idx],
+            "n": 1,
+            "sum_error_raw": error_raw,
+            "sum_error_abs": np.abs(error_raw),
+            "sum_error_rel": np.abs(error_raw) / realized,
+            "sum_error_sq": error_raw**2,
+        }
+    )
+    return get_error_sums(rows, "target_date"), get_error_sums(rows, "ticker")
+
+
+def get_error_sums(rows: pd.DataFrame, key: str) -> pd.DataFrame:
+    sums = ["n", "sum_error_raw", "sum_error_abs", "sum_error_rel", "sum_error_sq"]
+    return rows.groupby([key, "p", "q", "dist"], as_index=False)[sums].sum()
+
+
+def measure(fn: Callable[[], object], repeat: int) -> dict:
+    # one untimed warmup, then the median of `repeat` runs
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "max": max(times),
+        "repeat": repeat,
+    }
+
+
+def bench_fit(repeat: int, quick: bool) -> dict[str, dict]:
+    configs = FIT_CONFIGS[:4] if quick else FIT_CONFIGS
+    lengths = FIT_LENGTHS[:1] if quick else FIT_LENGTHS
+    results = {}
+    for n in lengths:
+        log_returns = simulate_garch(n)
+        for p, q, dist in configs:
+            params = GarchParams(p=p, q=q, dist=dist)  # type: ignore
+            name = f"fit/{get_model_config(params)}/n={n}"
+            results[name] = measure(lambda: get_garch_pred(log_returns, params), repeat)
+            logger.info(f"{name}: {results[name]['median'] * 1000:.1f}ms")
+    return results
+
+
+def bench_metrics(repeat: int, quick: bool) -> dict[str, dict]:
+    results = {}
+    for n_rows in METRICS_ROWS[:2] if quick else METRICS_ROWS:
+        df_date, df_ticker = simulate_error_sums(n_rows)
+        name = f"metrics_data/rows={n_rows}"
+        # get_metrics_data adds columns to its inputs
+        results[name] = measure(
+            lambda: get_metrics_data(df_date.copy(), df_ticker.copy()), repeat
+        )
+        logger.info(f"{name}: {results[name]['median'] * 1000:.1f}ms")
+    return results
+
+
+def bench_realized(repeat: int, quick: bool) -> dict[str, dict]:
+    # the bar store is a temporary directory filled with synthetic bars,
+    # removed when the benchmark ends
+    store_dir = bar_store.BAR_STORE_DIR
+    bar_store.BAR_STORE_DIR = tempfile.mkdtemp(prefix="fvf_benchmark_bars_")
+    try:
+        results = {}
+        rng = np.random.default_rng(SEED)
+        for k, n_tickers in enumerate(
+            REALIZED_TICKERS[:1] if quick else REALIZED_TICKERS
+        ):
+            # a date per size, a compacted day holds exactly these tickers
+            eval_date = date(2026, 1, 2) + timedelta(days=7 * k)
+            tickers = [f"R{n_tickers}_{i:03d}" for i in range(n_tickers)]
+            for day in get_window(eval_date):
+                for ticker in tickers:
+                    bar_store.put_bars(
+                        day, ticker, simulate_bars(day, BARS_PER_DAY, rng)
+                    )
+                bar_store.compact(day)
+
+            rows = [
+                SimpleNamespace(
+                    id=i * CONFIGS_PER_TICKER + c,
+                    ticker=ticker,
+                    target_date=eval_date,
+                    prediction=float(rng.uniform(0.5, 3.0)),
+                )
+                for i, ticker in enumerate(tickers)
+                for c in range(CONFIGS_PER_TICKER)
+            ]
+
+            # run_evaluation's per-date step: stored bars -> measures -> errors
+            def step() -> list[dict]:
+                bars = get_window_bars(eval_date, tickers)
+                return get_errors(rows, get_realized_measures(bars))
+
+            name = f"realized/tickers={n_tickers}"
+            results[name] = measure(step, repeat)
+            logger.info(f"{name}: {results[name]['median'] * 1000:.1f}ms")
+        return results
+    finally:
+        shutil.rmtree(bar_store.BAR_STORE_DIR, ignore_errors=True)
+        bar_store.BAR_STORE_DIR = store_dir
+
+
+BENCHMARKS = {"fit": bench_fit, "metrics": bench_metrics, "realized": bench_realized}
+
+
+def get_environment() -> dict:
+    packages = {}
+    for package in PACKAGES:
+        try:
+            packages[package] = version(package)
+        except Exception:
+            packages[package] = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "packages": packages,
+    }
+
+
+def compare(
+    baseline: dict, current: dict, threshold: float, min_delta: float
+) -> list[str]:
+    # slower by more than `threshold` (relative) and `min_delta` seconds
+    regressions = []
+    for name, result in sorted(current["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<40} {'new':>10} {result['median'] * 1000:>10.2f}ms")
+            continue
+
+        ratio = result["median"] / base["median"]
+        delta = result["median"] - base["median"]
+        regressed = ratio > 1 + threshold and delta > min_delta
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<40} {base['median'] * 1000:>10.2f}ms {result['median'] * 1000:>10.2f}ms "
+            f"{ratio:>6.2f}x{'  REGRESSION' if regressed else ''}"
+        )
+
+    for name in sorted(baseline["results"].keys() - current["results"].keys()):
+        print(f"{name:<40} missing in current results")
+
+    for package, old in baseline["environment"]["packages"].items():
+        new = current["environment"]["packages"].get(package)
+        if new != old:
+            print(f"{package}: {old} -> {new}")
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks of GARCH fitting, report aggregation and evaluation"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument(
+        "--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS)
+    )
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument(
+        "--quick", action="store_true", help="smallest sizes only, a smoke run"
+    )
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--baseline", help="compare against this result file")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+
+    for p in [run_parser, compare_parser]:
+        p.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="relative slowdown flagged as a regression (default: 0.2)",
+        )
+        p.add_argument(
+            "--min-delta",
+            type=float,
+            default=0.001,
+            help="ignore slowdowns below this many seconds (default: 0.001)",
+        )
+    args = parser.parse_args()
+
+    if args.command == "run":
+        # fits log every estimate at INFO
+        logger.remove()
+        logger.add(sys.stderr, level="INFO", filter=lambda r: r["name"] == "__main__")
+
+        results = {}
+        for name in args.only:
+            results |= BENCHMARKS[name](args.repeat, args.quick)
+
+        current = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "environment": get_environment(),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        logger.info(f"Wrote {len(results)} results to {args.output}")
+
+        if not args.baseline:
+            return
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+    regressions = compare(baseline, current, args.threshold, args.min_delta)
+    if regressions:
+        print(f"{len(regressions)} regressions")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,30 @@
 import os
 import sys
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
 
 import numpy as np
+import pandas as pd
 import yfinance as yf  # type: ignore
 from loguru import logger
 from sqlalchemy import create_engine, text
 
+from scripts import bar_store
+from scripts.realized import MEASURES, get_realized_measures
+
+# the schema is versioned in the API, shared with it. its imports have to
+# follow the path setup (noqa: E402)
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+)
+
+from src.services.migrations import run_migrations  # noqa: E402
+
 DB_URL = os.getenv("DB_URL", None)
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+DOWNLOAD_CHUNK = int(os.getenv("DOWNLOAD_CHUNK", "50"))
+INSERT_CHUNK = 1000
 
 if DB_URL:
     try:
@@ -22,30 +39,6 @@ else:
     sys.exit(1)
 
 
-def create_perf_table() -> None:
-    sql_create = text("""
-        CREATE TABLE IF NOT EXISTS "garch_performance" (
-        "prediction_id" integer PRIMARY KEY,
-        
-        "evaluation_date" date NOT NULL,
-        
-        "realized_vol" double precision,
-        "error_raw" double precision,
-        "error_abs" double precision,
-        "error_rel" double precision,
-        "error_sq" double precision,
-
-        CONSTRAINT "fk_garch_performance_prediction" 
-            FOREIGN KEY ("prediction_id") 
-            REFERENCES "garch_preds"("id") 
-            ON DELETE CASCADE
-        );
-    """)
-    with engine.begin() as conn:
-        conn.execute(sql_create)
-        logger.info("Succesfully created table 'garch_performance' or table exists")
-
-
 def get_missing_preds() -> dict:
     sql_extract = text("""
         SELECT 
@@ -56,7 +49,9 @@ def get_missing_preds() -> dict:
         FROM garch_preds AS p
         LEFT JOIN garch_performance AS gp
             ON p.id = gp.prediction_id
+            AND p.target_date = gp.target_date
         WHERE gp.prediction_id IS NULL
+            AND p.horizon = 1
             AND p.target_date < CURRENT_DATE
             AND p.target_date >= CURRENT_DATE - INTERVAL '7 days'
         ORDER BY p.target_date ASC;
@@ -80,101 +75,256 @@ def get_missing_preds() -> dict:
     return missing_preds_by_date
 
 
-def run_evaluation() -> None:
-    create_perf_table()
-
-    preds_by_date = get_missing_preds()
-
-    for eval_date, rows in preds_by_date.items():
-        tickers_list = [r.ticker for r in rows]
-        logger.info(f"Processing {eval_date}: {len(tickers_list)} tickers...")
-
-        try:
-            df_bulk = yf.download(
-                tickers_list,
-                start=eval_date - timedelta(days=1),
-                end=eval_date + timedelta(days=1),
-                interval="5m",
-                group_by="ticker",
-                auto_adjust=True,
-                progress=False,
-                threads=False,
-            )
-
-            if df_bulk is None or df_bulk.empty:
-                logger.warning(f"No data found for {eval_date} (Holiday?). Skipping.")
+def get_window(eval_date: date) -> list[date]:
+    # realized vol of a target date is taken over its bars and the day before
+    return [eval_date - timedelta(days=1), eval_date]
+
+
+def download_bars(eval_date: date, tickers: list[str]) -> pd.DataFrame | None:
+    df_bulk = yf.download(
+        tickers,
+        start=eval_date - timedelta(days=1),
+        end=eval_date + timedelta(days=1),
+        interval="5m",
+        group_by="ticker",
+        auto_adjust=True,
+        progress=False,
+        threads=False,
+    )
+    if df_bulk is None or df_bulk.empty:
+        return None
+
+    # (ticker, field) columns also for a single ticker
+    if not isinstance(df_bulk.columns, pd.MultiIndex):
+        df_bulk.columns = pd.MultiIndex.from_product([tickers, df_bulk.columns])
+
+    return df_bulk
+
+
+def store_bars(eval_date: date, tickers: list[str], df_bulk: pd.DataFrame) -> set:
+    # split a download into (day, ticker) partitions, returns the written days
+    written = set()
+    bar_dates = pd.DatetimeIndex(df_bulk.index).date
+    for day in get_window(eval_date):
+        if day >= date.today():
+            continue
+
+        day_bulk = df_bulk[bar_dates == day]
+        by_ticker = {
+            t: day_bulk[t].dropna(subset=["Close"])
+            for t in tickers
+            if t in df_bulk.columns.get_level_values(0)
+        }
+        traded = any(len(bars) for bars in by_ticker.values())
+        traded = traded or bar_store.has_bars(day)
+
+        for ticker in tickers:
+            bars = by_ticker.get(ticker)
+            # no bars for anyone -> non-trading day, stored as empty; a ticker
+            # without bars on a trading day may be a failed download, retried
+            if traded and (bars is None or bars.empty):
                 continue
+            if bars is None:
+                bars = pd.DataFrame(columns=bar_store.BAR_COLUMNS, dtype=float)
+            bar_store.put_bars(day, ticker, bars)
+
+        written.add(day)
+
+    return written
+
+
+def get_window_bars(eval_date: date, tickers: list[str]) -> pd.DataFrame:
+    # 5m bars over the evaluation window from the store, (ticker, field)
+    # columns, tickers missing any partition of the window are left out
+    stored = [bar_store.get_bars(day, tickers) for day in get_window(eval_date)]
+    bars = {
+        ticker: pd.concat([day_bars[ticker] for day_bars in stored])
+        for ticker in tickers
+        if all(ticker in day_bars for day_bars in stored)
+    }
+    if not bars:
+        return pd.DataFrame(
+            columns=pd.MultiIndex.from_tuples([], names=["ticker", "field"])
+        )
+    return pd.concat(bars, axis=1).sort_index()
+
+
+def get_errors(rows: list, measures: pd.DataFrame) -> list[dict]:
+    results = []
+    for row in rows:
+        if row.ticker not in measures.index:
+            logger.warning(f"Ticker {row.ticker} missing in bulk data.")
+            continue
+
+        ticker_measures = measures.loc[row.ticker]
+        real_vol = float(ticker_measures["realized_vol"])
+        error_raw = real_vol - row.prediction
+        error_abs = abs(error_raw)
+        results.append(
+            {
+                "prediction_id": row.id,
+                "target_date": row.target_date,
+                "evaluation_date": datetime.now().date(),
+                # NaN (e.g. bipower variation of a single return) -> NULL
+                **{
+                    m: None
+                    if np.isnan(ticker_measures[m])
+                    else float(ticker_measures[m])
+                    for m in MEASURES
+                },
+                "error_raw": error_raw,
+                "error_abs": error_abs,
+                "error_rel": (error_abs / real_vol) if real_vol != 0 else 0.0,
+                "error_sq": error_abs**2,
+            }
+        )
+
+    return results
+
+
+# adds the rows of an "evaluated" CTE to the metrics tables
+METRICS_UPSERTS = """
+    "by_date" AS (
+        INSERT INTO garch_metrics_date
+        SELECT target_date, model_config, COUNT(*), SUM(error_raw),
+            SUM(error_abs), SUM(error_rel), SUM(error_sq)
+        FROM "evaluated"
+        GROUP BY target_date, model_config
+        ON CONFLICT (target_date, model_config) DO UPDATE SET
+            n = garch_metrics_date.n + EXCLUDED.n,
+            sum_error_raw = garch_metrics_date.sum_error_raw + EXCLUDED.sum_error_raw,
+            sum_error_abs = garch_metrics_date.sum_error_abs + EXCLUDED.sum_error_abs,
+            sum_error_rel = garch_metrics_date.sum_error_rel + EXCLUDED.sum_error_rel,
+            sum_error_sq = garch_metrics_date.sum_error_sq + EXCLUDED.sum_error_sq
+    )
+    INSERT INTO garch_metrics_ticker
+    SELECT ticker, model_config, COUNT(*), SUM(error_raw),
+        SUM(error_abs), SUM(error_rel), SUM(error_sq)
+    FROM "evaluated"
+    GROUP BY ticker, model_config
+    ON CONFLICT (ticker, model_config) DO UPDATE SET
+        n = garch_metrics_ticker.n + EXCLUDED.n,
+        sum_error_raw = garch_metrics_ticker.sum_error_raw + EXCLUDED.sum_error_raw,
+        sum_error_abs = garch_metrics_ticker.sum_error_abs + EXCLUDED.sum_error_abs,
+        sum_error_rel = garch_metrics_ticker.sum_error_rel + EXCLUDED.sum_error_rel,
+        sum_error_sq = garch_metrics_ticker.sum_error_sq + EXCLUDED.sum_error_sq
+"""
+
+
+def insert_results(results: list[dict]) -> None:
+    # one multi-row statement per chunk instead of a round trip per row, the
+    # metrics tables are updated in the same statement with the rows that
+    # were actually inserted, so a re-evaluated prediction is never counted twice
+    for i in range(0, len(results), INSERT_CHUNK):
+        chunk = results[i : i + INSERT_CHUNK]
+        values = []
+        bind_params = {}
+        for j, row in enumerate(chunk):
+            values.append("(" + ", ".join(f":{col}_{j}" for col in row) + ")")
+            bind_params |= {f"{col}_{j}": val for col, val in row.items()}
+
+        sql_insert = text(f"""
+            WITH "inserted" AS (
+                INSERT INTO garch_performance
+                ({", ".join(chunk[0])})
+                VALUES {", ".join(values)}
+                ON CONFLICT (prediction_id, target_date) DO NOTHING
+                RETURNING *
+            ), "evaluated" AS (
+                SELECT p.ticker, p.target_date, p.model_config,
+                    i.error_raw, i.error_abs, i.error_rel, i.error_sq
+                FROM "inserted" i
+                    JOIN garch_preds p
+                    ON i.prediction_id = p.id
+                    AND i.target_date = p.target_date
+            ), {METRICS_UPSERTS}
+        """)
+        with engine.begin() as conn:
+            conn.execute(sql_insert, bind_params)
 
-            results_to_insert = []
 
-            for row in rows:
+def run_evaluation() -> None:
+    timings = {}
+    start = time.perf_counter()
+    run_migrations(engine)
+    preds_by_date = get_missing_preds()
+    timings["query"] = time.perf_counter() - start
+
+    # only partitions missing in the local bar store are downloaded, (date,
+    # chunk of tickers) downloads run concurrently, in processes since
+    # yf.download keeps its results in module globals and is not thread safe
+    start = time.perf_counter()
+    tickers_by_date = {
+        eval_date: list(dict.fromkeys(r.ticker for r in rows))
+        for eval_date, rows in preds_by_date.items()
+    }
+    tasks = []
+    for eval_date, tickers in tickers_by_date.items():
+        # one lookup per window day, each reads the day's compacted file once
+        missing_set: set[str] = set()
+        for d in get_window(eval_date):
+            missing_set.update(bar_store.get_missing(d, tickers))
+        missing = [t for t in tickers if t in missing_set]
+        logger.info(
+            f"Processing {eval_date}: {len(tickers)} tickers, "
+            f"{len(missing)} not in bar store..."
+        )
+        for i in range(0, len(missing), DOWNLOAD_CHUNK):
+            tasks.append((eval_date, missing[i : i + DOWNLOAD_CHUNK]))
+    timings["store lookup"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    written = set()
+    if tasks:
+        with ProcessPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            futures = {
+                pool.submit(download_bars, eval_date, tickers): (eval_date, tickers)
+                for eval_date, tickers in tasks
+            }
+            for future in as_completed(futures):
+                eval_date, tickers = futures[future]
                 try:
-                    if len(tickers_list) > 1:
-                        if row.ticker not in df_bulk.columns.get_level_values(0):
-                            logger.warning(f"Ticker {row.ticker} missing in bulk data.")
-                            continue
-                        ticker_df = df_bulk[row.ticker].copy()
-
-                    else:
-                        # if df doesnt have multiindex
-                        ticker_df = df_bulk.copy()
-
-                    log_returns = (
-                        np.log(
-                            ticker_df["Close"] / ticker_df["Close"].shift(1).dropna()
+                    df_bulk = future.result()
+                    if df_bulk is None:
+                        logger.warning(
+                            f"No data found for {eval_date} (Holiday?). Skipping."
                         )
-                        * 100
-                    )
-                    if log_returns is None or log_returns.size == 0:
                         continue
-
-                    real_var = np.sum(log_returns**2)
-                    real_vol = np.sqrt(real_var)
-
-                    real_vol = (
-                        real_vol.item()
-                        if hasattr(real_vol, "item")
-                        else float(real_vol)
+                    written |= store_bars(eval_date, tickers, df_bulk)
+                except Exception as e:
+                    logger.error(
+                        f"Critical error processing batch for {eval_date}: {e}"
                     )
+    timings["download"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results_to_insert = []
+    for eval_date, tickers in tickers_by_date.items():
+        bars = get_window_bars(eval_date, tickers)
+        results_to_insert += get_errors(
+            preds_by_date[eval_date], get_realized_measures(bars)
+        )
+    timings["compute"] = time.perf_counter() - start
 
-                    error_raw = real_vol - row.prediction
-                    error_abs = abs(error_raw)
-                    error_rel = (error_abs / real_vol) if real_vol != 0 else 0.0
-                    error_sq = error_abs**2
-
-                    results_to_insert.append(
-                        {
-                            "prediction_id": row.id,
-                            "evaluation_date": datetime.now().date(),
-                            "realized_vol": real_vol,
-                            "error_raw": error_raw,
-                            "error_abs": error_abs,
-                            "error_rel": error_rel,
-                            "error_sq": error_sq,
-                        }
-                    )
+    start = time.perf_counter()
+    if results_to_insert:
+        insert_results(results_to_insert)
+        logger.success(f"Saved {len(results_to_insert)} results.")
+    timings["insert"] = time.perf_counter() - start
 
-                except Exception as e:
-                    logger.warning(f"Error calculating RV for {row.ticker}: {e}")
-                    continue
-
-            if results_to_insert:
-                sql_insert = text("""
-                    INSERT INTO garch_performance
-                    (prediction_id, evaluation_date, realized_vol, error_raw, error_abs, error_rel, error_sq)
-                    VALUES
-                    (:prediction_id, :evaluation_date, :realized_vol, :error_raw, :error_abs, :error_rel, :error_sq)
-                """)
-
-                with engine.begin() as conn:
-                    conn.execute(sql_insert, results_to_insert)
-
-                logger.success(
-                    f"Saved {len(results_to_insert)} results for {eval_date}."
-                )
-
-        except Exception as e:
-            logger.error(f"Critical error processing batch for {eval_date}: {e}")
+    start = time.perf_counter()
+    for day in written:
+        try:
+            bar_store.compact(day)
+        except Exception:
+            logger.exception(f"Could not compact bar store of {day}")
+    timings["compact"] = time.perf_counter() - start
+
+    logger.info(
+        f"Evaluated {len(results_to_insert)} predictions over {len(preds_by_date)} "
+        f"dates ({len(tasks)} downloads) in {sum(timings.values()):.1f}s: "
+        + ", ".join(f"{stage} {secs:.2f}s" for stage, secs in timings.items())
+    )
 
 
 if __name__ == "__main__":
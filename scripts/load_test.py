@@ -0,0 +1,528 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timezone
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import requests
+from loguru import logger
+from sqlalchemy import create_engine, make_url, text
+
+# load test of /predict and /report against an API started per setting (or a
+# running one with --url), fed by an offline data source and a local DB
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+CONFIGS = [(1, 1, "skewt"), (4, 4, "skewt")]
+REPORT_DAYS = 10
+STARTUP_TIMEOUT = 120
+REQUEST_TIMEOUT = 120
+# the prime phase resends requests rejected with 503 (fit queue full) after
+# their Retry-After, at most PRIME_RETRIES times
+PRIME_RETRIES = 20
+
+
+def start_embedded_db(root: str):
+    try:
+        from pgserver.postgres_server import get_server
+    except ImportError:
+        logger.error("--db embedded needs the pgserver package (pip install pgserver)")
+        sys.exit(1)
+
+    # SQLite can not stand in, the schema uses partitions and plpgsql
+    return get_server(root, cleanup_mode="delete")
+
+
+def create_database(admin_url: str, name: str) -> str:
+    # a fresh database per API setting, earlier runs leave no stored predictions
+    engine = create_engine(admin_url, isolation_level="AUTOCOMMIT")
+    with engine.connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+        conn.execute(text(f'CREATE DATABASE "{name}"'))
+    engine.dispose()
+    return make_url(admin_url).set(database=name).render_as_string(hide_password=False)
+
+
+def seed_report_data(db_url: str, tickers: list[str]) -> None:
+    # evaluated predictions of the last REPORT_DAYS and their error sums so
+    # /report has data to render, written after the API's startup created
+    # the tables
+    rng = np.random.default_rng(0)
+    configs = [f"{p}_{q}_{dist}" for p, q, dist in CONFIGS]
+    days = pd.bdate_range(end=date.today(), periods=REPORT_DAYS + 1)[:-1].date
+    preds = pd.DataFrame(
+        [(t, d, c) for t in tickers for d in days for c in configs],
+        columns=["ticker", "target_date", "model_config"],
+    )
+    preds["horizon"] = 1
+    preds["prediction"] = rng.uniform(0.5, 3.0, len(preds))
+
+    engine = create_engine(db_url)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "TRUNCATE garch_preds, garch_performance, "
+                "garch_metrics_date, garch_metrics_ticker"
+            )
+        )
+        preds.to_sql("garch_preds", conn, if_exists="append", index=False)
+
+        evaluated = pd.read_sql(
+            text("SELECT id, target_date, prediction FROM garch_preds"), conn
+        )
+        realized = evaluated["prediction"] * rng.lognormal(0, 0.3, len(evaluated))
+        error_raw = realized - evaluated["prediction"]
+        pd.DataFrame(
+            {
+                "prediction_id": evaluated["id"],
+                "target_date": evaluated["target_date"],
+                "evaluation_date": evaluated["target_date"],
+                "realized_vol": realized,
+                "error_raw": error_raw,
+                "error_abs": error_raw.abs(),
+                "error_rel": error_raw.abs() / realized,
+                "error_sq": error_raw**2,
+            }
+        ).to_sql("garch_performance", conn, if_exists="append", index=False)
+
+        # the metrics tables as scripts/evaluate.py keeps them
+        for table, key in [
+            ("garch_metrics_date", "p.target_date"),
+            ("garch_metrics_ticker", "p.ticker"),
+        ]:
+            conn.execute(
+                text(f"""
+                    INSERT INTO {table}
+                    SELECT {key}, p.model_config, COUNT(*), SUM(e.error_raw),
+                        SUM(e.error_abs), SUM(e.error_rel), SUM(e.error_sq)
+                    FROM garch_performance e
+                        JOIN garch_preds p
+                        ON e.prediction_id = p.id
+                        AND e.target_date = p.target_date
+                    GROUP BY {key}, p.model_config
+                """)
+            )
+    engine.dispose()
+
+
+def start_api(port: int, workers: int, env: dict[str, str], log_path: str):
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "src.main:api",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+        ],
+        cwd=API_DIR,
+        env=os.environ | env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+    url = f"http://127.0.0.1:{port}"
+    if wait_ready(url, workers, process):
+        return process, url
+    if process.poll() is not None:
+        raise RuntimeError(f"API exited with {process.returncode}, see {log_path}")
+
+    stop_api(process)
+    raise RuntimeError(f"API did not start within {STARTUP_TIMEOUT}s, see {log_path}")
+
+
+def wait_ready(url: str, workers: int, process: subprocess.Popen | None = None) -> bool:
+    # /health answers while the fit workers still warm up, the API is ready
+    # when the warmup is no longer pending or running. every uvicorn worker
+    # warms up its own pool, a connection reaches any of them, so 2 answers
+    # per worker in a row have to agree
+    settled = 0
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            response = requests.get(f"{url}/health", timeout=5)
+            warmup = response.json().get("startup", {}).get("warmup")
+            ready = response.ok and warmup not in ("enabled", "running")
+        except (requests.RequestException, ValueError):
+            ready = False
+        settled = settled + 1 if ready else 0
+        if settled >= 2 * workers:
+            return True
+        time.sleep(0.1 if ready else 0.5)
+    return False
+
+
+def stop_api(process: subprocess.Popen) -> None:
+    # SIGTERM lets the writer flush its queue
+    process.terminate()
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def get_request(
+    rng: random.Random,
+    tickers: list[str],
+    configs: list[tuple[int, int, str]],
+    report_share: float,
+    refit_share: float,
+) -> tuple[str, str]:
+    if rng.random() < report_share:
+        return "report", "/report"
+
+    p, q, dist = rng.choice(configs)
+    path = f"/predict/{rng.choice(tickers)}?p={p}&q={q}&dist={dist}"
+    if rng.random() < refit_share:
+        path += "&force_refit=true"
+    return "predict", path
+
+
+def run_load(
+    url: str,
+    requests_: list[tuple[str, str]] | None,
+    concurrency: int,
+    duration: float,
+    make_request=None,
+    retries: int = 0,
+) -> tuple[list[tuple[str, int, float]], float]:
+    # `concurrency` clients, each sending its next request when the last one
+    # is answered: a fixed request list split over the clients, or requests
+    # from make_request(rng) until `duration` seconds have passed. a 503 is
+    # sent again after its Retry-After up to `retries` times, the latency
+    # covers all attempts
+    records: list[tuple[str, int, float]] = []
+    retried = 0
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(concurrency + 1)
+    pending = list(requests_ or [])
+
+    def client(i: int) -> None:
+        nonlocal retried
+        rng = random.Random(i)
+        session = requests.Session()
+        own = []
+        start_barrier.wait()
+        deadline = time.monotonic() + duration
+        while True:
+            if requests_ is not None:
+                with lock:
+                    if not pending:
+                        break
+                    endpoint, path = pending.pop()
+            elif time.monotonic() < deadline:
+                endpoint, path = make_request(rng)  # type: ignore
+            else:
+                break
+
+            t0 = time.perf_counter()
+            attempts = 0
+            while True:
+                attempts += 1
+                try:
+                    response = session.get(url + path, timeout=REQUEST_TIMEOUT)
+                except requests.RequestException:
+                    status = 0
+                    break
+                status = response.status_code
+                if status != 503 or attempts > retries:
+                    break
+                with lock:
+                    retried += 1
+                time.sleep(float(response.headers.get("Retry-After") or 1))
+            own.append((endpoint, status, time.perf_counter() - t0))
+
+        session.close()
+        with lock:
+            records.extend(own)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    start_barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if retried:
+        logger.info(f"{retried} requests retried after 503")
+    return records, elapsed
+
+
+def summarize(records: list[tuple[str, int, float]], elapsed: float) -> dict:
+    # 2xx and 304 are successes, 0 is a connection error or timeout
+    summary = {}
+    endpoints = sorted({r[0] for r in records})
+    for endpoint in ["all", *endpoints]:
+        rows = [r for r in records if endpoint in ("all", r[0])]
+        if not rows:
+            continue
+
+        latencies = np.array([r[2] for r in rows]) * 1000
+        statuses: dict[str, int] = {}
+        for _, status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        errors = sum(n for s, n in statuses.items() if s == "0" or int(s) >= 400)
+
+        summary[endpoint] = {
+            "requests": len(rows),
+            "rps": len(rows) / elapsed,
+            "error_rate": errors / len(rows),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+            "statuses": statuses,
+        }
+    return summary
+
+
+def log_summary(name: str, summary: dict) -> None:
+    for endpoint, s in summary.items():
+        logger.info(
+            f"{name} {endpoint}: {s['requests']} requests, {s['rps']:.1f} req/s, "
+            f"p50 {s['p50_ms']:.0f}ms, p95 {s['p95_ms']:.0f}ms, "
+            f"p99 {s['p99_ms']:.0f}ms, errors {s['error_rate']:.1%} {s['statuses']}"
+        )
+
+
+def run_setting(url: str, args, tickers: list[str], configs: list) -> dict:
+    # every (ticker, config) once from cold caches, then the steady-state mix
+    # per concurrency after an unmeasured warmup
+    prime_requests = [
+        ("predict", f"/predict/{t}?p={p}&q={q}&dist={d}")
+        for t in tickers
+        for p, q, d in configs
+    ]
+    if args.report_share > 0:
+        prime_requests.append(("report", "/report"))
+    records, elapsed = run_load(
+        url, prime_requests, max(args.concurrency), 0, retries=PRIME_RETRIES
+    )
+    result: dict = {"prime": summarize(records, elapsed), "runs": {}}
+    log_summary("prime", result["prime"])
+
+    def make_request(rng: random.Random) -> tuple[str, str]:
+        return get_request(rng, tickers, configs, args.report_share, args.refit_share)
+
+    for concurrency in args.concurrency:
+        if args.warmup > 0:
+            run_load(url, None, concurrency, args.warmup, make_request)
+        records, elapsed = run_load(url, None, concurrency, args.duration, make_request)
+        summary = summarize(records, elapsed)
+        log_summary(f"concurrency={concurrency}", summary)
+        result["runs"][str(concurrency)] = summary
+
+    try:
+        result["health"] = requests.get(f"{url}/health", timeout=10).json()
+    except (requests.RequestException, ValueError):
+        result["health"] = None
+    return result
+
+
+def get_tickers(args) -> list[str]:
+    if args.symbols:
+        return [s.upper() for s in args.symbols]
+    if args.data_source == "recorded":
+        # cache files are named after the sanitized symbol
+        names = sorted(
+            f[:-8] for f in os.listdir(args.data_dir) if f.endswith(".parquet")
+        )
+        return names[: args.tickers]
+    return [f"SYN{i:03d}" for i in range(args.tickers)]
+
+
+def parse_config(value: str) -> tuple[int, int, str]:
+    p, q, dist = value.split(",")
+    return int(p), int(q), dist
+
+
+def print_table(results: list[dict]) -> None:
+    print(
+        f"{'workers':>7} {'fit':>4} {'pool':>4} {'conc':>4} {'req/s':>8} "
+        f"{'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'errors':>7}"
+    )
+    for r in results:
+        for concurrency, summary in r["runs"].items():
+            s = summary["all"]
+            print(
+                f"{r['workers'] or '-':>7} {r['fit_workers'] or '-':>4} "
+                f"{r['pool_size'] or '-':>4} {concurrency:>4} {s['rps']:>8.1f} "
+                f"{s['p50_ms']:>8.0f} {s['p95_ms']:>8.0f} {s['p99_ms']:>8.0f} "
+                f"{s['error_rate']:>7.1%}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Offline load test of /predict and /report over API settings"
+    )
+    parser.add_argument("--url", help="load test a running API instead of starting one")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1], help="uvicorn workers to try"
+    )
+    parser.add_argument(
+        "--fit-workers",
+        type=int,
+        nargs="+",
+        default=[0],
+        help="FIT_WORKERS to try (0: default)",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        nargs="+",
+        default=[0],
+        help="DB_POOL_SIZE to try (0: default)",
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=30, help="seconds per run")
+    parser.add_argument(
+        "--warmup", type=float, default=5, help="unmeasured seconds per run"
+    )
+    parser.add_argument("--tickers", type=int, default=50, help="number of tickers")
+    parser.add_argument("--symbols", nargs="+", help="tickers to request instead")
+    parser.add_argument(
+        "--configs",
+        type=parse_config,
+        nargs="+",
+        default=CONFIGS,
+        help="p,q,dist of the requested models (default: 1,1,skewt 4,4,skewt)",
+    )
+    parser.add_argument("--report-share", type=float, default=0.1)
+    parser.add_argument(
+        "--refit-share",
+        type=float,
+        default=0.0,
+        help="share of predictions with force_refit",
+    )
+    parser.add_argument(
+        "--data-source", choices=["synthetic", "recorded"], default="synthetic"
+    )
+    parser.add_argument("--data-dir", help="recorded <ticker>.parquet histories")
+    parser.add_argument(
+        "--fetch-latency", type=float, default=0.0, help="seconds added per download"
+    )
+    parser.add_argument(
+        "--db",
+        default="embedded",
+        help="embedded (local Postgres via pgserver), none, or a Postgres URL",
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--env", nargs="+", default=[], metavar="KEY=VALUE", help="more API settings"
+    )
+    parser.add_argument("--output", default="load_test.json")
+    args = parser.parse_args()
+
+    if args.data_source == "recorded" and not args.data_dir:
+        parser.error("--data-source recorded needs --data-dir")
+
+    tickers = get_tickers(args)
+    if not tickers:
+        logger.error("No tickers to request")
+        sys.exit(1)
+
+    results = []
+    if args.url:
+        url = args.url.rstrip("/")
+        if not wait_ready(url, 1):
+            logger.error(f"API at {url} is not ready")
+            sys.exit(1)
+        result = run_setting(url, args, tickers, args.configs)
+        results.append(
+            {"workers": None, "fit_workers": None, "pool_size": None, **result}
+        )
+    else:
+        # API logs are kept, everything else is removed at the end
+        root = tempfile.mkdtemp(prefix="fvf_load_test_")
+        log_dir = tempfile.mkdtemp(prefix="fvf_load_test_logs_")
+        server, admin_url = None, ""
+        if args.db == "embedded":
+            server = start_embedded_db(os.path.join(root, "pgdata"))
+            admin_url = server.get_uri()
+        elif args.db != "none":
+            admin_url = args.db
+
+        try:
+            settings = list(product(args.workers, args.fit_workers, args.pool_size))
+            for i, (workers, fit_workers, pool_size) in enumerate(settings):
+                name = (
+                    f"workers={workers} fit_workers={fit_workers} pool_size={pool_size}"
+                )
+                logger.info(f"Starting API with {name}")
+
+                # a fresh price cache, spill file and (embedded) database per setting
+                env = {
+                    "DATA_SOURCE": args.data_source,
+                    "DATA_SOURCE_DIR": os.path.abspath(args.data_dir or ""),
+                    "DATA_SOURCE_LATENCY": str(args.fetch_latency),
+                    "PRICE_CACHE_DIR": os.path.join(root, f"price_cache_{i}"),
+                    "PRED_SPILL_PATH": os.path.join(root, f"spill_{i}.jsonl"),
+                    "DB_URL": "",
+                }
+                if args.db == "embedded":
+                    env["DB_URL"] = create_database(admin_url, f"fvf_load_{i}")
+                elif args.db != "none":
+                    env["DB_URL"] = admin_url
+                if fit_workers:
+                    env["FIT_WORKERS"] = str(fit_workers)
+                if pool_size:
+                    env["DB_POOL_SIZE"] = str(pool_size)
+                env |= dict(e.split("=", 1) for e in args.env)
+
+                log_path = os.path.join(log_dir, f"api_{i}.log")
+                process, url = start_api(args.port, workers, env, log_path)
+                try:
+                    if env["DB_URL"] and args.report_share > 0:
+                        seed_report_data(env["DB_URL"], tickers)
+                    result = run_setting(url, args, tickers, args.configs)
+                finally:
+                    stop_api(process)
+
+                results.append(
+                    {
+                        "workers": workers,
+                        "fit_workers": fit_workers,
+                        "pool_size": pool_size,
+                        **result,
+                    }
+                )
+        finally:
+            if server is not None:
+                server.cleanup()
+            shutil.rmtree(root, ignore_errors=True)
+            logger.info(f"API logs in {log_dir}")
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "cpus": os.cpu_count(),
+                "args": vars(args),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    logger.info(f"Wrote results to {args.output}")
+    print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,27 @@
+import argparse
 import os
 import sys
 import time
-from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 
+import numpy as np
 import pandas as pd
 import requests
 from loguru import logger
 
-API_URL = os.getenv("API_URL")
-if not API_URL:
-    logger.error("API_URL environment variable is not set.")
-    sys.exit(1)
-API_ENDPOINT = API_URL + "/predict/{ticker}"
+# fits in-process with the API's services instead of calling /predict. their
+# imports have to follow the path setup (noqa: E402)
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+)
+
+from src.config import BatchItemResult, EngineType, GarchParams  # noqa: E402
+from src.services.database import get_model_config, migrate_schema  # noqa: E402
+from src.services.executor import get_fit_executor, shutdown_fit_executor  # noqa: E402
+from src.services.prediction import run_batch  # noqa: E402
+from src.services.writer import get_pred_writer, shutdown_pred_writer  # noqa: E402
+
+CONFIGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs.txt")
 
 
 def get_nasdaq_100() -> list | None:
@@ -38,46 +47,157 @@ def get_nasdaq_100() -> list | None:
         return None
 
 
-def trigger_ticker(
-    params: dict, ticker: str, retries: int = 3, delay: int = 30
-) -> tuple[bool, str, str | None]:
-    for attempt in range(retries):
-        try:
-            response = requests.get(
-                API_ENDPOINT.format(ticker=ticker), params=params, timeout=30
-            )
-            response.raise_for_status()
-            return True, ticker, None
-        except Exception as e:
-            if attempt < retries - 1:
-                logger.warning(
-                    f"Attempt {attempt + 1} failed for {ticker}: {e}. Retrying in {delay}s..."
-                )
-                time.sleep(delay)
-            else:
-                return False, ticker, str(e)
-
-
-def main(params):
-    tickers = get_nasdaq_100()
+def read_configs(path: str) -> list[GarchParams]:
+    # one p,q,dist per line, blank lines and # comments are skipped
+    configs = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if line:
+                p, q, dist = (v.strip() for v in line.split(","))
+                configs.append(GarchParams(p=int(p), q=int(q), dist=dist))  # type: ignore
+    return configs
+
+
+def run_chunks(
+    tickers: list[str],
+    configs: list[GarchParams],
+    chunk_size: int,
+    engine: EngineType,
+    horizon: int,
+    force_refit: bool,
+) -> tuple[list[BatchItemResult], list[float]]:
+    # every chunk fetches its tickers once and fits all configs on that data
+    results: list[BatchItemResult] = []
+    latencies: list[float] = []
+    for i in range(0, len(tickers), chunk_size):
+        chunk = tickers[i : i + chunk_size]
+        start = time.perf_counter()
+        results.extend(run_batch(chunk, configs, force_refit, engine, horizon))
+        latencies.append(time.perf_counter() - start)
+        logger.info(
+            f"Chunk {i // chunk_size + 1}: {len(chunk)} tickers in {latencies[-1]:.1f}s"
+        )
+
+    return results, latencies
+
+
+def log_summary(
+    results: list[BatchItemResult],
+    latencies: list[float],
+    elapsed: float,
+    fit_stats: dict,
+    write_stats: dict,
+) -> None:
+    ok = [r for r in results if r.error is None]
+    by_config: dict[str, list[int]] = {}
+    for r in results:
+        counts = by_config.setdefault(get_model_config(r.model_params), [0, 0])
+        counts[r.error is not None] += 1
+
+    logger.info(
+        f"Predicted {len(ok)}/{len(results)} (ticker, config) pairs in {elapsed:.1f}s, "
+        f"{len(ok) / elapsed:.2f} predictions/s"
+    )
+    logger.info(
+        f"Chunk latency p50 {np.percentile(latencies, 50):.1f}s, "
+        f"p95 {np.percentile(latencies, 95):.1f}s, max {max(latencies):.1f}s"
+    )
+    for config, (n_ok, n_failed) in by_config.items():
+        logger.info(f"{config}: {n_ok} ok, {n_failed} failed")
+    logger.info(f"Fit pool: {fit_stats}")
+    logger.info(f"Writer: {write_stats}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Predict all Nasdaq-100 components for every configured model"
+    )
+    parser.add_argument(
+        "--configs",
+        default=CONFIGS_PATH,
+        help="file with one p,q,dist per line (default: scripts/configs.txt)",
+    )
+    parser.add_argument(
+        "--tickers", nargs="+", help="tickers to predict (default: Nasdaq-100)"
+    )
+    parser.add_argument("--chunk-size", type=int, default=25)
+    parser.add_argument("--engine", choices=["arch", "vectorized"], default="arch")
+    parser.add_argument("--horizon", type=int, default=1)
+    parser.add_argument("--force-refit", action="store_true")
+    args = parser.parse_args()
+
+    configs = read_configs(args.configs)
+    if not configs:
+        logger.error(f"No model configs in {args.configs}")
+        sys.exit(1)
+
+    tickers = args.tickers or get_nasdaq_100()
     if not tickers:
         sys.exit(1)
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        future_to_ticker = {
-            executor.submit(trigger_ticker, params, t): t for t in tickers
-        }
+    tickers = list(dict.fromkeys(t.upper() for t in tickers))
 
-        for future in future_to_ticker:
-            success, ticker, error = future.result()
+    migrate_schema()
+    logger.info(
+        f"Predicting {len(tickers)} tickers x {len(configs)} configs "
+        f"({', '.join(get_model_config(c) for c in configs)})"
+    )
 
-            if not success:
-                logger.error(f"ERROR {ticker}: {error}")
+    # kept for their stats, shutting down drops the shared instances
+    fit_executor = get_fit_executor()
+    pred_writer = get_pred_writer()
+
+    start = time.perf_counter()
+    try:
+        results, latencies = run_chunks(
+            tickers,
+            configs,
+            args.chunk_size,
+            args.engine,
+            args.horizon,
+            args.force_refit,
+        )
+
+        # one more pass for failed tickers, mostly transient download errors;
+        # pairs predicted in the first pass are served from the cache, no refit
+        failed = list(dict.fromkeys(r.symbol for r in results if r.error is not None))
+        if failed:
+            logger.warning(f"Retrying {len(failed)} failed tickers")
+            retried, retry_latencies = run_chunks(
+                failed,
+                configs,
+                args.chunk_size,
+                args.engine,
+                args.horizon,
+                False,
+            )
+            retried_keys = {
+                (r.symbol, get_model_config(r.model_params)) for r in retried
+            }
+            results = [
+                r
+                for r in results
+                if (r.symbol, get_model_config(r.model_params)) not in retried_keys
+            ] + retried
+            latencies += retry_latencies
+    finally:
+        # drains the write queue, all predictions are stored before exiting
+        shutdown_pred_writer()
+        shutdown_fit_executor()
+
+    elapsed = time.perf_counter() - start
+    for r in results:
+        if r.error is not None:
+            logger.error(
+                f"ERROR {r.symbol} {get_model_config(r.model_params)}: {r.error}"
+            )
+
+    log_summary(results, latencies, elapsed, fit_executor.stats(), pred_writer.stats())
+    if not any(r.error is None for r in results):
+        sys.exit(1)
 
     logger.info("Succesfully finished predicting Nasdaq-100")
 
 
 if __name__ == "__main__":
-    params1 = {"p": 1, "q": 1, "dist": "skewt"}
-    params4 = {"p": 4, "q": 4, "dist": "skewt"}
-    main(params1)
-    main(params4)
+    main()
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# realized measures of all tickers at once from a wide bar frame, columns
+# (ticker, field) with fields Open/High/Low/Close and a shared time index;
+# everything in percent (x100 log returns) and returned as volatilities
+SUBSAMPLE_STEP = 3
+MEASURES = [
+    "realized_vol",
+    "realized_bv",
+    "realized_pk",
+    "realized_gk",
+    "realized_rv_sub",
+]
+
+
+def get_realized_measures(bars: pd.DataFrame) -> pd.DataFrame:
+    # one row per ticker, tickers without any return are dropped. bars of a
+    # ticker may be missing (gaps, half days, tickers not traded at some
+    # time), a return always spans from the ticker's previous bar
+    fields = {f: _field(bars, f) for f in ["Open", "High", "Low", "Close"]}
+    log_close = np.log(fields["Close"]) * 100
+    last_close = log_close.ffill()
+    returns = log_close - last_close.shift(1)
+    n_returns = returns.count()
+
+    measures = pd.DataFrame(
+        {
+            "realized_vol": np.sqrt((returns**2).sum()),
+            "realized_bv": np.sqrt(_bipower_variation(returns, n_returns)),
+            "realized_pk": np.sqrt(_parkinson(fields)),
+            "realized_gk": np.sqrt(_garman_klass(fields)),
+            "realized_rv_sub": np.sqrt(_subsampled_rv(last_close)),
+        }
+    )
+    return measures[n_returns > 0]
+
+
+def _field(bars: pd.DataFrame, field: str) -> pd.DataFrame:
+    # one consolidated block, the per-ticker columns of a concatenated bar
+    # frame are separate blocks and slow every operation down
+    values = bars.xs(field, axis=1, level=1)
+    array = values.to_numpy(dtype=float, copy=True)
+    # non-positive prices are bad ticks, not bars
+    array[~(array > 0)] = np.nan
+    return pd.DataFrame(array, index=values.index, columns=values.columns)
+
+
+def _bipower_variation(returns: pd.DataFrame, n_returns: pd.Series) -> pd.Series:
+    # pi/2 * sum |r_t| |r_t-1| over consecutive returns of a ticker, robust
+    # to jumps, with the n / (n - 1) small sample correction
+    abs_returns = returns.abs()
+    prev_abs = abs_returns.ffill().shift(1).where(abs_returns.notna())
+    bv = np.pi / 2 * (abs_returns * prev_abs).sum()
+    return (bv * n_returns / (n_returns - 1)).where(n_returns > 1)
+
+
+def _parkinson(fields: dict[str, pd.DataFrame]) -> pd.Series:
+    # high-low range of each bar, covers the intraday ranges only
+    log_hl = np.log(fields["High"] / fields["Low"]) * 100
+    return (log_hl**2).sum() / (4 * np.log(2))
+
+
+def _garman_klass(fields: dict[str, pd.DataFrame]) -> pd.Series:
+    log_hl = np.log(fields["High"] / fields["Low"]) * 100
+    log_co = np.log(fields["Close"] / fields["Open"]) * 100
+    # a bar's term is >= 0 unless its close/open lies outside high/low
+    gk = 0.5 * log_hl**2 - (2 * np.log(2) - 1) * log_co**2
+    return gk.clip(lower=0).sum()
+
+
+def _subsampled_rv(last_close: pd.DataFrame) -> pd.Series:
+    # average of the realized variances on the SUBSAMPLE_STEP offset grids of
+    # SUBSAMPLE_STEP-bar returns, less sensitive to microstructure noise
+    rvs = [
+        (last_close.iloc[offset::SUBSAMPLE_STEP].diff() ** 2).sum()
+        for offset in range(SUBSAMPLE_STEP)
+    ]
+    return sum(rvs) / SUBSAMPLE_STEP